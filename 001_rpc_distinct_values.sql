@@ -0,0 +1,25 @@
+
+-- Valeurs distinctes d'une colonne : options des filtres latéraux (filter_pushdown.py)
+-- SECURITY INVOKER : la RLS de l'utilisateur connecté s'applique
+CREATE OR REPLACE FUNCTION public.distinct_values(p_table text, p_column text)
+RETURNS SETOF text
+LANGUAGE plpgsql
+STABLE
+SECURITY INVOKER
+AS $$
+BEGIN
+  IF p_table NOT IN ('lots', 'controle_qualite', 'conditionnement', 'expedition') THEN
+    RAISE EXCEPTION 'Table non autorisée : %', p_table;
+  END IF;
+  RETURN QUERY EXECUTE format(
+    'SELECT DISTINCT %I::text FROM public.%I WHERE %I IS NOT NULL ORDER BY 1',
+    p_column, p_table, p_column
+  );
+END;
+$$;
+
+-- Index des colonnes filtrées côté serveur (période, filiale, type)
+CREATE INDEX IF NOT EXISTS idx_lots_date_enregistrement ON public.lots (date_enregistrement);
+CREATE INDEX IF NOT EXISTS idx_controle_qualite_date_controle ON public.controle_qualite (date_controle);
+CREATE INDEX IF NOT EXISTS idx_controle_qualite_lot_id ON public.controle_qualite (lot_id);
+CREATE INDEX IF NOT EXISTS idx_conditionnement_date ON public.conditionnement (date_conditionnement);
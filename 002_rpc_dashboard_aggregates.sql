@@ -0,0 +1,131 @@
+
+-- Agrégats du tableau de bord (Accueil) : chaque widget télécharge quelques
+-- dizaines de lignes au lieu de l'historique complet (voir aggregates.py).
+-- Paramètre NULL = pas de filtre. Équivalents SQLite dans aggregates.py.
+
+-- ===== Lots (filtre : trimestres 1..4) =====
+CREATE OR REPLACE FUNCTION public.kpi_lots_totaux(p_trimestres int[] DEFAULT NULL)
+RETURNS TABLE (nb_lots bigint, total_cartes bigint, lots_avec_pin bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT count(*), coalesce(sum(l.quantite), 0), count(*) FILTER (WHERE l.impression_pin = 'Oui')
+  FROM public.lots l
+  WHERE p_trimestres IS NULL OR extract(quarter FROM l.date_enregistrement::date)::int = ANY (p_trimestres)
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_lots_par_type(p_trimestres int[] DEFAULT NULL)
+RETURNS TABLE (type_lot text, quantite bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT l.type_lot, coalesce(sum(l.quantite), 0)
+  FROM public.lots l
+  WHERE p_trimestres IS NULL OR extract(quarter FROM l.date_enregistrement::date)::int = ANY (p_trimestres)
+  GROUP BY l.type_lot
+  ORDER BY l.type_lot
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_lots_par_mois(p_trimestres int[] DEFAULT NULL)
+RETURNS TABLE (annee int, mois int, quantite bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT extract(year FROM l.date_enregistrement::date)::int,
+         extract(month FROM l.date_enregistrement::date)::int,
+         coalesce(sum(l.quantite), 0)
+  FROM public.lots l
+  WHERE l.date_enregistrement IS NOT NULL
+    AND (p_trimestres IS NULL OR extract(quarter FROM l.date_enregistrement::date)::int = ANY (p_trimestres))
+  GROUP BY 1, 2
+  ORDER BY 1, 2
+$$;
+
+-- ===== Contrôle qualité (filtres : période, filiales, types de carte, jours ISO 1..7) =====
+CREATE OR REPLACE FUNCTION public.kpi_controle_filtre(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS TABLE (date_controle date, filiale text, type_carte text, quantite int,
+               quantite_a_tester int, resultat text)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT c.date_controle::date, l.filiale, c.type_carte, c.quantite, c.quantite_a_tester, c.resultat
+  FROM public.controle_qualite c
+  LEFT JOIN public.lots l ON l.id = c.lot_id
+  WHERE (p_debut IS NULL OR c.date_controle::date >= p_debut)
+    AND (p_fin IS NULL OR c.date_controle::date <= p_fin)
+    AND (p_filiales IS NULL OR l.filiale = ANY (p_filiales))
+    AND (p_types IS NULL OR c.type_carte = ANY (p_types))
+    AND (p_jours IS NULL OR extract(isodow FROM c.date_controle::date)::int = ANY (p_jours))
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_controle_totaux(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS TABLE (nb_tests bigint, quantite bigint, quantite_a_tester bigint,
+               nb_reussites bigint, nb_echecs bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT count(*), coalesce(sum(f.quantite), 0), coalesce(sum(f.quantite_a_tester), 0),
+         count(*) FILTER (WHERE f.resultat = 'Réussite'), count(*) FILTER (WHERE f.resultat = 'Échec')
+  FROM public.kpi_controle_filtre(p_debut, p_fin, p_filiales, p_types, p_jours) f
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_controle_par_filiale_type(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS TABLE (filiale text, type_carte text, nb_tests bigint, quantite bigint, quantite_a_tester bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT f.filiale, f.type_carte, count(*), coalesce(sum(f.quantite), 0), coalesce(sum(f.quantite_a_tester), 0)
+  FROM public.kpi_controle_filtre(p_debut, p_fin, p_filiales, p_types, p_jours) f
+  GROUP BY f.filiale, f.type_carte
+  ORDER BY f.filiale, f.type_carte
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_controle_par_mois(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS TABLE (mois text, quantite_a_tester bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT to_char(f.date_controle, 'YYYY-MM'), coalesce(sum(f.quantite_a_tester), 0)
+  FROM public.kpi_controle_filtre(p_debut, p_fin, p_filiales, p_types, p_jours) f
+  WHERE f.date_controle IS NOT NULL
+  GROUP BY 1
+  ORDER BY 1
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_controle_par_semaine(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS TABLE (lundi date, quantite_a_tester bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT date_trunc('week', f.date_controle)::date, coalesce(sum(f.quantite_a_tester), 0)
+  FROM public.kpi_controle_filtre(p_debut, p_fin, p_filiales, p_types, p_jours) f
+  WHERE f.date_controle IS NOT NULL
+  GROUP BY 1
+  ORDER BY 1
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_controle_par_jour_semaine(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS TABLE (jour int, quantite_a_tester bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT extract(isodow FROM f.date_controle)::int, coalesce(sum(f.quantite_a_tester), 0)
+  FROM public.kpi_controle_filtre(p_debut, p_fin, p_filiales, p_types, p_jours) f
+  WHERE f.date_controle IS NOT NULL
+  GROUP BY 1
+  ORDER BY 1
+$$;
+
+-- ===== Expéditions =====
+CREATE OR REPLACE FUNCTION public.kpi_expeditions()
+RETURNS TABLE (agence text, pays text, statut text, nb bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT e.agence, e.pays, e.statut, count(*)
+  FROM public.expedition e
+  GROUP BY e.agence, e.pays, e.statut
+  ORDER BY e.agence, e.pays, e.statut
+$$;
@@ -0,0 +1,266 @@
+
+-- Tables de cumuls quotidiens, tenues à jour par triggers à chaque écriture.
+-- Les fonctions kpi_* de l'Accueil (002) sont redéfinies pour les lire :
+-- leur coût dépend du nombre de jours, plus du nombre de lignes.
+-- Une filiale ou une date absente est stockée '' / ignorée (clé primaire non nulle).
+
+-- ===== Tables =====
+CREATE TABLE IF NOT EXISTS public.rollup_lots_jour (
+  jour date NOT NULL,
+  filiale text NOT NULL DEFAULT '',
+  type_lot text NOT NULL DEFAULT '',
+  nb_lots bigint NOT NULL DEFAULT 0,
+  quantite bigint NOT NULL DEFAULT 0,
+  lots_avec_pin bigint NOT NULL DEFAULT 0,
+  PRIMARY KEY (jour, filiale, type_lot)
+);
+
+CREATE TABLE IF NOT EXISTS public.rollup_controle_jour (
+  jour date NOT NULL,
+  filiale text NOT NULL DEFAULT '',
+  type_carte text NOT NULL DEFAULT '',
+  resultat text NOT NULL DEFAULT '',
+  nb_tests bigint NOT NULL DEFAULT 0,
+  quantite bigint NOT NULL DEFAULT 0,
+  quantite_a_tester bigint NOT NULL DEFAULT 0,
+  PRIMARY KEY (jour, filiale, type_carte, resultat)
+);
+
+ALTER TABLE public.rollup_lots_jour ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.rollup_controle_jour ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS rollup_lots_lecture ON public.rollup_lots_jour;
+CREATE POLICY rollup_lots_lecture ON public.rollup_lots_jour FOR SELECT TO authenticated USING (true);
+DROP POLICY IF EXISTS rollup_controle_lecture ON public.rollup_controle_jour;
+CREATE POLICY rollup_controle_lecture ON public.rollup_controle_jour FOR SELECT TO authenticated USING (true);
+
+-- ===== Ajustements (signe = +1 ajout, -1 retrait) =====
+CREATE OR REPLACE FUNCTION public.rollup_lots_ajuster(
+  p_jour date, p_filiale text, p_type_lot text, p_signe int, p_quantite int, p_pin text)
+RETURNS void
+LANGUAGE plpgsql SECURITY DEFINER
+AS $$
+BEGIN
+  IF p_jour IS NULL THEN RETURN; END IF;
+  INSERT INTO public.rollup_lots_jour AS r (jour, filiale, type_lot, nb_lots, quantite, lots_avec_pin)
+  VALUES (p_jour, coalesce(p_filiale, ''), coalesce(p_type_lot, ''), p_signe,
+          p_signe * coalesce(p_quantite, 0), CASE WHEN p_pin = 'Oui' THEN p_signe ELSE 0 END)
+  ON CONFLICT (jour, filiale, type_lot) DO UPDATE
+    SET nb_lots = r.nb_lots + excluded.nb_lots,
+        quantite = r.quantite + excluded.quantite,
+        lots_avec_pin = r.lots_avec_pin + excluded.lots_avec_pin;
+  DELETE FROM public.rollup_lots_jour
+  WHERE jour = p_jour AND filiale = coalesce(p_filiale, '') AND type_lot = coalesce(p_type_lot, '') AND nb_lots <= 0;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.rollup_controle_ajuster(
+  p_jour date, p_filiale text, p_type_carte text, p_resultat text, p_signe int,
+  p_quantite int, p_quantite_a_tester int)
+RETURNS void
+LANGUAGE plpgsql SECURITY DEFINER
+AS $$
+BEGIN
+  IF p_jour IS NULL THEN RETURN; END IF;
+  INSERT INTO public.rollup_controle_jour AS r
+    (jour, filiale, type_carte, resultat, nb_tests, quantite, quantite_a_tester)
+  VALUES (p_jour, coalesce(p_filiale, ''), coalesce(p_type_carte, ''), coalesce(p_resultat, ''), p_signe,
+          p_signe * coalesce(p_quantite, 0), p_signe * coalesce(p_quantite_a_tester, 0))
+  ON CONFLICT (jour, filiale, type_carte, resultat) DO UPDATE
+    SET nb_tests = r.nb_tests + excluded.nb_tests,
+        quantite = r.quantite + excluded.quantite,
+        quantite_a_tester = r.quantite_a_tester + excluded.quantite_a_tester;
+  DELETE FROM public.rollup_controle_jour
+  WHERE jour = p_jour AND filiale = coalesce(p_filiale, '') AND type_carte = coalesce(p_type_carte, '')
+    AND resultat = coalesce(p_resultat, '') AND nb_tests <= 0;
+END;
+$$;
+
+-- ===== Triggers =====
+CREATE OR REPLACE FUNCTION public.rollup_lots_trigger()
+RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER
+AS $$
+DECLARE
+  c record;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.rollup_lots_ajuster(OLD.date_enregistrement::date, OLD.filiale, OLD.type_lot, -1, OLD.quantite, OLD.impression_pin);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM public.rollup_lots_ajuster(NEW.date_enregistrement::date, NEW.filiale, NEW.type_lot, 1, NEW.quantite, NEW.impression_pin);
+  END IF;
+
+  -- La filiale des contrôles vient du lot : on déplace leurs cumuls si elle change
+  IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.filiale IS DISTINCT FROM OLD.filiale) THEN
+    FOR c IN
+      SELECT date_controle::date AS jour, type_carte, resultat, quantite, quantite_a_tester
+      FROM public.controle_qualite WHERE lot_id = OLD.id
+    LOOP
+      PERFORM public.rollup_controle_ajuster(c.jour, OLD.filiale, c.type_carte, c.resultat, -1, c.quantite, c.quantite_a_tester);
+      PERFORM public.rollup_controle_ajuster(c.jour, CASE WHEN TG_OP = 'DELETE' THEN NULL ELSE NEW.filiale END,
+                                             c.type_carte, c.resultat, 1, c.quantite, c.quantite_a_tester);
+    END LOOP;
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.rollup_controle_trigger()
+RETURNS trigger
+LANGUAGE plpgsql SECURITY DEFINER
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.rollup_controle_ajuster(
+      OLD.date_controle::date, (SELECT filiale FROM public.lots WHERE id = OLD.lot_id),
+      OLD.type_carte, OLD.resultat, -1, OLD.quantite, OLD.quantite_a_tester);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') THEN
+    PERFORM public.rollup_controle_ajuster(
+      NEW.date_controle::date, (SELECT filiale FROM public.lots WHERE id = NEW.lot_id),
+      NEW.type_carte, NEW.resultat, 1, NEW.quantite, NEW.quantite_a_tester);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_rollup_lots ON public.lots;
+CREATE TRIGGER trg_rollup_lots
+AFTER INSERT OR UPDATE OR DELETE ON public.lots
+FOR EACH ROW EXECUTE FUNCTION public.rollup_lots_trigger();
+
+DROP TRIGGER IF EXISTS trg_rollup_controle ON public.controle_qualite;
+CREATE TRIGGER trg_rollup_controle
+AFTER INSERT OR UPDATE OR DELETE ON public.controle_qualite
+FOR EACH ROW EXECUTE FUNCTION public.rollup_controle_trigger();
+
+-- ===== Reconstruction complète (initialisation, contrôle de cohérence) =====
+CREATE OR REPLACE FUNCTION public.rollups_reconstruire()
+RETURNS void
+LANGUAGE sql SECURITY DEFINER
+AS $$
+  TRUNCATE public.rollup_lots_jour, public.rollup_controle_jour;
+  INSERT INTO public.rollup_lots_jour (jour, filiale, type_lot, nb_lots, quantite, lots_avec_pin)
+  SELECT l.date_enregistrement::date, coalesce(l.filiale, ''), coalesce(l.type_lot, ''),
+         count(*), coalesce(sum(l.quantite), 0), count(*) FILTER (WHERE l.impression_pin = 'Oui')
+  FROM public.lots l WHERE l.date_enregistrement IS NOT NULL
+  GROUP BY 1, 2, 3;
+  INSERT INTO public.rollup_controle_jour (jour, filiale, type_carte, resultat, nb_tests, quantite, quantite_a_tester)
+  SELECT c.date_controle::date, coalesce(l.filiale, ''), coalesce(c.type_carte, ''), coalesce(c.resultat, ''),
+         count(*), coalesce(sum(c.quantite), 0), coalesce(sum(c.quantite_a_tester), 0)
+  FROM public.controle_qualite c LEFT JOIN public.lots l ON l.id = c.lot_id
+  WHERE c.date_controle IS NOT NULL
+  GROUP BY 1, 2, 3, 4;
+$$;
+
+SELECT public.rollups_reconstruire();
+
+-- ===== Fonctions du tableau de bord relues sur les cumuls =====
+CREATE OR REPLACE FUNCTION public.kpi_lots_totaux(p_trimestres int[] DEFAULT NULL)
+RETURNS TABLE (nb_lots bigint, total_cartes bigint, lots_avec_pin bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT coalesce(sum(r.nb_lots), 0)::bigint, coalesce(sum(r.quantite), 0)::bigint, coalesce(sum(r.lots_avec_pin), 0)::bigint
+  FROM public.rollup_lots_jour r
+  WHERE p_trimestres IS NULL OR extract(quarter FROM r.jour)::int = ANY (p_trimestres)
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_lots_par_type(p_trimestres int[] DEFAULT NULL)
+RETURNS TABLE (type_lot text, quantite bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT nullif(r.type_lot, ''), sum(r.quantite)::bigint
+  FROM public.rollup_lots_jour r
+  WHERE p_trimestres IS NULL OR extract(quarter FROM r.jour)::int = ANY (p_trimestres)
+  GROUP BY r.type_lot
+  ORDER BY r.type_lot
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_lots_par_mois(p_trimestres int[] DEFAULT NULL)
+RETURNS TABLE (annee int, mois int, quantite bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT extract(year FROM r.jour)::int, extract(month FROM r.jour)::int, sum(r.quantite)::bigint
+  FROM public.rollup_lots_jour r
+  WHERE p_trimestres IS NULL OR extract(quarter FROM r.jour)::int = ANY (p_trimestres)
+  GROUP BY 1, 2
+  ORDER BY 1, 2
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_controle_cumuls(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS SETOF public.rollup_controle_jour
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT r.*
+  FROM public.rollup_controle_jour r
+  WHERE (p_debut IS NULL OR r.jour >= p_debut)
+    AND (p_fin IS NULL OR r.jour <= p_fin)
+    AND (p_filiales IS NULL OR r.filiale = ANY (p_filiales))
+    AND (p_types IS NULL OR r.type_carte = ANY (p_types))
+    AND (p_jours IS NULL OR extract(isodow FROM r.jour)::int = ANY (p_jours))
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_controle_totaux(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS TABLE (nb_tests bigint, quantite bigint, quantite_a_tester bigint,
+               nb_reussites bigint, nb_echecs bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT coalesce(sum(f.nb_tests), 0)::bigint, coalesce(sum(f.quantite), 0)::bigint,
+         coalesce(sum(f.quantite_a_tester), 0)::bigint,
+         coalesce(sum(f.nb_tests) FILTER (WHERE f.resultat = 'Réussite'), 0)::bigint,
+         coalesce(sum(f.nb_tests) FILTER (WHERE f.resultat = 'Échec'), 0)::bigint
+  FROM public.kpi_controle_cumuls(p_debut, p_fin, p_filiales, p_types, p_jours) f
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_controle_par_filiale_type(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS TABLE (filiale text, type_carte text, nb_tests bigint, quantite bigint, quantite_a_tester bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT nullif(f.filiale, ''), nullif(f.type_carte, ''), sum(f.nb_tests)::bigint,
+         sum(f.quantite)::bigint, sum(f.quantite_a_tester)::bigint
+  FROM public.kpi_controle_cumuls(p_debut, p_fin, p_filiales, p_types, p_jours) f
+  GROUP BY f.filiale, f.type_carte
+  ORDER BY f.filiale, f.type_carte
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_controle_par_mois(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS TABLE (mois text, quantite_a_tester bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT to_char(f.jour, 'YYYY-MM'), sum(f.quantite_a_tester)::bigint
+  FROM public.kpi_controle_cumuls(p_debut, p_fin, p_filiales, p_types, p_jours) f
+  GROUP BY 1
+  ORDER BY 1
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_controle_par_semaine(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS TABLE (lundi date, quantite_a_tester bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT date_trunc('week', f.jour)::date, sum(f.quantite_a_tester)::bigint
+  FROM public.kpi_controle_cumuls(p_debut, p_fin, p_filiales, p_types, p_jours) f
+  GROUP BY 1
+  ORDER BY 1
+$$;
+
+CREATE OR REPLACE FUNCTION public.kpi_controle_par_jour_semaine(
+  p_debut date DEFAULT NULL, p_fin date DEFAULT NULL,
+  p_filiales text[] DEFAULT NULL, p_types text[] DEFAULT NULL, p_jours int[] DEFAULT NULL)
+RETURNS TABLE (jour int, quantite_a_tester bigint)
+LANGUAGE sql STABLE SECURITY INVOKER
+AS $$
+  SELECT extract(isodow FROM f.jour)::int, sum(f.quantite_a_tester)::bigint
+  FROM public.kpi_controle_cumuls(p_debut, p_fin, p_filiales, p_types, p_jours) f
+  GROUP BY 1
+  ORDER BY 1
+$$;
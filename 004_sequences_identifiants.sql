@@ -0,0 +1,36 @@
+-- Identifiants attribués par la base (séquences) au lieu de "SELECT max(id) + 1" :
+-- une insertion = un aller-retour, sans collision entre opérateurs simultanés.
+-- Les colonnes déjà en IDENTITY / serial gardent leur séquence existante.
+DO $$
+DECLARE
+  t text;
+  seq text;
+BEGIN
+  FOREACH t IN ARRAY ARRAY['lots', 'controle_qualite', 'conditionnement', 'expedition', 'livreurs'] LOOP
+    seq := pg_get_serial_sequence('public.' || t, 'id');
+    IF seq IS NULL THEN
+      seq := format('public.%I', t || '_id_seq');
+      EXECUTE format('CREATE SEQUENCE IF NOT EXISTS %s OWNED BY public.%I.id', seq, t);
+      EXECUTE format('ALTER TABLE public.%I ALTER COLUMN id SET DEFAULT nextval(%L)', t, seq);
+    END IF;
+    -- Repart après le plus grand id déjà attribué
+    EXECUTE format('SELECT setval(%L, greatest((SELECT coalesce(max(id), 0) FROM public.%I), 1))', seq, t);
+  END LOOP;
+END;
+$$;
+
+-- Réservation d'un bloc d'identifiants (insertions par lots préparées côté application)
+CREATE OR REPLACE FUNCTION public.reserver_ids(p_table text, p_nombre int)
+RETURNS SETOF bigint
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+  IF p_table NOT IN ('lots', 'controle_qualite', 'conditionnement', 'expedition', 'livreurs') THEN
+    RAISE EXCEPTION 'Table non autorisée : %', p_table;
+  END IF;
+  RETURN QUERY
+    SELECT nextval(pg_get_serial_sequence('public.' || p_table, 'id'))
+    FROM generate_series(1, greatest(p_nombre, 1));
+END;
+$$;
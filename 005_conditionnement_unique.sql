@@ -0,0 +1,35 @@
+-- Un conditionnement est unique par (nom_lot, date_conditionnement, type_emballage, filiale) :
+-- l'enregistrement envoie un seul upsert "ignore les doublons" au lieu d'une vérification par paquet.
+
+-- Doublons existants : on garde la première saisie. Les suivantes peuvent différer (packs,
+-- nombre_cartes, remarque) : elles sont d'abord copiées dans conditionnement_doublons_005,
+-- avec l'id de la ligne gardée, pour être revues avant suppression définitive.
+CREATE TABLE IF NOT EXISTS public.conditionnement_doublons_005 (
+  LIKE public.conditionnement,
+  id_garde bigint,
+  archive_le timestamptz NOT NULL DEFAULT now()
+);
+
+INSERT INTO public.conditionnement_doublons_005
+SELECT c.*, k.id_garde, now()
+FROM public.conditionnement c
+JOIN LATERAL (
+  SELECT min(d.id) AS id_garde
+  FROM public.conditionnement d
+  WHERE d.nom_lot = c.nom_lot
+    AND d.date_conditionnement = c.date_conditionnement
+    AND d.type_emballage = c.type_emballage
+    AND d.filiale = c.filiale
+) k ON c.id > k.id_garde;
+
+DELETE FROM public.conditionnement c
+USING public.conditionnement d
+WHERE c.nom_lot = d.nom_lot
+  AND c.date_conditionnement = d.date_conditionnement
+  AND c.type_emballage = d.type_emballage
+  AND c.filiale = d.filiale
+  AND c.id > d.id;
+
+ALTER TABLE public.conditionnement
+  ADD CONSTRAINT conditionnement_unique_paquet
+  UNIQUE (nom_lot, date_conditionnement, type_emballage, filiale);
@@ -0,0 +1,19 @@
+-- Rejeu idempotent de la file d'écritures locale (write_queue.py) :
+-- chaque ligne mise en file porte une clé unique, un second envoi ne crée rien.
+ALTER TABLE public.expedition ADD COLUMN IF NOT EXISTS cle_idempotence text;
+CREATE UNIQUE INDEX IF NOT EXISTS expedition_cle_idempotence_key
+  ON public.expedition (cle_idempotence);
+
+-- Une expédition par lot (règle du formulaire) : un doublon saisi hors ligne
+-- remonte en conflit au rejeu au lieu de passer silencieusement
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM public.expedition GROUP BY lot_id HAVING count(*) > 1
+  ) THEN
+    CREATE UNIQUE INDEX IF NOT EXISTS expedition_lot_unique ON public.expedition (lot_id);
+  ELSE
+    RAISE NOTICE 'expedition_lot_unique non créé : des lots ont plusieurs expéditions';
+  END IF;
+END;
+$$;
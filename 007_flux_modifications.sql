@@ -0,0 +1,21 @@
+-- Flux de modifications (change_feed.py) : Supabase Realtime diffuse les
+-- insertions, modifications et suppressions des tables de la publication.
+-- Les suppressions ne portent que la clé primaire (REPLICA IDENTITY par défaut),
+-- ce qui suffit pour retirer la ligne des caches.
+DO $$
+DECLARE
+  t text;
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_publication WHERE pubname = 'supabase_realtime') THEN
+    CREATE PUBLICATION supabase_realtime;
+  END IF;
+  FOREACH t IN ARRAY ARRAY['lots', 'controle_qualite', 'conditionnement', 'expedition'] LOOP
+    IF NOT EXISTS (
+      SELECT 1 FROM pg_publication_tables
+      WHERE pubname = 'supabase_realtime' AND schemaname = 'public' AND tablename = t
+    ) THEN
+      EXECUTE format('ALTER PUBLICATION supabase_realtime ADD TABLE public.%I', t);
+    END IF;
+  END LOOP;
+END;
+$$;
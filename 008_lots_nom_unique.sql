@@ -0,0 +1,19 @@
+-- Un nom de lot est unique : l'import en masse (lot_import.py) écarte les doublons d'après le miroir
+-- local, la contrainte refuse ceux qu'un miroir en retard laisserait passer.
+
+-- Doublons existants : aucune correction automatique (les lots sont référencés, dont conditionnement
+-- par nom_lot) ; la migration s'arrête tant qu'ils n'ont pas été résolus à la main. Pour les lister :
+--   SELECT nom_lot, array_agg(id ORDER BY id) FROM public.lots GROUP BY nom_lot HAVING count(*) > 1;
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM public.lots GROUP BY nom_lot HAVING count(*) > 1
+  ) THEN
+    RAISE EXCEPTION 'lots_nom_lot_unique non créé : des noms de lot sont en double, à résoudre avant la migration';
+  END IF;
+END;
+$$;
+
+ALTER TABLE public.lots
+  ADD CONSTRAINT lots_nom_lot_unique
+  UNIQUE (nom_lot);
@@ -0,0 +1,209 @@
+"""
+Agrégats du tableau de bord calculés côté base.
+
+Chaque widget de l'Accueil appelle une fonction SQL (002_rpc_dashboard_aggregates.sql)
+qui renvoie quelques dizaines de lignes déjà agrégées au lieu de l'historique
+complet de lots / controle_qualite. Ces fonctions lisent les cumuls quotidiens
+(003_rollups_quotidiens.sql) ; les mêmes requêtes existent en dialecte SQLite
+pour la base locale erp_lots (tests, hors ligne, cumuls de rollups.py).
+
+Paramètres communs (None = pas de filtre) :
+- lots : p_trimestres (liste d'entiers 1..4)
+- contrôle : p_debut, p_fin (dates), p_filiales, p_types (listes), p_jours (jours ISO 1..7)
+"""
+import json
+import sqlite3
+from datetime import date
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+
+import change_feed
+import data_access
+import rollups
+
+# Tables lues par chaque fonction : une écriture sur l'une d'elles invalide le cache
+AGGREGATE_TABLES: Dict[str, Tuple[str, ...]] = {
+    "kpi_lots_totaux": ("lots",),
+    "kpi_lots_par_type": ("lots",),
+    "kpi_lots_par_mois": ("lots",),
+    "kpi_controle_totaux": ("controle_qualite", "lots"),
+    "kpi_controle_par_filiale_type": ("controle_qualite", "lots"),
+    "kpi_controle_par_mois": ("controle_qualite", "lots"),
+    "kpi_controle_par_semaine": ("controle_qualite", "lots"),
+    "kpi_controle_par_jour_semaine": ("controle_qualite", "lots"),
+    "kpi_expeditions": ("expedition",),
+}
+
+# Colonnes renvoyées (un résultat vide garde ses colonnes pour les groupby des pages)
+AGGREGATE_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "kpi_lots_totaux": ("nb_lots", "total_cartes", "lots_avec_pin"),
+    "kpi_lots_par_type": ("type_lot", "quantite"),
+    "kpi_lots_par_mois": ("annee", "mois", "quantite"),
+    "kpi_controle_totaux": ("nb_tests", "quantite", "quantite_a_tester", "nb_reussites", "nb_echecs"),
+    "kpi_controle_par_filiale_type": ("filiale", "type_carte", "nb_tests", "quantite", "quantite_a_tester"),
+    "kpi_controle_par_mois": ("mois", "quantite_a_tester"),
+    "kpi_controle_par_semaine": ("lundi", "quantite_a_tester"),
+    "kpi_controle_par_jour_semaine": ("jour", "quantite_a_tester"),
+    "kpi_expeditions": ("agence", "pays", "statut", "nb"),
+}
+
+# --- Équivalents SQLite (base locale erp_lots, cumuls quotidiens de rollups.py) ---
+_SQLITE_LOTS_FILTRE = """
+    (:p_trimestres IS NULL
+     OR (CAST(strftime('%m', r.jour) AS INTEGER) + 2) / 3 IN (SELECT value FROM json_each(:p_trimestres)))
+"""
+_SQLITE_CONTROLE_CUMULS = """
+    SELECT r.* FROM rollup_controle_jour r
+    WHERE (:p_debut IS NULL OR r.jour >= :p_debut)
+      AND (:p_fin IS NULL OR r.jour <= :p_fin)
+      AND (:p_filiales IS NULL OR r.filiale IN (SELECT value FROM json_each(:p_filiales)))
+      AND (:p_types IS NULL OR r.type_carte IN (SELECT value FROM json_each(:p_types)))
+      AND (:p_jours IS NULL
+           OR (CAST(strftime('%w', r.jour) AS INTEGER) + 6) % 7 + 1 IN (SELECT value FROM json_each(:p_jours)))
+"""
+
+SQLITE_QUERIES: Dict[str, str] = {
+    "kpi_lots_totaux": f"""
+        SELECT coalesce(sum(r.nb_lots), 0) AS nb_lots, coalesce(sum(r.quantite), 0) AS total_cartes,
+               coalesce(sum(r.lots_avec_pin), 0) AS lots_avec_pin
+        FROM rollup_lots_jour r WHERE {_SQLITE_LOTS_FILTRE}
+    """,
+    "kpi_lots_par_type": f"""
+        SELECT nullif(r.type_lot, '') AS type_lot, sum(r.quantite) AS quantite
+        FROM rollup_lots_jour r WHERE {_SQLITE_LOTS_FILTRE}
+        GROUP BY r.type_lot ORDER BY r.type_lot
+    """,
+    "kpi_lots_par_mois": f"""
+        SELECT CAST(strftime('%Y', r.jour) AS INTEGER) AS annee,
+               CAST(strftime('%m', r.jour) AS INTEGER) AS mois,
+               sum(r.quantite) AS quantite
+        FROM rollup_lots_jour r WHERE {_SQLITE_LOTS_FILTRE}
+        GROUP BY 1, 2 ORDER BY 1, 2
+    """,
+    "kpi_controle_totaux": f"""
+        SELECT coalesce(sum(f.nb_tests), 0) AS nb_tests, coalesce(sum(f.quantite), 0) AS quantite,
+               coalesce(sum(f.quantite_a_tester), 0) AS quantite_a_tester,
+               coalesce(sum(CASE WHEN f.resultat = 'Réussite' THEN f.nb_tests END), 0) AS nb_reussites,
+               coalesce(sum(CASE WHEN f.resultat = 'Échec' THEN f.nb_tests END), 0) AS nb_echecs
+        FROM ({_SQLITE_CONTROLE_CUMULS}) f
+    """,
+    "kpi_controle_par_filiale_type": f"""
+        SELECT nullif(f.filiale, '') AS filiale, nullif(f.type_carte, '') AS type_carte,
+               sum(f.nb_tests) AS nb_tests, sum(f.quantite) AS quantite,
+               sum(f.quantite_a_tester) AS quantite_a_tester
+        FROM ({_SQLITE_CONTROLE_CUMULS}) f
+        GROUP BY f.filiale, f.type_carte ORDER BY f.filiale, f.type_carte
+    """,
+    "kpi_controle_par_mois": f"""
+        SELECT strftime('%Y-%m', f.jour) AS mois, sum(f.quantite_a_tester) AS quantite_a_tester
+        FROM ({_SQLITE_CONTROLE_CUMULS}) f
+        GROUP BY 1 ORDER BY 1
+    """,
+    "kpi_controle_par_semaine": f"""
+        SELECT date(f.jour, '-' || ((CAST(strftime('%w', f.jour) AS INTEGER) + 6) % 7) || ' days') AS lundi,
+               sum(f.quantite_a_tester) AS quantite_a_tester
+        FROM ({_SQLITE_CONTROLE_CUMULS}) f
+        GROUP BY 1 ORDER BY 1
+    """,
+    "kpi_controle_par_jour_semaine": f"""
+        SELECT (CAST(strftime('%w', f.jour) AS INTEGER) + 6) % 7 + 1 AS jour,
+               sum(f.quantite_a_tester) AS quantite_a_tester
+        FROM ({_SQLITE_CONTROLE_CUMULS}) f
+        GROUP BY 1 ORDER BY 1
+    """,
+    "kpi_expeditions": """
+        SELECT e.agence, e.pays, e.statut, count(*) AS nb
+        FROM expedition e
+        GROUP BY e.agence, e.pays, e.statut ORDER BY e.agence, e.pays, e.statut
+    """,
+}
+
+_PARAMS = {
+    "lots": ("p_trimestres",),
+    "controle": ("p_debut", "p_fin", "p_filiales", "p_types", "p_jours"),
+}
+
+
+def _param_names(name: str) -> Tuple[str, ...]:
+    if name.startswith("kpi_lots"):
+        return _PARAMS["lots"]
+    if name.startswith("kpi_controle"):
+        return _PARAMS["controle"]
+    return ()
+
+
+def _normalize(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Dates → ISO, listes → listes triées (clé de cache stable, JSON sérialisable)."""
+    out = {}
+    for k, v in params.items():
+        if v is None:
+            continue
+        if isinstance(v, date):
+            v = v.isoformat()
+        elif isinstance(v, (list, tuple, set)):
+            v = sorted(v)
+        out[k] = v
+    return out
+
+
+def controle_params(date_range=None, filiales=None, types=None, jours=None) -> Dict[str, Any]:
+    """Paramètres des fonctions kpi_controle_* à partir des filtres de la barre latérale."""
+    debut, fin = (date_range[0], date_range[-1]) if date_range else (None, None)
+    return {"p_debut": debut, "p_fin": fin, "p_filiales": filiales, "p_types": types, "p_jours": jours}
+
+
+def fetch(client, name: str, **params: Any) -> pd.DataFrame:
+    """Appelle la fonction d'agrégat (RPC PostgREST), résultat mis en cache jusqu'à la prochaine écriture."""
+    params = _normalize(params)
+    cache = data_access.table_cache()
+    table, key = f"rpc:{name}", json.dumps(params, sort_keys=True)
+    with data_access.measure("rpc", name, None, [("params", k, v) for k, v in params.items()]) as record:
+        rows = cache.get(table, key)
+        record["provenance"] = "cache"
+        if rows is None:
+            generation = cache.generation(table)
+            rows = client.rpc(name, params).execute().data or []
+            record["provenance"] = "reseau"
+            cache.put(table, key, rows, generation, cache.ttl_for(AGGREGATE_TABLES[name][0]))
+        record["lignes"] = len(rows)
+    return pd.DataFrame([dict(r) for r in rows], columns=list(AGGREGATE_COLUMNS[name]))
+
+
+def sqlite_fetch(conn: sqlite3.Connection, name: str, **params: Any) -> pd.DataFrame:
+    """Agrégat exécuté sur une connexion SQLite dont les cumuls sont installés (rollups.install)."""
+    params = _normalize(params)
+    bound: Dict[str, Optional[Any]] = {p: None for p in _param_names(name)}
+    for k, v in params.items():
+        bound[k] = json.dumps(v) if isinstance(v, list) else v
+    return pd.read_sql_query(SQLITE_QUERIES[name], conn, params=bound)
+
+
+class SQLiteAggregates:
+    """Mêmes agrégats exécutés sur la base SQLite locale (erp_lots), à partir des cumuls quotidiens."""
+
+    def __init__(self, path: str = "erp_lots"):
+        self.path = path
+        self._installed = False
+
+    def fetch(self, name: str, **params: Any) -> pd.DataFrame:
+        with sqlite3.connect(self.path) as conn:
+            if not self._installed:
+                rollups.install(conn)
+                self._installed = True
+            return sqlite_fetch(conn, name, **params)
+
+
+def _on_write(table: str, op: str, filters, rows) -> None:
+    for name, tables in AGGREGATE_TABLES.items():
+        if table in tables:
+            data_access.table_cache().invalidate(f"rpc:{name}")
+
+
+def _on_change(change: change_feed.Change) -> None:
+    # Cumuls maintenus côté base : le résultat (quelques dizaines de lignes) est relu au prochain appel
+    _on_write(change.table, change.op, (), None)
+
+
+data_access.add_write_listener(_on_write)
+change_feed.add_consumer(_on_change)
@@ -0,0 +1,165 @@
+"""
+Générateur de données synthétiques au schéma erp_lots (banc d'essai, voir benchmark.py).
+
+generate(path, lots=N, seed=S) crée une base SQLite d'après le schéma du
+fichier erp_lots et la remplit de façon reproductible (même graine, mêmes
+données) avec des distributions proches de la production :
+- lots : filiales et types de lot pondérés comme dans erp_lots, quantités à
+  longue traîne, dates d'enregistrement sur plusieurs années (jours ouvrés) ;
+- controle_qualite : 0 à 3 contrôles par lot, types de carte pondérés,
+  taux d'échec paramétrable ;
+- conditionnement : paquets de 50 cartes et une enveloppe pour le reste ;
+- expedition : une par lot conditionné (statuts « Expédié » majoritaires).
+Les tables de référence (agences, références, livreurs, utilisateurs) sont
+recopiées depuis le modèle. Les lignes partent par executemany en morceaux :
+la mémoire reste bornée même pour un million de lots.
+"""
+import math
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+import replica
+import rollups
+import sqlite_backend
+
+CHUNK = 10_000
+
+# Pondérations observées dans erp_lots
+FILIALES = {
+    "Burkina Faso": 450, "Côte d'Ivoire": 103, "Togo": 71, "Sénégal": 70, "Mali": 49,
+    "Bénin": 36, "Niger": 18, "Guinée Bissau": 14, "Guinée Conakry": 8,
+}
+TYPES_LOT = {"Ordinaire": 494, "Renouvellement": 186, "Émission instantanée": 139}
+TYPES_CARTE = {
+    "challenge": 203, "open": 202, "visa leader": 59, "visa gold encoche": 57, "challenge plus": 52,
+    "access": 44, "visa infinite encoche": 40, "wadia open": 16, "wadia challenge": 15,
+    "wadia challenge plus": 6, "visa gold premier": 1,
+}
+FIN = date(2025, 12, 31)  # dernier jour des données (fixe : même graine, mêmes données)
+STATUTS_EXPEDITION = {"Expédié": 75, "En cours d'expédition": 15, "En attente": 10}
+TABLES_REFERENCE = ("agences_livraison", "references_expedition", "livreurs", "utilisateurs", "droits_utilisateur")
+
+
+def _choices(rng: random.Random, weights: Dict[str, int]):
+    values, cum = list(weights), []
+    total = 0
+    for w in weights.values():
+        total += w
+        cum.append(total)
+    return lambda: rng.choices(values, cum_weights=cum)[0]
+
+
+def _jours_ouvres(debut: date, fin: date) -> List[date]:
+    jours = [debut + timedelta(days=i) for i in range((fin - debut).days + 1)]
+    return [j for j in jours if j.weekday() < 5]
+
+
+COLONNES = {
+    "lots": ("id", "nom_lot", "type_lot", "quantite", "date_production", "date_enregistrement",
+             "filiale", "impression_pin", "nombre_pin", "cartes_a_tester"),
+    "controle_qualite": ("lot_id", "type_carte", "quantite", "quantite_a_tester", "date_controle",
+                         "remarque", "resultat"),
+    "conditionnement": ("lot_id", "nom_lot", "type_lot", "filiale", "type_emballage", "nombre_cartes",
+                        "date_conditionnement", "operateur", "remarque", "packs"),
+    "expedition": ("lot_id", "pays", "statut", "bordereau", "reference", "agence", "agent_id",
+                   "date_expedition"),
+}
+
+
+class _Writer:
+    """Tampons d'insertion par table, vidés par executemany tous les CHUNK lignes."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.buffers: Dict[str, List[Tuple]] = {t: [] for t in COLONNES}
+        self.counts: Dict[str, int] = {t: 0 for t in COLONNES}
+
+    def add(self, table: str, row: Tuple) -> None:
+        self.buffers[table].append(row)
+        if len(self.buffers[table]) >= CHUNK:
+            self.flush(table)
+
+    def flush(self, table: str) -> None:
+        rows = self.buffers[table]
+        if rows:
+            columns = COLONNES[table]
+            self.conn.executemany(
+                f'INSERT INTO "{table}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})', rows)
+            self.counts[table] += len(rows)
+            rows.clear()
+
+
+def generate(path: str, lots: int = 10_000, seed: int = 42, years: int = 3, taux_echec: float = 0.03,
+             template: str = "erp_lots", fin: date = FIN) -> Dict[str, int]:
+    """Crée (en écrasant path) et remplit la base ; renvoie le nombre de lignes par table."""
+    if os.path.exists(path):
+        os.remove(path)
+    replica.create_from_template(path, template)
+    rng = random.Random(seed)
+    filiale, type_lot, type_carte = _choices(rng, FILIALES), _choices(rng, TYPES_LOT), _choices(rng, TYPES_CARTE)
+    statut = _choices(rng, STATUTS_EXPEDITION)
+    jours = _jours_ouvres(fin - timedelta(days=365 * years), fin)
+    counts: Dict[str, int] = {}
+
+    with sqlite3.connect(path) as conn:
+        sqlite_backend.ensure_schema(conn)
+        # Tables de référence recopiées du modèle
+        conn.execute("ATTACH DATABASE ? AS modele", (f"file:{template}?mode=ro",))
+        for table in TABLES_REFERENCE:
+            columns = [r[1] for r in conn.execute(f'PRAGMA modele.table_info("{table}")')]
+            cols = ", ".join(f'"{c}"' for c in columns)
+            conn.execute(f'INSERT INTO main."{table}" ({cols}) SELECT {cols} FROM modele."{table}"')
+            counts[table] = conn.execute(f'SELECT count(*) FROM main."{table}"').fetchone()[0]
+        conn.commit()
+        conn.execute("DETACH DATABASE modele")
+
+        agence_par_pays = dict(conn.execute("SELECT pays, agence FROM agences_livraison"))
+        livreurs: Dict[str, List[int]] = {}
+        for id_, agence in conn.execute("SELECT id, agence FROM livreurs"):
+            livreurs.setdefault(agence, []).append(id_)
+
+        # Un lot et ses lignes dépendantes sont produits ensemble : rien n'est gardé en mémoire
+        writer = _Writer(conn)
+        for lot_id in range(1, lots + 1):
+            jour = rng.choice(jours)
+            nom_lot, pays = f"LOT_{seed}_{lot_id:07d}", filiale()
+            quantite = max(1, int(rng.lognormvariate(3.0, 1.2)))
+            pin = rng.random() < 0.2
+            type_du_lot = type_lot()
+            writer.add("lots", (lot_id, nom_lot, type_du_lot, quantite,
+                                str(jour - timedelta(days=rng.randint(0, 10))), str(jour), pays,
+                                "Oui" if pin else "Non", rng.randint(1, 3) if pin else 0, math.ceil(quantite / 50)))
+
+            for _ in range(rng.choices((0, 1, 2, 3), (10, 55, 25, 10))[0]):
+                resultat = "Échec" if rng.random() < taux_echec else "Réussite"
+                writer.add("controle_qualite", (
+                    lot_id, type_carte(), max(1, quantite // 3), math.ceil(quantite / 50),
+                    str(jour + timedelta(days=rng.randint(0, 5))),
+                    "RAS" if resultat == "Réussite" else "Carte défectueuse", resultat))
+
+            if rng.random() >= 0.8:
+                continue
+            jour_c = jour + timedelta(days=rng.randint(1, 10))
+            paquets = [("Paquet", quantite - quantite % 50), ("Enveloppe", quantite % 50)]
+            for emballage, cartes in paquets:
+                if not cartes:
+                    continue
+                writer.add("conditionnement", (lot_id, nom_lot, type_du_lot, pays, emballage, cartes,
+                                               str(jour_c), "Automatique", "", 1))
+
+            if rng.random() >= 0.9:
+                continue
+            agence = agence_par_pays.get(pays, "Agence non définie")
+            writer.add("expedition", (lot_id, pays, statut(), f"BL{lot_id:07d}", "Référence non disponible",
+                                      agence, rng.choice(livreurs.get(agence) or [None]),
+                                      str(jour_c + timedelta(days=rng.randint(1, 20)))))
+        for table in COLONNES:
+            writer.flush(table)
+        conn.commit()
+        counts.update(writer.counts)
+        # Cumuls quotidiens calculés une fois, après le remplissage (triggers posés ensuite)
+        rollups.install(conn)
+    return counts
@@ -0,0 +1,175 @@
+"""
+Banc d'essai des pages du menu sur données synthétiques.
+
+    python benchmark.py --lots 10000 100000 --graine 42 --sortie benchmark.json
+
+Pour chaque volume, une base est générée (bench_data.generate) puis chaque
+page de erp_api.py est exécutée sans navigateur (streamlit.testing AppTest,
+backend SQLite, session administrateur) deux fois : à froid (caches du
+processus vidés) puis à chaud. Mesures par passage :
+- durée murale du rerun complet (lectures, calculs pandas, rendu) ;
+- pic mémoire Python pendant le rerun (tracemalloc, sauf --sans-memoire) ;
+- appels de la couche de données (instrumentation.py), dont ceux servis par
+  la base, et requêtes SQL réellement exécutées ;
+- lignes lues.
+Avec --latence MS, les pages passent par le faux PostgREST (fake_backend.py,
+copie en mémoire de la base générée) : chaque requête attend MS millisecondes
+et les allers-retours sont comptés, avec leur détail par table.
+Le fichier JSON de sortie (une entrée par volume × page × passage) se compare
+d'une exécution à l'autre.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import bench_data
+import data_access
+import delta_sync
+import fake_backend
+import instrumentation
+import reference_data
+import sqlite_backend
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "erp_api.py")
+MENU_LABEL = "Naviguer vers :"
+TIMEOUT = 600
+
+
+def _vider_caches() -> None:
+    """Passage à froid : caches de lecture, miroirs et données de référence du processus oubliés."""
+    data_access.table_cache().clear()
+    delta_sync.reset()
+    reference_data.invalidate()
+
+
+def _version() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(APP)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class _CompteurSQL:
+    """Requêtes SQL exécutées sur la connexion du backend (hors instructions des triggers)."""
+
+    def __init__(self, conn):
+        self.n = 0
+        conn.set_trace_callback(self)
+
+    def __call__(self, statement: str) -> None:
+        if not statement.lstrip().startswith("--"):
+            self.n += 1
+
+
+def run_pages(db: str, pages: Optional[List[str]] = None, memoire: bool = True,
+              latence: Optional[float] = None) -> List[Dict[str, Any]]:
+    from streamlit.testing.v1 import AppTest  # dépendance du seul banc d'essai
+
+    at = AppTest.from_file(APP, default_timeout=TIMEOUT)
+    if latence is None:
+        at.secrets["backend"] = "sqlite"
+        at.secrets["sqlite_path"] = db
+        client, faux = sqlite_backend.connect(db), None
+    else:
+        # Même clé que erp_api.py : la page et le banc partagent le faux client
+        at.secrets["backend"] = "fake"
+        at.secrets["fake_template"] = db
+        at.secrets["fake_latency_ms"] = latence
+        client = faux = fake_backend.connect(db, latency=float(latence) / 1000)
+    at.secrets["write_queue_path"] = os.path.join(os.path.dirname(db), "file_ecritures.db")
+    for key, value in {"bearer_token": "banc", "user_id": "banc", "role": "admin",
+                       "utilisateur": "admin", "display_name": "banc d'essai"}.items():
+        at.session_state[key] = value
+    compteur = _CompteurSQL(client.conn)
+    at.run()
+    menu = next(s for s in at.selectbox if s.label == MENU_LABEL)
+
+    resultats = []
+    for page in pages or menu.options:
+        _vider_caches()
+        for passage in ("froid", "chaud"):
+            if memoire:
+                tracemalloc.start()
+            sql_avant = compteur.n
+            if faux is not None:
+                faux.reset_stats()
+            with instrumentation.capture() as appels:
+                debut = time.perf_counter()
+                if passage == "froid":
+                    next(s for s in at.selectbox if s.label == MENU_LABEL).set_value(page).run()
+                else:
+                    at.run()
+                duree = time.perf_counter() - debut
+            pic = tracemalloc.get_traced_memory()[1] if memoire else None
+            if memoire:
+                tracemalloc.stop()
+            resultats.append({
+                "page": page,
+                "passage": passage,
+                "ms": round(duree * 1000, 1),
+                "pic_memoire_mo": round(pic / 2**20, 1) if pic is not None else None,
+                "appels": len(appels),
+                "appels_base": sum(1 for a in appels if a["provenance"] == "reseau"),
+                "requetes_sql": compteur.n - sql_avant,
+                "lignes": sum(a["lignes"] or 0 for a in appels),
+                "exceptions": [e.value[:300] for e in at.exception],
+            })
+            if faux is not None:
+                resultats[-1]["allers_retours"] = faux.stats()
+            r = resultats[-1]
+            print(f"  {page:<40} {passage:<5} {r['ms']:>9.1f} ms  {r['pic_memoire_mo'] or 0:>7.1f} Mo  "
+                  f"{r['appels']:>3} appels  {r['requetes_sql']:>4} SQL  {r['lignes']:>8} lignes"
+                  + ("  EXCEPTION" if r["exceptions"] else ""), flush=True)
+    return resultats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lots", type=int, nargs="+", default=[10_000], help="volumes de lots à générer")
+    parser.add_argument("--graine", type=int, default=42)
+    parser.add_argument("--annees", type=int, default=3)
+    parser.add_argument("--pages", nargs="*", help="pages du menu (toutes par défaut)")
+    parser.add_argument("--dossier", help="dossier des bases générées (temporaire par défaut)")
+    parser.add_argument("--sortie", default="benchmark.json")
+    parser.add_argument("--latence", type=float, help="faux PostgREST avec cette latence par requête (ms)")
+    parser.add_argument("--sans-memoire", action="store_true", help="sans tracemalloc (durées moins perturbées)")
+    args = parser.parse_args(argv)
+
+    dossier = args.dossier or tempfile.mkdtemp(prefix="erp_bench_")
+    rapport: Dict[str, Any] = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "version": _version(),
+        "python": sys.version.split()[0],
+        "machine": platform.platform(),
+        "graine": args.graine,
+        "latence_ms": args.latence,
+        "volumes": [],
+    }
+    for lots in args.lots:
+        db = os.path.join(dossier, f"erp_bench_{lots}.db")
+        debut = time.perf_counter()
+        lignes = bench_data.generate(db, lots=lots, seed=args.graine, years=args.annees)
+        print(f"{lots} lots : base générée en {time.perf_counter() - debut:.1f} s {lignes}", flush=True)
+        rapport["volumes"].append({
+            "lots": lots,
+            "lignes": lignes,
+            "pages": run_pages(db, args.pages, memoire=not args.sans_memoire, latence=args.latence),
+        })
+    with open(args.sortie, "w", encoding="utf-8") as fh:
+        json.dump(rapport, fh, ensure_ascii=False, indent=2)
+    print(f"Résultats : {args.sortie}")
+    erreurs = sum(1 for v in rapport["volumes"] for p in v["pages"] if p["exceptions"])
+    return 1 if erreurs else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
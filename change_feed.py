@@ -0,0 +1,197 @@
+"""
+Flux de modifications : les écritures des autres opérateurs poussées dans les caches.
+
+Supabase Realtime (postgres_changes, publication supabase_realtime, voir
+007_flux_modifications.sql) envoie chaque insertion, modification et
+suppression de lots, controle_qualite, conditionnement et expedition. Les
+consommateurs inscrits par add_consumer les appliquent sur place :
+- miroirs delta_sync : ligne ajoutée, remplacée ou retirée du DataFrame ;
+- réplique locale : ligne recopiée, les triggers de cumuls (rollups.py) suivent ;
+- cache de lecture et agrégats RPC : entrées de la table invalidées.
+
+Tant que le flux est abonné, les miroirs ne relancent plus de delta à chaque
+rerun. Une coupure puis un réabonnement émettent un événement "resync" :
+les consommateurs reprennent alors une lecture complète (événements manqués).
+
+LocalFeed est le remplaçant local (tests, base SQLite) : publish() diffuse
+un événement comme le ferait Realtime.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import data_access
+
+log = logging.getLogger("erp.data")
+
+FEED_TABLES = ("lots", "controle_qualite", "conditionnement", "expedition")
+CHANNEL = "erp-modifications"
+TOKEN_REFRESH = 1800.0  # secondes entre deux renouvellements du jeton (RLS)
+CHECK_EVERY = 5.0       # secondes entre deux vérifications de la socket
+RETRY_DELAY = 15.0      # secondes avant une nouvelle connexion après coupure
+
+# Opérations d'un événement (celles des abonnés de data_access, plus resync)
+INSERT, UPDATE, DELETE, RESYNC = "insert", "update", "delete", "resync"
+
+
+class Change:
+    """Événement du flux : table, opération, ligne nouvelle (record) et ancienne (old, clé au minimum)."""
+
+    __slots__ = ("table", "op", "record", "old", "received")
+
+    def __init__(self, table: str, op: str, record: Optional[Dict[str, Any]] = None,
+                 old: Optional[Dict[str, Any]] = None):
+        self.table = table
+        self.op = op
+        self.record = record or {}
+        self.old = old or {}
+        self.received = time.time()
+
+    def key(self, column: str = "id") -> Any:
+        return self.record.get(column, self.old.get(column))
+
+    def __repr__(self) -> str:
+        return f"Change({self.table!r}, {self.op!r}, {self.key()!r})"
+
+
+# --- Consommateurs : fn(change) ---
+_consumers: List[Callable[[Change], None]] = []
+_state: Dict[str, Any] = {"live": False, "since": None, "events": 0, "last_event": None, "error": None}
+_lock = threading.Lock()
+
+
+def add_consumer(fn: Callable[[Change], None]) -> None:
+    if fn not in _consumers:
+        _consumers.append(fn)
+
+
+def dispatch(change: Change) -> None:
+    """Applique l'événement : cache de lecture invalidé, puis chaque consommateur."""
+    if change.op != RESYNC:
+        with _lock:
+            _state["events"] += 1
+            _state["last_event"] = change.received
+    data_access.invalidate(change.table)
+    for fn in list(_consumers):
+        try:
+            fn(change)
+        except Exception as e:
+            log.warning("Flux : %r non appliqué par %s : %s", change, getattr(fn, "__qualname__", fn), e)
+
+
+def live() -> bool:
+    """True quand le flux est abonné : les caches sont tenus à jour sans relecture périodique."""
+    return _state["live"]
+
+
+def _set_live(value: bool, error: Optional[str] = None) -> None:
+    with _lock:
+        was = _state["live"]
+        _state["live"] = value
+        _state["since"] = time.time() if value else None
+        _state["error"] = error
+    if value and not was:
+        # (Ré)abonnement : les événements émis pendant la coupure sont perdus
+        for table in FEED_TABLES:
+            dispatch(Change(table, RESYNC))
+
+
+def status_label() -> str:
+    with _lock:
+        state = dict(_state)
+    if state["live"]:
+        return f"📡 Flux de modifications actif ({state['events']} événement(s) reçus)"
+    erreur = f" — {state['error']}" if state["error"] else ""
+    return f"📴 Flux de modifications coupé : relectures périodiques{erreur}"
+
+
+# --- Remplaçant local ---
+class LocalFeed:
+    """Flux en mémoire : publish() diffuse l'événement dans le thread appelant."""
+
+    def start(self) -> "LocalFeed":
+        _set_live(True)
+        return self
+
+    def stop(self) -> None:
+        _set_live(False)
+
+    def publish(self, table: str, op: str, record: Optional[Dict[str, Any]] = None,
+                old: Optional[Dict[str, Any]] = None) -> None:
+        dispatch(Change(table, op, record, old))
+
+
+# --- Supabase Realtime ---
+class RealtimeFeed:
+    """Abonnement postgres_changes, tenu par une boucle asyncio dans un thread de fond."""
+
+    def __init__(self, url: str, api_key: str, token_factory: Optional[Callable[[], str]] = None,
+                 tables=FEED_TABLES):
+        self.url = f"{url.rstrip('/')}/realtime/v1"
+        self.api_key = api_key
+        self.token_factory = token_factory
+        self.tables = tuple(tables)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "RealtimeFeed":
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="erp-change-feed", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while True:
+            try:
+                asyncio.run(self._listen())
+            except Exception as e:
+                _set_live(False, str(e))
+                log.warning("Flux : connexion Realtime perdue : %s", e)
+            time.sleep(RETRY_DELAY)
+
+    async def _listen(self) -> None:
+        from realtime import AsyncRealtimeClient, RealtimeSubscribeStates  # dépendance du client supabase
+
+        client = AsyncRealtimeClient(self.url, self.api_key, auto_reconnect=False)
+        await client.connect()
+        if self.token_factory is not None:
+            await client.set_auth(self.token_factory())
+        channel = client.channel(CHANNEL)
+        for table in self.tables:
+            channel.on_postgres_changes("*", schema="public", table=table, callback=self._on_change)
+
+        def on_state(state, error) -> None:
+            if state == RealtimeSubscribeStates.SUBSCRIBED:
+                _set_live(True)
+            else:
+                _set_live(False, str(error or state.value))
+
+        await channel.subscribe(on_state)
+        refreshed = time.monotonic()
+        while True:
+            await asyncio.sleep(CHECK_EVERY)
+            if not client.is_connected:
+                # Nouvelle connexion par _run, puis réabonnement (resync)
+                raise ConnectionError("socket Realtime fermée")
+            if self.token_factory is not None and time.monotonic() - refreshed >= TOKEN_REFRESH:
+                await client.set_auth(self.token_factory())
+                refreshed = time.monotonic()
+
+    def _on_change(self, payload: Dict[str, Any]) -> None:
+        data = payload.get("data", payload)
+        op = getattr(data.get("type"), "value", data.get("type"))  # INSERT / UPDATE / DELETE
+        dispatch(Change(data.get("table"), str(op).lower(), data.get("record"), data.get("old_record")))
+
+
+# --- Flux du processus ---
+_feed: Any = None
+
+
+def start(feed) -> Any:
+    """Démarre (une fois par processus) le flux donné : RealtimeFeed ou LocalFeed."""
+    global _feed
+    with _lock:
+        if _feed is None:
+            _feed = feed
+    return _feed.start()
@@ -0,0 +1,482 @@
+"""
+Couche d'accès aux données partagée par toutes les pages de erp_api.py.
+
+Un seul client HTTP (pool de connexions keep-alive, HTTP/2) est créé par
+processus. Chaque session Streamlit reçoit une vue PostgREST légère qui
+réutilise ce pool avec ses propres en-têtes (clé anon + Bearer JWT pour la
+RLS) : plus de poignée de main TLS ni de création de client à chaque rerun.
+
+Les lectures passent par fetch_rows / fetch_df (cache TTL partagé, voir
+table_cache.py) et les écritures par insert_rows / update_rows / delete_rows,
+qui invalident le cache de la table modifiée. Les projections déclarées par
+page (projections.py) remplacent les select("*") ; la taille de chaque réponse
+est journalisée.
+
+Dans un même rerun, une lecture déjà faite (mêmes table, filtres et tri) est
+resservie par le mémo du rerun, y compris pour une projection plus étroite
+que celle déjà lue ; ces lectures redondantes sont comptées par page.
+
+Chaque appel est mesuré (measure, voir instrumentation.py) : page, table,
+projection, filtres, provenance, lignes, octets reçus et durée.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import httpx
+import pandas as pd
+from postgrest import SyncPostgrestClient
+
+import instrumentation
+from projections import page_projection
+from table_cache import TABLE_TTLS, TableCache
+
+log = logging.getLogger("erp.data")
+
+# --- Réglages du pool HTTP (partagé par toutes les sessions du processus) ---
+POOL_LIMITS = httpx.Limits(
+    max_connections=50,
+    max_keepalive_connections=20,
+    keepalive_expiry=120.0,
+)
+REQUEST_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+_lock = threading.Lock()
+_http_client: Optional[httpx.Client] = None
+
+# Octets reçus par table (décompressés, sur le réseau) depuis le démarrage du processus
+payload_stats: Dict[str, List[int]] = {}
+
+
+def count_request(size: int) -> None:
+    """Une requête de size octets, comptée dans l'appel mesuré en cours de ce thread (s'il y en a un)."""
+    record = getattr(_context, "io", None)
+    if record is not None:
+        # Appel mesuré en cours dans ce thread (ou dans la session qui l'a lancé)
+        with _lock:
+            record["octets"] += size
+            record["requetes"] += 1
+
+
+def _log_payload(response: httpx.Response) -> None:
+    """Hook httpx : journalise la taille de chaque réponse PostgREST."""
+    response.read()
+    size, wire = len(response.content), response.num_bytes_downloaded
+    count_request(size)
+    if response.request.method not in ("GET", "HEAD"):
+        return
+    table = response.request.url.path.rsplit("/", 1)[-1]
+    with _lock:
+        stats = payload_stats.setdefault(table, [0, 0])
+        stats[0] += size
+        stats[1] += wire
+    log.info("%s select=%s : %d octets (%d sur le réseau)",
+             table, response.request.url.params.get("select", "*"), size, wire)
+
+
+def shared_http_client() -> httpx.Client:
+    """Client HTTP unique du processus (les en-têtes d'auth restent par session)."""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                timeout=REQUEST_TIMEOUT,
+                follow_redirects=True,
+                event_hooks={"response": [_log_payload]},
+                # retries=1 : une nouvelle tentative si une connexion du pool a été fermée côté serveur
+                transport=httpx.HTTPTransport(limits=POOL_LIMITS, http2=True, retries=1),
+            )
+        return _http_client
+
+
+class SessionClient:
+    """
+    Vue authentifiée d'une session : expose les mêmes appels que le client
+    supabase utilisés par les pages (table, rpc, postgrest.auth).
+    Les en-têtes sont propres à la session, les connexions sont partagées.
+    """
+
+    def __init__(self, url: str, api_key: str):
+        self.api_key = api_key
+        self.rest_url = f"{url.rstrip('/')}/rest/v1"
+        self.postgrest = SyncPostgrestClient(
+            self.rest_url,
+            headers={"apikey": api_key, "Authorization": f"Bearer {api_key}"},
+            http_client=shared_http_client(),
+        )
+
+    def table(self, name: str):
+        return self.postgrest.from_(name)
+
+    from_ = table
+
+    def rpc(self, fn: str, params: Optional[Dict[str, Any]] = None):
+        return self.postgrest.rpc(fn, params or {})
+
+    def set_bearer(self, token: Optional[str]) -> None:
+        """Attache le Bearer JWT (RLS) ou revient à la clé anon si token est None."""
+        self.postgrest.auth(token or self.api_key)
+
+
+def connect(url: str, api_key: str) -> SessionClient:
+    """Crée la vue de session (à stocker dans st.session_state)."""
+    return SessionClient(url, api_key)
+
+
+# --- Cache de lecture (partagé par le processus) ---
+_cache = TableCache(ttls=TABLE_TTLS)
+
+# Un filtre est un triplet (opérateur PostgREST, colonne, valeur), ex. ("eq", "filiale", "Mali")
+Filter = Tuple[str, str, Any]
+
+
+# --- Page courante (un rerun Streamlit s'exécute dans le thread de sa session) ---
+_context = threading.local()
+STRICT_PROJECTIONS = False  # True : une colonne hors registre lève une erreur
+
+
+def set_page(page: Optional[str]) -> None:
+    """Déclare la page du menu en cours de rendu (projections.PAGE_PROJECTIONS)."""
+    _context.page = page
+
+
+def current_page() -> Optional[str]:
+    return getattr(_context, "page", None)
+
+
+def snapshot_context() -> Dict[str, Any]:
+    """Contexte du thread de la session (page, mémo du rerun) à transmettre à un thread de travail."""
+    return dict(vars(_context))
+
+
+@contextmanager
+def use_context(snapshot: Dict[str, Any]):
+    """Exécute le bloc avec le contexte d'une session (lectures lancées depuis un pool de threads)."""
+    state = vars(_context)
+    saved = dict(state)
+    state.clear()
+    state.update(snapshot)
+    try:
+        yield
+    finally:
+        state.clear()
+        state.update(saved)
+
+
+# --- Mémo du rerun : (table, filtres, tri, limite, tranche) → [(projection, lignes)] ---
+# Lectures redondantes resservies par le mémo, par (page, table), depuis le démarrage du processus
+redundant_reads: Dict[Tuple[Optional[str], str], int] = {}
+
+
+# Reruns ouverts par session : Streamlit lance un thread de script par interaction, le
+# rerun interrompu (st.stop, st.rerun, exception) est clos au rerun suivant de la session
+_open_reruns: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+MAX_OPEN_RERUNS = 1000
+
+
+def _close(state: Optional[Dict[str, Any]]) -> None:
+    """Totaux d'un rerun versés à la fenêtre glissante de sa page (une seule fois)."""
+    if state is None or state.get("closed"):
+        return
+    state["closed"] = True
+    if state.get("queries"):
+        instrumentation.finish_rerun(state.get("page"), state["queries"])
+
+
+def begin_rerun(session: Any = None) -> None:
+    """Début d'un rerun : vide le mémo des lectures et les compteurs du thread de la session."""
+    with _lock:
+        previous = _open_reruns.pop(session, None) if session is not None else None
+    # Sans session : rerun précédent de ce même thread (st.rerun enchaîné)
+    _close(previous if session is not None else vars(_context) if hasattr(_context, "queries") else None)
+    _context.memo = {}
+    _context.stats = {"lectures": 0, "reseau": 0, "identiques": 0, "projections": 0}
+    _context.queries = []
+    _context.closed = False
+    _context.session = session
+    if session is not None:
+        stale = []
+        with _lock:
+            _open_reruns[session] = vars(_context)
+            while len(_open_reruns) > MAX_OPEN_RERUNS:
+                stale.append(_open_reruns.popitem(last=False)[1])
+        for state in stale:
+            _close(state)
+
+
+def end_rerun() -> None:
+    """Fin normale du script : les totaux du rerun rejoignent la fenêtre glissante de la page."""
+    session = getattr(_context, "session", None)
+    if session is not None:
+        with _lock:
+            _open_reruns.pop(session, None)
+    _close(vars(_context))
+
+
+def rerun_queries() -> List[Dict[str, Any]]:
+    """Appels mesurés depuis le début du rerun en cours."""
+    return list(getattr(_context, "queries", []))
+
+
+@contextmanager
+def measure(kind: str, table: str, columns: Any = None, filters: Sequence[Filter] = ()):
+    """
+    Mesure un appel de la couche de données ; l'appelant renseigne record["lignes"]
+    et record["provenance"]. Les octets des réponses HTTP reçues pendant l'appel
+    (threads de pagination compris) sont ajoutés par le hook httpx.
+    """
+    record = instrumentation.start(kind, table, current_page(), columns, filters)
+    outer = getattr(_context, "io", None)
+    record["imbrique"] = outer is not None
+    _context.io = record
+    try:
+        yield record
+    except Exception as e:
+        record["erreur"] = str(e)
+        raise
+    finally:
+        _context.io = outer
+        if outer is not None:
+            with _lock:
+                outer["octets"] += record["octets"]
+                outer["requetes"] += record["requetes"]
+        instrumentation.finish(record)
+        queries = getattr(_context, "queries", None)
+        if queries is not None:
+            queries.append(record)
+
+
+def rerun_stats() -> Dict[str, int]:
+    """Compteurs du rerun en cours : lectures, requêtes envoyées, lectures resservies (identiques / projections)."""
+    return dict(getattr(_context, "stats", {}))
+
+
+def _count(name: str) -> None:
+    stats = getattr(_context, "stats", None)
+    if stats is not None:
+        stats[name] += 1
+
+
+def _memo_get(table: str, base: Tuple, cols: Tuple[str, ...]) -> Optional[List[Dict[str, Any]]]:
+    memo = getattr(_context, "memo", None)
+    if not memo:
+        return None
+    for cached_cols, rows in memo.get((table,) + base, ()):
+        if cached_cols == cols:
+            kind, hit = "identiques", rows
+        elif cached_cols == ("*",) and rows and all(c in rows[0] for c in cols) \
+                or cached_cols != ("*",) and set(cols) <= set(cached_cols):
+            # Projection plus étroite : extraite des lignes déjà lues
+            kind, hit = "projections", [{c: r.get(c) for c in cols} for r in rows]
+        else:
+            continue
+        _count(kind)
+        page = current_page()
+        with _lock:
+            redundant_reads[(page, table)] = redundant_reads.get((page, table), 0) + 1
+        log.debug("%s select=%s resservi par le mémo du rerun (%s, page %s)", table, ",".join(cols), kind, page)
+        return hit
+    return None
+
+
+def _memo_put(table: str, base: Tuple, cols: Tuple[str, ...], rows: List[Dict[str, Any]]) -> None:
+    memo = getattr(_context, "memo", None)
+    if memo is not None:
+        memo.setdefault((table,) + base, []).append((cols, rows))
+
+
+def _memo_invalidate(table: str) -> None:
+    memo = getattr(_context, "memo", None)
+    for key in [k for k in (memo or {}) if k[0] == table]:
+        del memo[key]
+
+
+def resolve_columns(table: str, columns: Any = None) -> Tuple[str, ...]:
+    """
+    Applique le registre de projections : "*" (ou None) devient la projection
+    déclarée par la page ; une colonne demandée hors registre est signalée.
+    """
+    cols = normalize_columns(columns or "*")
+    declared = page_projection(current_page(), table)
+    if declared is None:
+        return cols
+    if cols == ("*",):
+        return declared
+    extra = [c for c in cols if c not in declared]
+    if extra:
+        message = f"Colonnes {extra} hors projection de « {current_page()} » pour {table}"
+        if STRICT_PROJECTIONS:
+            raise ValueError(message)
+        log.warning(message)
+    return cols
+
+
+def table_cache() -> TableCache:
+    return _cache
+
+
+def configure_cache(ttls: Optional[Dict[str, float]] = None, default_ttl: Optional[float] = None) -> None:
+    """Surcharge les TTL (secondes) par table, ex. depuis la section [cache_ttl] de secrets.toml."""
+    if default_ttl is not None:
+        _cache.default_ttl = float(default_ttl)
+    for table, ttl in (ttls or {}).items():
+        if table == "default":
+            _cache.default_ttl = float(ttl)
+        else:
+            _cache.ttls[table] = float(ttl)
+
+
+def invalidate(*tables: str) -> None:
+    for table in tables:
+        _cache.invalidate(table)
+
+
+# --- Abonnés aux écritures (miroirs delta_sync, ...) : fn(table, op, filters, rows) ---
+_write_listeners: List[Callable[[str, str, Tuple[Filter, ...], Any], None]] = []
+
+
+def add_write_listener(fn: Callable[[str, str, Tuple[Filter, ...], Any], None]) -> None:
+    if fn not in _write_listeners:
+        _write_listeners.append(fn)
+
+
+def _written(table: str, op: str, filters: Sequence[Filter] = (), rows: Any = None) -> None:
+    _cache.invalidate(table)
+    _memo_invalidate(table)
+    for fn in list(_write_listeners):
+        fn(table, op, normalize_filters(filters), rows)
+
+
+def normalize_columns(columns: Any) -> Tuple[str, ...]:
+    if isinstance(columns, str):
+        columns = columns.split(",")
+    return tuple(c.strip() for c in columns if c.strip()) or ("*",)
+
+
+def normalize_filters(filters: Iterable[Filter]) -> Tuple[Filter, ...]:
+    normalized = []
+    for op, column, value in filters:
+        if isinstance(value, (list, tuple, set)):
+            value = tuple(value)
+        normalized.append((op, column, value))
+    return tuple(normalized)
+
+
+def apply_filters(query, filters: Iterable[Filter]):
+    """Applique les triplets (op, colonne, valeur) sur un builder PostgREST."""
+    for op, column, value in filters:
+        query = getattr(query, op)(column, list(value) if isinstance(value, tuple) else value)
+    return query
+
+
+def select_rows(client, table: str, columns: Any = "*", filters: Sequence[Filter] = (),
+                order: Optional[str] = None, desc: bool = False, limit: Optional[int] = None,
+                page_size: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Lecture directe (hors cache) ; page_size : lit tout le résultat par tranches."""
+    columns = normalize_columns(columns)
+    filters = normalize_filters(filters)
+
+    def build():
+        query = apply_filters(client.table(table).select(",".join(columns)), filters)
+        if order:
+            query = query.order(order, desc=desc)
+        return query
+
+    if not page_size:
+        query = build()
+        if limit:
+            query = query.limit(limit)
+        return query.execute().data or []
+
+    # Pagination : PostgREST plafonne le nombre de lignes renvoyées par requête ;
+    # pages téléchargées en parallèle (import local : pagination importe ce module)
+    import pagination
+    return pagination.fetch_all_rows(client, table, columns, filters, order or "id", desc, page_size)
+
+
+def fetch_rows(client, table: str, columns: Any = None, filters: Sequence[Filter] = (),
+               order: Optional[str] = None, desc: bool = False, limit: Optional[int] = None,
+               page_size: Optional[int] = None, ttl: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Lecture à travers le mémo du rerun puis le cache : clé = table + projection + filtres + tri.
+    Renvoie des copies des lignes (les pages peuvent les enrichir sans polluer le cache).
+    columns : None ou "*" → projection déclarée par la page courante.
+    page_size : lit toute la table par tranches de page_size lignes.
+    """
+    cols = resolve_columns(table, columns)
+    flt = normalize_filters(filters)
+    key = (cols, flt, order, desc, limit, page_size)
+    base = (flt, order, desc, limit, page_size)
+    _count("lectures")
+
+    with measure("lecture", table, cols, flt) as record:
+        rows = _memo_get(table, base, cols)
+        record["provenance"] = "memo"
+        if rows is None:
+            rows = _cache.get(table, key)
+            record["provenance"] = "cache"
+            if rows is None:
+                generation = _cache.generation(table)
+                rows = select_rows(client, table, cols, flt, order, desc, limit, page_size)
+                record["provenance"] = "reseau"
+                _count("reseau")
+                _cache.put(table, key, rows, generation, ttl)
+            _memo_put(table, base, cols, rows)
+        record["lignes"] = len(rows)
+    return [dict(r) for r in rows]
+
+
+def fetch_df(client, table: str, columns: Any = None, filters: Sequence[Filter] = (), **kwargs) -> pd.DataFrame:
+    return pd.DataFrame(fetch_rows(client, table, columns, filters, **kwargs))
+
+
+# --- Écritures (invalident le cache de la table et préviennent les abonnés) ---
+def insert_rows(client, table: str, rows: Any) -> List[Dict[str, Any]]:
+    data: List[Dict[str, Any]] = []
+    try:
+        with measure("insert", table) as record:
+            data = client.table(table).insert(rows).execute().data or []
+            record["lignes"] = len(data)
+        return data
+    finally:
+        _written(table, "insert", (), data)
+
+
+def upsert_rows(client, table: str, rows: Any, on_conflict: str,
+                ignore_duplicates: bool = False) -> List[Dict[str, Any]]:
+    """INSERT ... ON CONFLICT en une requête ; avec ignore_duplicates, renvoie seulement les lignes créées."""
+    data: List[Dict[str, Any]] = []
+    try:
+        with measure("upsert", table) as record:
+            data = client.table(table).upsert(
+                rows, on_conflict=on_conflict, ignore_duplicates=ignore_duplicates
+            ).execute().data or []
+            record["lignes"] = len(data)
+        return data
+    finally:
+        # Sans mise à jour des lignes existantes, seul l'ajout de lignes est à propager
+        _written(table, "insert" if ignore_duplicates else "upsert", (), data)
+
+
+def update_rows(client, table: str, values: Dict[str, Any], filters: Sequence[Filter]) -> List[Dict[str, Any]]:
+    data: List[Dict[str, Any]] = []
+    try:
+        with measure("update", table, tuple(values), normalize_filters(filters)) as record:
+            data = apply_filters(client.table(table).update(values), filters).execute().data or []
+            record["lignes"] = len(data)
+        return data
+    finally:
+        _written(table, "update", filters, data)
+
+
+def delete_rows(client, table: str, filters: Sequence[Filter] = ()) -> List[Dict[str, Any]]:
+    data: List[Dict[str, Any]] = []
+    try:
+        with measure("delete", table, None, normalize_filters(filters)) as record:
+            data = apply_filters(client.table(table).delete(), filters).execute().data or []
+            record["lignes"] = len(data)
+        return data
+    finally:
+        _written(table, "delete", filters, data)
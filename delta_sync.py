@@ -0,0 +1,222 @@
+"""
+Synchronisation incrémentale des grosses tables (lots, controle_qualite, conditionnement).
+
+Chaque miroir garde un DataFrame local et une high-water mark (max id, ou
+updated_at quand la colonne existe). Un rerun ne télécharge que les lignes
+nouvelles ou modifiées ; une réconciliation complète périodique rattrape les
+modifications et suppressions faites hors de l'application. Quand le flux de
+modifications est abonné (change_feed.py), les événements sont appliqués
+directement au DataFrame et les deltas périodiques cessent.
+"""
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+import pandas as pd
+
+import change_feed
+import data_access
+import pagination
+
+PAGE_SIZE = pagination.PAGE_SIZE
+DEFAULT_MIN_INTERVAL = 5.0   # secondes minimum entre deux requêtes delta
+DEFAULT_FULL_EVERY = 900.0   # réconciliation complète (suppressions externes)
+
+# Colonne de watermark par table ; None : updated_at si la table l'expose, sinon la clé
+SYNC_WATERMARKS: Dict[str, Optional[str]] = {
+    "lots": None,
+    "controle_qualite": None,
+    "conditionnement": None,
+}
+
+
+def _scalar(value: Any) -> Any:
+    """numpy → type Python (sérialisable dans un filtre PostgREST)."""
+    return value.item() if hasattr(value, "item") else value
+
+
+class TableMirror:
+    """DataFrame local d'une table + high-water mark, mis à jour par deltas."""
+
+    def __init__(self, table: str, columns: Any = "*", key: str = "id",
+                 watermark: Optional[str] = None,
+                 min_interval: float = DEFAULT_MIN_INTERVAL,
+                 full_every: float = DEFAULT_FULL_EVERY):
+        self.table = table
+        self.key = key
+        self.watermark = watermark
+        self.min_interval = min_interval
+        self.full_every = full_every
+        cols = data_access.normalize_columns(columns)
+        if cols != ("*",):
+            # La clé (et la watermark) sont indispensables à la fusion
+            cols = tuple(dict.fromkeys((key, *([watermark] if watermark else []), *cols)))
+        self.columns: Tuple[str, ...] = cols
+
+        self.frame: Optional[pd.DataFrame] = None
+        self.high_water: Any = None
+        self.last_delta = 0.0
+        self.last_full = 0.0
+        self._due = False
+        self._force_full = False
+        self._stale_keys: Set[Hashable] = set()
+        self._deleted_keys: Set[Hashable] = set()
+        self._lock = threading.Lock()
+
+    # --- Notifications d'écriture (via data_access) ---
+    def notify(self, op: str, filters: Tuple[data_access.Filter, ...]) -> None:
+        with self._lock:
+            if op == "insert":
+                self._due = True
+                return
+            keys: Set[Hashable] = set()
+            for f_op, column, value in filters:
+                if column != self.key or f_op not in ("eq", "in_"):
+                    # Filtre non ciblé sur la clé : on ne sait pas quelles lignes ont bougé
+                    self._force_full = True
+                    return
+                keys.update(value if f_op == "in_" else (value,))
+            if not filters:
+                self._force_full = True
+            elif op == "delete":
+                self._deleted_keys |= keys
+            else:
+                self._stale_keys |= keys
+
+    # --- Flux de modifications (change_feed) ---
+    def apply_change(self, change: change_feed.Change) -> None:
+        """Ajoute, remplace ou retire la ligne de l'événement dans le DataFrame local."""
+        with self._lock:
+            if self.frame is None:
+                return
+            if change.op == change_feed.RESYNC:
+                self._force_full = True
+                return
+            key = change.key(self.key)
+            if key is None:
+                self._force_full = True
+                return
+            if not self.frame.empty:
+                self.frame = self.frame[self.frame[self.key] != key]
+            if change.op == change_feed.DELETE:
+                self.frame = self.frame.reset_index(drop=True)
+                return
+            record = change.record
+            if self.columns != ("*",):
+                record = {c: record.get(c) for c in self.columns}
+            self._merge(pd.DataFrame([record]))
+
+    # --- Synchronisation ---
+    def sync(self, client) -> pd.DataFrame:
+        """Met le miroir à jour et renvoie une copie du DataFrame local."""
+        with self._lock:
+            now = time.monotonic()
+            if self.frame is None or self._force_full or now - self.last_full >= self.full_every:
+                self._full(client, now)
+            else:
+                self._apply_local_changes(client)
+                # Flux abonné : les lignes des autres sessions arrivent par apply_change
+                if self._due or (not change_feed.live() and now - self.last_delta >= self.min_interval):
+                    self._delta(client, now)
+            return self.frame.copy()
+
+    def _fetch(self, client, filters=()) -> pd.DataFrame:
+        # Pages concurrentes triées sur la clé, assemblées au fil de l'eau
+        return pagination.fetch_df(client, self.table, self.columns, filters,
+                                   order=self.key, page_size=PAGE_SIZE)
+
+    def _full(self, client, now: float) -> None:
+        frame = self._fetch(client)
+        if self.watermark is None:
+            self.watermark = "updated_at" if "updated_at" in frame.columns else self.key
+        self.frame = frame
+        self.high_water = _scalar(frame[self.watermark].max()) if not frame.empty else None
+        self.last_full = self.last_delta = now
+        self._due = self._force_full = False
+        self._stale_keys.clear()
+        self._deleted_keys.clear()
+
+    def _delta(self, client, now: float) -> None:
+        filters = []
+        if self.high_water is not None:
+            # updated_at : gte car plusieurs lignes peuvent partager le même horodatage
+            op = "gt" if self.watermark == self.key else "gte"
+            filters.append((op, self.watermark, self.high_water))
+        self._merge(self._fetch(client, filters))
+        self.last_delta = now
+        self._due = False
+
+    def _apply_local_changes(self, client) -> None:
+        if self._deleted_keys and not self.frame.empty:
+            self.frame = self.frame[~self.frame[self.key].isin(self._deleted_keys)]
+        self._deleted_keys.clear()
+        if self._stale_keys:
+            keys = [_scalar(k) for k in self._stale_keys]
+            fresh = self._fetch(client, [("in_", self.key, keys)])
+            if not self.frame.empty:
+                # Les lignes disparues entre-temps sont retirées
+                self.frame = self.frame[~self.frame[self.key].isin(keys)]
+            self._merge(fresh)
+            self._stale_keys.clear()
+
+    def _merge(self, new: pd.DataFrame) -> None:
+        if new.empty:
+            return
+        if self.frame is None or self.frame.empty:
+            merged = new
+        else:
+            kept = self.frame[~self.frame[self.key].isin(new[self.key])]
+            merged = pd.concat([kept, new], ignore_index=True)
+        self.frame = merged.sort_values(self.key, kind="stable").reset_index(drop=True)
+        high = _scalar(new[self.watermark].max())
+        if self.high_water is None or high > self.high_water:
+            self.high_water = high
+
+
+# --- Registre des miroirs (partagé par le processus) ---
+_mirrors: Dict[Tuple[str, Tuple[str, ...], str], TableMirror] = {}
+_registry_lock = threading.Lock()
+
+
+def mirror(table: str, columns: Any = "*", key: str = "id", **kwargs) -> TableMirror:
+    cols = data_access.normalize_columns(columns)
+    with _registry_lock:
+        m = _mirrors.get((table, cols, key))
+        if m is None:
+            kwargs.setdefault("watermark", SYNC_WATERMARKS.get(table))
+            m = _mirrors[(table, cols, key)] = TableMirror(table, cols, key, **kwargs)
+        return m
+
+
+def synced_df(client, table: str, columns: Any = "*", key: str = "id", **kwargs) -> pd.DataFrame:
+    """DataFrame complet d'une table, tenu à jour par deltas (projection de la page courante)."""
+    cols = data_access.resolve_columns(table, columns)
+    with data_access.measure("miroir", table, cols) as record:
+        frame = mirror(table, cols, key, **kwargs).sync(client)
+        record["provenance"] = "reseau" if record["requetes"] else "miroir"
+        record["lignes"] = len(frame)
+    return frame
+
+
+def reset() -> None:
+    """Oublie tous les miroirs (relecture complète au prochain appel)."""
+    with _registry_lock:
+        _mirrors.clear()
+
+
+def _on_write(table: str, op: str, filters, rows) -> None:
+    with _registry_lock:
+        targets = [m for (t, _, _), m in _mirrors.items() if t == table]
+    for m in targets:
+        m.notify(op, filters)
+
+
+def _on_change(change: change_feed.Change) -> None:
+    with _registry_lock:
+        targets = [m for (t, _, _), m in _mirrors.items() if t == change.table]
+    for m in targets:
+        m.apply_change(change)
+
+
+data_access.add_write_listener(_on_write)
+change_feed.add_consumer(_on_change)
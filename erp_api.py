@@ -1,6 +1,5 @@
 import math
 import streamlit as st
-from supabase import create_client
 import jwt  # pyjwt
 import time
 import pandas as pd
@@ -13,20 +12,52 @@ import plotly.express as px
 from sklearn.linear_model import LinearRegression
 import streamlit as st
 import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from numpy.random import default_rng as rng
 import io
+import os
 from datetime import date
+
+import aggregates
+import change_feed
+import data_access
+import delta_sync
+import exports
+import fake_backend
+import fanout
+import filter_pushdown
+import id_allocator
+import instrumentation
+import lot_import
+import profiling
+import reference_data
+import replica
+import sqlite_backend
+import write_queue
 st.set_page_config(
     page_title="DSTM",
     page_icon="Designer.png"  # ton icône
 )
 
-# Connexion à Supabase
-url = st.secrets["supabase_url"]
-anon_key = st.secrets["supabase_anon_key"]
-key = st.secrets["supabase_key"]
-supabase = create_client(url, key)
-JWT_SECRET = st.secrets["SUPABASE_JWT_SECRET"]
+# Nouveau rerun : mémo des lectures et compteurs de requêtes remis à zéro
+contexte_script = get_script_run_ctx()
+data_access.begin_rerun(contexte_script.session_id if contexte_script is not None else None)
+# Reruns de cette session à profiler, armés depuis « Gestion des comptes utilisateurs » :
+# échantillonnés dès ici (connexion, client, lectures) ; page et utilisateur connus plus bas
+if contexte_script is not None:
+    profiling.begin(contexte_script.session_id, st.session_state.get("display_name"), None)
+
+# Connexion : Supabase, ou base SQLite locale avec backend = "sqlite" dans secrets.toml
+# (backend = "fake" : copie en mémoire avec latence simulée, voir fake_backend.py)
+BACKEND = st.secrets.get("backend", "supabase")
+LOCAL_BACKEND = BACKEND in ("sqlite", "fake")
+if LOCAL_BACKEND:
+    url = anon_key = ""
+    JWT_SECRET = st.secrets.get("SUPABASE_JWT_SECRET", "local")
+else:
+    url = st.secrets["supabase_url"]
+    anon_key = st.secrets["supabase_anon_key"]
+    JWT_SECRET = st.secrets["SUPABASE_JWT_SECRET"]
 JWT_ALG = "HS256"
 
 
@@ -50,24 +81,63 @@ def make_supabase_compatible_jwt(user_id: str, ttl_seconds: int = 7200) -> str:
     return token if isinstance(token, str) else token.decode("utf-8")
 
 
-# Stocker le client dans la session pour pouvoir le recréer au besoin
+# Vue de session sur le pool HTTP partagé du processus (voir data_access.py) :
+# toutes les pages utilisent ce client, aucune ne recrée de connexion.
 if "supabase_client" not in st.session_state:
-    st.session_state["supabase_client"] = create_client(url, anon_key)
+    if BACKEND == "sqlite":
+        st.session_state["supabase_client"] = sqlite_backend.connect(st.secrets.get("sqlite_path", sqlite_backend.DEFAULT_PATH))
+    elif BACKEND == "fake":
+        st.session_state["supabase_client"] = fake_backend.connect(
+            st.secrets.get("fake_template", "erp_lots"),
+            latency=float(st.secrets.get("fake_latency_ms", 0)) / 1000,
+            jitter=float(st.secrets.get("fake_jitter_ms", 0)) / 1000,
+        )
+    else:
+        client = data_access.connect(url, anon_key)
+        # Réplique locale en lecture (replica_path dans secrets.toml) : lectures SQLite, écritures Supabase
+        if st.secrets.get("replica_path"):
+            compte_replique = st.secrets.get("replica_user_id")
+
+            def auth_replique(remote):
+                # Jeton du compte technique de la réplique, renouvelé à chaque cycle (RLS)
+                if compte_replique:
+                    remote.set_bearer(make_supabase_compatible_jwt(compte_replique))
+
+            client = replica.ReplicatedClient(client, replica.start(
+                data_access.connect(url, anon_key), st.secrets["replica_path"],
+                interval=float(st.secrets.get("replica_interval", replica.DEFAULT_INTERVAL)),
+                refresh_auth=auth_replique,
+            ))
+        st.session_state["supabase_client"] = client
 supabase = st.session_state["supabase_client"]
+# File d'écritures durable (conditionnement, expédition), rejouée vers Supabase en arrière-plan
+file_ecritures = write_queue.start(
+    st.secrets.get("write_queue_path", write_queue.DEFAULT_PATH),
+    supabase if LOCAL_BACKEND else data_access.connect(url, anon_key),
+    token_factory=make_supabase_compatible_jwt,
+)
+# Flux de modifications (change_feed = "realtime" dans secrets.toml) : les écritures des
+# autres opérateurs sont appliquées aux miroirs, à la réplique et aux caches du processus
+if not LOCAL_BACKEND and st.secrets.get("change_feed") == "realtime":
+    compte_flux = st.secrets.get("change_feed_user_id") or st.secrets.get("replica_user_id")
+    change_feed.start(change_feed.RealtimeFeed(
+        url, anon_key,
+        token_factory=(lambda: make_supabase_compatible_jwt(compte_flux)) if compte_flux else None,
+    ))
+# Mesures de la couche de données en JSON (perf_log_path dans secrets.toml, sinon sortie d'erreur)
+instrumentation.configure_logging(st.secrets.get("perf_log_path"))
+# Profils des reruns échantillonnés à la demande (profile_path dans secrets.toml)
+profiling.configure(st.secrets.get("profile_path"))
+# TTL du cache de lecture configurables via la section [cache_ttl] de secrets.toml
+data_access.configure_cache(dict(st.secrets.get("cache_ttl", {})))
 
 def set_bearer(token: str):
     """Attache le Bearer JWT au client PostgREST (RLS)."""
-    # Méthode officielle (v2.x)
-    supabase.postgrest.auth(token)
+    supabase.set_bearer(token)
 
 def clear_bearer():
     """Retire le Bearer JWT du client PostgREST (RLS)."""
-    try:
-        # Méthode officielle (v2.x)
-        supabase.postgrest.auth(None)
-    except Exception:
-        # Fallback universel : recréer un client propre sans Authorization
-        st.session_state["supabase_client"] = create_client(url, anon_key)
+    supabase.set_bearer(None)
 
 
 def logout():
@@ -183,16 +253,16 @@ def enregistrer_lot():
         col1, col2 = st.columns(2)
         with col1:
             nom_lot = st.text_input("Nom du lot")
-            type_lot = st.selectbox("Type de lot", ["Ordinaire", "Émission instantanée", "Renouvellement"])
+            type_lot = st.selectbox("Type de lot", lot_import.TYPES_LOT)
             quantite = st.number_input("Quantité totale", min_value=1)
             date_production = st.date_input("Date de production", value=date.today())
         with col2:
             date_enregistrement = st.date_input("Date d'enregistrement", value=date.today())
-            filiale = st.selectbox("Filiale", ["Burkina Faso", "Mali", "Niger", "Côte d'Ivoire", "Sénégal", "Bénin", "Togo", "Guinée Bissau", "Guinée Conakry"])
+            filiale = st.selectbox("Filiale", lot_import.FILIALES)
             impression_pin = st.radio("Impression de PIN ?", ["Oui", "Non"])
             nombre_pin = st.number_input("Nombre de PIN", min_value=1) if impression_pin == "Oui" else 0
 
-        cartes_a_tester = int(quantite / 50) + (quantite % 50 > 0)
+        cartes_a_tester = lot_import.cartes_a_tester(quantite)
         submitted = st.form_submit_button("✅ Enregistrer le lot")
         
 
@@ -201,25 +271,166 @@ def enregistrer_lot():
             if existing:
                 st.error("❌ Ce nom de lot existe déjà. Vérifiez le nom de lot.")
             else:
-                
-# Récupérer le dernier ID
-                last_id_data = supabase.table("lots").select("id").order("id", desc=True).limit(1).execute().data
-                next_id = (last_id_data[0]["id"] + 1) if last_id_data else 1
-                   
-                supabase.table("lots").insert({
-                    "id": next_id,
-                    "nom_lot": nom_lot,
-                    "type_lot": type_lot,
-                    "quantite": quantite,
-                    "date_production": str(date_production),
-                    "date_enregistrement": str(date_enregistrement),
-                    "filiale": filiale,
-                    "impression_pin": impression_pin,
-                    "nombre_pin": nombre_pin,
-                    "cartes_a_tester": cartes_a_tester, 
-                }).execute()
-                st.success("✅ Lot enregistré avec succès.")
-                st.rerun()
+                # id attribué par la séquence de la table (004_sequences_identifiants.sql)
+                try:
+                    data_access.insert_rows(supabase, "lots", {
+                        "nom_lot": nom_lot,
+                        "type_lot": type_lot,
+                        "quantite": quantite,
+                        "date_production": str(date_production),
+                        "date_enregistrement": str(date_enregistrement),
+                        "filiale": filiale,
+                        "impression_pin": impression_pin,
+                        "nombre_pin": nombre_pin,
+                        "cartes_a_tester": cartes_a_tester, 
+                    })
+                except Exception as e:
+                    # 23505 : nom créé entre la vérification et l'insertion (lots_nom_lot_unique)
+                    if str(getattr(e, "code", "")) != "23505":
+                        raise
+                    st.error("❌ Ce lot existe déjà. Vérifiez le nom de lot.")
+                else:
+                    st.success("✅ Lot enregistré avec succès.")
+                    st.rerun()
+
+# Import de lots en masse (CSV / Excel), mêmes règles que le formulaire (voir lot_import.py)
+def importer_lots():
+    st.markdown("## 📥 Import de lots depuis un fichier")
+    st.caption("Colonnes attendues : " + ", ".join(lot_import.COLONNES)
+               + ". Dates vides = aujourd'hui ; cartes à tester calculées automatiquement.")
+    fichier = st.file_uploader("Fichier CSV ou Excel", type=["csv", "xlsx"])
+    chunk_size = st.number_input("Lignes par insertion", min_value=1, max_value=1000, value=lot_import.CHUNK_SIZE)
+
+    if fichier is not None and st.button("📥 Importer les lots"):
+        barre = st.progress(0.0)
+        etat = st.empty()
+        report = lot_import.ImportReport()
+
+        def avancement(courant):
+            nonlocal report
+            report = courant
+            etat.write(f"Lignes lues : {report.lues} — insérées : {report.inserees} — "
+                       f"doublons : {len(report.doublons)} — erreurs : {len(report.erreurs)}")
+            barre.progress(min(fichier.tell() / max(fichier.size, 1), 1.0))
+
+        try:
+            report = lot_import.import_lots(supabase, lot_import.read_rows(fichier, fichier.name, int(chunk_size)),
+                                            chunk_size=int(chunk_size), progress=avancement)
+        except Exception as e:
+            # Fichier illisible (format, encodage, colonnes) : les morceaux déjà insérés le restent
+            st.error(f"❌ Fichier illisible : {e}")
+            if report.inserees:
+                st.info(f"ℹ️ {report.inserees} lot(s) déjà importé(s) avant l'erreur.")
+            return
+        barre.progress(1.0)
+        st.success(f"✅ {report.inserees} lot(s) importé(s) sur {report.lues} ligne(s) lue(s).")
+        if report.doublons:
+            st.warning(f"⚠️ {len(report.doublons)} nom(s) de lot déjà existant(s) ignoré(s).")
+            st.dataframe(pd.DataFrame(report.doublons, columns=["Ligne", "Nom du lot"]), use_container_width=True)
+        if report.erreurs:
+            st.error(f"❌ {len(report.erreurs)} ligne(s) rejetée(s).")
+            st.dataframe(pd.DataFrame(report.erreurs, columns=["Ligne", "Motif"]), use_container_width=True)
+
+# Export de l'inventaire filtré : fichier écrit page par page (voir exports.py)
+def bouton_export(nom, filtres, table, columns=None, transform=None):
+    with st.expander("📤 Exporter"):
+        fmt = st.radio("Format", list(exports.FORMATS), horizontal=True, key=f"export_format_{nom}")
+        if st.button("Préparer le fichier", key=f"export_preparer_{nom}"):
+            precedent = st.session_state.pop(f"export_{nom}", None)
+            if precedent:
+                exports.remove(precedent[0])
+            try:
+                with st.spinner("Export en cours..."):
+                    path, rows = exports.export_to_file(filtres.iter_frames(supabase, table, columns, transform), fmt)
+                st.session_state[f"export_{nom}"] = (path, fmt, rows)
+            except ValueError as e:
+                # Fichier partiel déjà supprimé par export_to_file
+                st.error(f"❌ {e} : choisissez le format CSV.")
+
+        prepare = st.session_state.get(f"export_{nom}")
+        if prepare and os.path.exists(prepare[0]):
+            path, fmt_prepare, rows = prepare
+            suffix, mime = exports.FORMATS[fmt_prepare]
+            # Streamlit charge le fichier en mémoire pour le servir (limite décrite dans exports.py)
+            with open(path, "rb") as fh:
+                st.download_button(f"⬇️ Télécharger {nom}{suffix} ({rows} lignes)", fh,
+                                   file_name=f"{nom}_{date.today()}{suffix}", mime=mime,
+                                   key=f"export_telecharger_{nom}")
+
+# État de la file d'écritures d'une table : envois en attente et conflits à examiner
+def etat_file_ecritures(table):
+    en_attente = file_ecritures.pending(table)
+    if en_attente:
+        st.info(f"📥 {en_attente} enregistrement(s) en attente d'envoi vers la base (hors connexion).")
+    problemes = file_ecritures.problems(table)
+    if problemes:
+        with st.expander(f"⚠️ {len(problemes)} enregistrement(s) refusé(s) au rejeu", expanded=True):
+            for p in problemes:
+                col1, col2 = st.columns([4, 1])
+                col1.write(f"**{p['cree_le']}** — {p['statut']} : {p['erreur']}")
+                col1.caption(p["lignes"])
+                if col2.button("Marquer traité", key=f"file_ecritures_{p['seq']}"):
+                    file_ecritures.dismiss(p["seq"])
+                    st.rerun()
+
+def panneau_performance():
+    """Panneau « ⏱ Performance » (administrateurs) : appels du rerun et percentiles glissants."""
+    with st.sidebar.expander("⏱ Performance"):
+        appels = [r for r in data_access.rerun_queries() if not r["imbrique"]]
+        st.caption(f"Ce rerun : {len(appels)} appel(s), {sum(r['requetes'] for r in appels)} requête(s), "
+                   f"{sum(r['octets'] for r in appels) / 1024:.1f} Ko, {sum(r['ms'] for r in appels):.0f} ms")
+        if appels:
+            df_appels = pd.DataFrame(appels)[["appel", "table", "provenance", "lignes", "octets", "ms",
+                                              "projection", "filtres"]]
+            # Filtres en texte : une colonne de listes n'est pas convertible pour l'affichage
+            df_appels["filtres"] = df_appels["filtres"].map(lambda f: ", ".join(" ".join(map(str, t)) for t in f))
+            st.dataframe(df_appels, hide_index=True, use_container_width=True)
+        st.markdown("**Par page (durée cumulée d'un rerun)**")
+        st.dataframe(pd.DataFrame(instrumentation.rerun_summary()), hide_index=True, use_container_width=True)
+        st.markdown(f"**Par appel ({instrumentation.WINDOW} derniers)**")
+        st.dataframe(pd.DataFrame(instrumentation.summary()), hide_index=True, use_container_width=True)
+
+def panneau_profilage():
+    """Profilage des prochains reruns d'une session et consultation des profils (profiling.py)."""
+    with st.expander("⏱ Profilage des reruns"):
+        sessions = {s["session"]: s for s in profiling.sessions()}
+        if sessions:
+            def libelle_session(session_id):
+                s = sessions[session_id]
+                armes = f" — {s['reruns_armes']} rerun(s) armé(s)" if s["reruns_armes"] else ""
+                return (f"{s['utilisateur'] or 'Anonyme'} — {s['page']} — "
+                        f"vu à {time.strftime('%H:%M:%S', time.localtime(s['vu']))}{armes}")
+
+            session_id = st.selectbox("Session", list(sessions), format_func=libelle_session, key="profil_session")
+            col1, col2, col3 = st.columns([2, 1, 1])
+            nombre = col1.number_input("Reruns à profiler", min_value=1, max_value=profiling.MAX_RERUNS, value=3,
+                                       key="profil_reruns")
+            if col2.button("▶️ Armer", key="profil_armer", use_container_width=True):
+                profiling.arm(session_id, nombre)
+                st.success(f"Les {nombre} prochain(s) rerun(s) de cette session seront profilés.")
+            if col3.button("⏹ Désarmer", key="profil_desarmer", use_container_width=True):
+                profiling.disarm(session_id)
+
+        profils = profiling.list_profiles()
+        if not profils:
+            st.caption("Aucun profil enregistré.")
+            return
+        st.dataframe(pd.DataFrame([
+            {"profil": p["id"], "début": p["debut"], "utilisateur": p["utilisateur"], "page": p["page"],
+             "durée (ms)": p["duree_ms"], "appels": p["appels"], **p["familles"]}
+            for p in profils
+        ]), hide_index=True, use_container_width=True)
+
+        profil_id = st.selectbox("Profil", [p["id"] for p in profils], key="profil_choisi")
+        profil = profiling.load(profil_id)
+        st.markdown("**Temps par famille (ms)**")
+        st.bar_chart(pd.DataFrame({"ms": profil["familles"]}))
+        if profil["filtres"]:
+            st.caption("Filtres : " + " ; ".join(" ".join(map(str, f)) for f in profil["filtres"]))
+        st.markdown("**Fonctions les plus coûteuses**")
+        st.dataframe(pd.DataFrame(profiling.hot_functions(profil)), hide_index=True, use_container_width=True)
+        st.download_button("📥 Piles repliées (flamegraph.pl, speedscope)", profiling.folded(profil),
+                           file_name=f"profil_{profil_id}.folded", mime="text/plain", key="profil_telecharger")
 
 st.markdown("<h1 style='text-align: center;'>Gestion des activités de la section DCP</h1>", unsafe_allow_html=True)
 st.divider()
@@ -227,6 +438,10 @@ st.divider()
 with st.sidebar:
     st.image("imageExcelis.png", width=200)
     st.markdown("<h6 style='text-align: center; color: grey;'><em>Département Cartes et Partenariat DCP</em></h6>", unsafe_allow_html=True)
+    if isinstance(supabase, replica.ReplicatedClient):
+        st.caption(replica.staleness_label(supabase.replica))
+    if st.secrets.get("change_feed"):
+        st.caption(change_feed.status_label())
     
     menu = st.selectbox("Naviguer vers :", [
         "🏠 Accueil",
@@ -242,19 +457,20 @@ with st.sidebar:
         "📦 Visualisation des expéditions",
         "🔐 Gestion des comptes utilisateurs"
     ])
+    # Projections de colonnes déclarées par page (projections.py)
+    data_access.set_page(menu)
+    if contexte_script is not None:
+        profiling.set_page(contexte_script.session_id, st.session_state.get("display_name"), menu)
 
 def accueil_dashboard():
     import pandas as pd
     st.markdown("<h2 style='text-align:center;'>Accueil</h2>", unsafe_allow_html=True)
 # 📦 Carte des lots enregistrés
-    lots_data = supabase.table("lots").select("type_lot", "quantite").execute().data
-    lots_df = pd.DataFrame(lots_data)
-
-# Total des lots
-    total_lots = len(lots_df)
+# Total des lots (agrégats côté base, voir aggregates.py)
+    total_lots = int(aggregates.fetch(supabase, "kpi_lots_totaux")["nb_lots"].iloc[0])
 
 # Agrégation par type
-    repartition = lots_df.groupby("type_lot")["quantite"].sum().reset_index()
+    repartition = aggregates.fetch(supabase, "kpi_lots_par_type")
 
 # Histogramme
     fig = px.bar(repartition, x="type_lot", y="quantite", text="quantite",
@@ -278,16 +494,15 @@ def accueil_dashboard():
 
     
 # 🧪 Carte des tests qualité
-    controle_data = supabase.table("controle_qualite").select("quantite", "quantite_a_tester", "resultat").execute().data
-    controle_df = pd.DataFrame(controle_data)
+    controle_totaux = aggregates.fetch(supabase, "kpi_controle_totaux").iloc[0]
 
 # Calculs
-    total_enregistree = controle_df["quantite"].sum()
-    total_testee = controle_df["quantite_a_tester"].sum()
+    total_enregistree = int(controle_totaux["quantite"])
+    total_testee = int(controle_totaux["quantite_a_tester"])
     pourcentage = round((total_testee / total_enregistree) * 100, 2) if total_enregistree > 0 else 0
 
 # Vérification du taux de réussite
-    taux_100 = controle_df["resultat"].eq("Réussite").all()
+    taux_100 = int(controle_totaux["nb_reussites"] or 0) == int(controle_totaux["nb_tests"])
 
 # Données pour le diagramme en anneau
     donut_data = pd.DataFrame({
@@ -317,8 +532,7 @@ def accueil_dashboard():
     
     
 # 🧪 Carte des tests qualité
-    controle_data = supabase.table("controle_qualite").select("type_carte", "quantite", "quantite_a_tester").execute().data
-    controle_df = pd.DataFrame(controle_data)
+    controle_df = aggregates.fetch(supabase, "kpi_controle_par_filiale_type")
 
 # Calcul du total testé
     total_testee = controle_df["quantite_a_tester"].sum()
@@ -341,13 +555,12 @@ def accueil_dashboard():
     st.divider()
 
 
-# 🔹 Récupération des données des agences
-    agences_data = supabase.table("agences_livraison").select("agence", "pays").execute().data
+# 🔹 Récupération des données des agences (cache des données de référence)
+    agences_data = reference_data.get(supabase).rows("agences_livraison", "agence", "pays")
     agences_df = pd.DataFrame(agences_data)
 
     # 🔹 Récupération des données des expéditions
-    expeditions_data = supabase.table("expedition").select("agence", "pays", "statut").execute().data
-    expeditions_df = pd.DataFrame(expeditions_data)
+    expeditions_df = aggregates.fetch(supabase, "kpi_expeditions")
 
     # ✅ 1. Affichage du total des agences
     total_agences = agences_df["agence"].nunique()
@@ -367,7 +580,7 @@ def accueil_dashboard():
         expeditions_filtre = expeditions_df[expeditions_df["statut"].str.lower() == "expédié"]
 
         # Calculer la quantité par agence et filiale (nombre d'enregistrements)
-        repartition = expeditions_filtre.groupby(["agence", "pays"]).size().reset_index(name="quantite")
+        repartition = expeditions_filtre.groupby(["agence", "pays"])["nb"].sum().reset_index(name="quantite")
 
         # ✅ Graphique combiné : barres groupées par agence et filiale
         fig = px.bar(
@@ -418,19 +631,13 @@ if menu == "🏠 Accueil":
     delta = round(data[-1], 2)
 
     # Récupération des données
-    lots_data = supabase.table("lots").select("*").execute().data
-    controle_data = supabase.table("controle_qualite").select("*").execute().data
+    # Récupération des agrégats (fonctions SQL, voir aggregates.py) : quelques dizaines de lignes
+    totaux_lots = aggregates.fetch(supabase, "kpi_lots_totaux")
+    totaux_controle = aggregates.fetch(supabase, "kpi_controle_totaux")
 
-    if not lots_data or not controle_data:
+    if totaux_lots.empty or not totaux_lots["nb_lots"].iloc[0] or totaux_controle.empty or not totaux_controle["nb_tests"].iloc[0]:
         st.warning("Aucune donnée disponible dans Supabase.")
     else:
-        lots_df = pd.DataFrame(lots_data)
-        controle_df = pd.DataFrame(controle_data)
-
-        # Ajout des filiales aux contrôles
-        lot_filiales = {lot["id"]: lot["filiale"] for lot in lots_data}
-        controle_df["filiale"] = controle_df["lot_id"].map(lot_filiales)
-
         mois_en_fr = {
             'January': 'Janvier', 'February': 'Février', 'March': 'Mars', 'April': 'Avril',
             'May': 'Mai', 'June': 'Juin', 'July': 'Juillet', 'August': 'Août',
@@ -441,42 +648,40 @@ if menu == "🏠 Accueil":
             'Friday': 'Vendredi', 'Saturday': 'Samedi', 'Sunday': 'Dimanche'
         }
 
-        # Conversion des dates
-        lots_df["date_enregistrement"] = pd.to_datetime(lots_df["date_enregistrement"], errors="coerce")
-        controle_df["date_controle"] = pd.to_datetime(controle_df["date_controle"], errors="coerce")
-        controle_df["Jour_Semaine"] = controle_df["date_controle"].dt.day_name().map(semaine_en_fr)     
-        controle_df["Mois"] = controle_df["date_controle"].dt.month_name().map(mois_en_fr)
-        lots_df["Mois"] = lots_df["date_enregistrement"].dt.month_name().map(mois_en_fr)
-        lots_df["Trimestre"] = lots_df["date_enregistrement"].dt.quarter.astype(str)
-        controle_df["Trimestre"] = controle_df["date_controle"].dt.quarter.astype(str)
-      
+        mois_numeros = {i + 1: m for i, m in enumerate(mois_en_fr.values())}
+        jours_iso = {j: i + 1 for i, j in enumerate(semaine_en_fr.values())}
+
+        # Options des filtres : agrégats non filtrés (mois, trimestres, filiales, types, jours présents)
+        lots_par_mois_tous = aggregates.fetch(supabase, "kpi_lots_par_mois")
+        controle_par_mois_tous = aggregates.fetch(supabase, "kpi_controle_par_mois")
+        controle_filiale_type_tous = aggregates.fetch(supabase, "kpi_controle_par_filiale_type")
+        controle_jours_tous = aggregates.fetch(supabase, "kpi_controle_par_jour_semaine")
+
         # Fusionner les mois des deux sources
-        mois_lots = lots_df["Mois"].dropna().unique().tolist()
-        mois_controle = controle_df["Mois"].dropna().unique().tolist()
-        mois_combines = sorted(set(mois_lots + mois_controle), key=lambda x: mois_lots.index(x) if x in mois_lots else mois_controle.index(x))
+        numeros_mois = set(lots_par_mois_tous["mois"].astype(int)) if not lots_par_mois_tous.empty else set()
+        if not controle_par_mois_tous.empty:
+            numeros_mois |= set(controle_par_mois_tous["mois"].str[5:7].astype(int))
+        mois_combines = [mois_numeros[m] for m in sorted(numeros_mois)]
 
         
         # Fusion des trimestres disponibles
-        trimestres_lots = lots_df["Trimestre"].dropna().unique().tolist()
-        trimestres_controle = controle_df["Trimestre"].dropna().unique().tolist()
-        trimestres_combines = sorted(set(trimestres_lots + trimestres_controle), key=lambda x: int(x))
+        trimestres_combines = sorted({str((m + 2) // 3) for m in numeros_mois}, key=lambda x: int(x))
 
         
         st.sidebar.header("🔍 Filtres Graphiques")
 
-        controle_df["date_controle"] = pd.to_datetime(controle_df["date_controle"], errors="coerce")
-        min_date = controle_df["date_controle"].min().date()
-        max_date = controle_df["date_controle"].max().date()
+        min_date, max_date = filter_pushdown.date_bounds(supabase, "controle_qualite", "date_controle")
         date_range = st.sidebar.date_input("Période de contrôle", [min_date, max_date])
 
-        filiales = controle_df["filiale"].dropna().unique().tolist()
+        filiales = controle_filiale_type_tous["filiale"].dropna().unique().tolist()
         filiale_selection = st.sidebar.multiselect("Filiale", filiales, default=filiales)
 
-        types_cartes = controle_df["type_carte"].dropna().unique().tolist()
+        types_cartes = controle_filiale_type_tous["type_carte"].dropna().unique().tolist()
         type_selection = st.sidebar.multiselect("Type de carte", types_cartes, default=types_cartes)
 
         
-        jours = controle_df["Jour_Semaine"].dropna().unique().tolist()
+        jours = [list(semaine_en_fr.values())[j - 1] for j in controle_jours_tous["jour"].astype(int)] \
+            if not controle_jours_tous.empty else []
         jour_selection = st.sidebar.multiselect("Jour de la semaine", jours, default=jours)
 
         
@@ -488,28 +693,25 @@ if menu == "🏠 Accueil":
         trimestre_selection = st.sidebar.multiselect("Trimestre", trimestres_combines, default=trimestres_combines)
 
         
-        controle_df_filtered = controle_df[
-            (controle_df["date_controle"].dt.date >= date_range[0]) &
-            (controle_df["date_controle"].dt.date <= date_range[1]) &
-            (controle_df["filiale"].isin(filiale_selection)) &
-            (controle_df["type_carte"].isin(type_selection)) &
-            (controle_df["Jour_Semaine"].isin(jour_selection)) 
-        ]
-        
-        # Appliquer le filtre aux deux DataFrames
-        lots_df_filtered = lots_df[lots_df["Mois"].isin(mois_selection)]
+        # Filtres transmis aux fonctions d'agrégat (calcul côté base)
+        filtres_controle = aggregates.controle_params(
+            date_range, filiale_selection, type_selection, [jours_iso[j] for j in jour_selection]
+        )
         
-        # Application du filtre aux deux DataFrames
-        lots_df_filtered = lots_df[lots_df["Trimestre"].isin(trimestre_selection)]
+        # Application du filtre trimestre aux lots
+        filtres_lots = {"p_trimestres": [int(t) for t in trimestre_selection]}
+
+        lots_totaux = aggregates.fetch(supabase, "kpi_lots_totaux", **filtres_lots).iloc[0]
+        lots_par_type = aggregates.fetch(supabase, "kpi_lots_par_type", **filtres_lots)
+        lots_par_mois = aggregates.fetch(supabase, "kpi_lots_par_mois", **filtres_lots)
 
 
         # KPIs sur les lots
         st.subheader("Lots Enregistrés")
 
-        total_lots = len(lots_df_filtered)
-        total_cartes = lots_df_filtered["quantite"].sum()
-        moyenne_cartes = lots_df_filtered["quantite"].mean()
-        lots_avec_pin = lots_df_filtered[lots_df_filtered["impression_pin"] == "Oui"].shape[0]
+        total_lots = int(lots_totaux["nb_lots"])
+        total_cartes = int(lots_totaux["total_cartes"])
+        lots_avec_pin = int(lots_totaux["lots_avec_pin"] or 0)
 
         col1, col2, col3= st.columns(3)
 
@@ -522,10 +724,9 @@ if menu == "🏠 Accueil":
         with st.container(border=True):
         # Graphique Mesh3D production mensuelle
 # Conversion des dates et extraction du mois
-            lots_df_filtered["Mois"] = lots_df_filtered["date_enregistrement"].dt.month_name()
-            lots_df_filtered["Mois"] = lots_df_filtered["Mois"].map({'January': 'Janvier', 'February': 'Février', 'March': 'Mars', 'April': 'Avril', 'May': 'Mai', 'June': 'Juin', 'July': 'Juillet', 'August': 'Août', 'September': 'Septembre', 'October': 'Octobre', 'November': 'Novembre', 'December': 'Décembre'})
-# Agrégation mensuelle
-            production_mensuelle = lots_df_filtered.groupby("Mois")["quantite"].sum().reset_index()
+# Agrégation mensuelle (toutes années confondues)
+            production_mensuelle = lots_par_mois.groupby("mois")["quantite"].sum().reset_index()
+            production_mensuelle["Mois"] = production_mensuelle["mois"].map(mois_numeros)
 # Ordre des mois
             mois_ordonne = ["Janvier", "Février", "Mars", "Avril", "Mai", "Juin",
                    "Juillet", "Août", "Septembre", "Octobre", "Novembre", "Décembre"]
@@ -574,8 +775,8 @@ if menu == "🏠 Accueil":
         with col1:
             with st.container(border=True):
         # Graphique cônes 3D par type de lot
-                types_lot = lots_df_filtered["type_lot"].unique().tolist()
-                quantites = lots_df_filtered.groupby("type_lot")["quantite"].sum().tolist()
+                types_lot = lots_par_type["type_lot"].tolist()
+                quantites = lots_par_type["quantite"].tolist()
                 colors = ['lightblue', 'lightgreen', 'lightpink']
                 fig = go.Figure()
                 n_points = 50
@@ -618,9 +819,8 @@ if menu == "🏠 Accueil":
         with col2:
             with st.container(border=True):
         # Graphique cylindres 3D par trimestre
-                lots_df_filtered["Année"] = lots_df_filtered["date_enregistrement"].dt.year
-                lots_df_filtered["Trimestre"] = lots_df_filtered["date_enregistrement"].dt.quarter
-                agg = lots_df_filtered.groupby(["Année", "Trimestre"])["quantite"].sum().reset_index()
+                trimestriel = lots_par_mois.assign(Année=lots_par_mois["annee"], Trimestre=(lots_par_mois["mois"] + 2) // 3)
+                agg = trimestriel.groupby(["Année", "Trimestre"])["quantite"].sum().reset_index()
                 agg["Label"] = agg.apply(lambda row: f"{row['Année']} - T{row['Trimestre']}", axis=1)
                 fig = go.Figure()
                 r = 0.4
@@ -658,8 +858,10 @@ if menu == "🏠 Accueil":
                 st.plotly_chart(fig, use_container_width=True)
 
         with st.container(border=True):
-            lots_df_filtered["mois"] = lots_df_filtered["date_enregistrement"].dt.to_period("M").astype(str)
-            evolution_lots = lots_df_filtered.groupby("mois")["quantite"].sum().reset_index()
+            evolution_lots = pd.DataFrame({
+                "mois": [f"{int(a)}-{int(m):02d}" for a, m in zip(lots_par_mois["annee"], lots_par_mois["mois"])],
+                "quantite": lots_par_mois["quantite"].tolist(),
+            })
             fig = px.line(evolution_lots, x="mois", y="quantite", markers=True,
                 title="📈 Évolution mensuelle des lots enregistrés",
                 labels={"mois": "Mois", "quantite": "Quantité totale"})
@@ -669,12 +871,14 @@ if menu == "🏠 Accueil":
 
         # KPIs sur le contrôle qualité
         st.subheader("Contrôle qualité")
-        total_tests = controle_df_filtered["quantite_a_tester"].sum()
-        nb_reussites = controle_df_filtered[controle_df_filtered["resultat"] == "Réussite"].shape[0]
-        nb_echecs = controle_df_filtered[controle_df_filtered["resultat"] == "Échec"].shape[0]
+        controle_totaux = aggregates.fetch(supabase, "kpi_controle_totaux", **filtres_controle).iloc[0]
+        controle_par_mois = aggregates.fetch(supabase, "kpi_controle_par_mois", **filtres_controle)
+        controle_filiale_type = aggregates.fetch(supabase, "kpi_controle_par_filiale_type", **filtres_controle)
+        total_tests = int(controle_totaux["quantite_a_tester"])
+        nb_reussites = int(controle_totaux["nb_reussites"] or 0)
+        nb_echecs = int(controle_totaux["nb_echecs"] or 0)
         taux_reussite = (nb_reussites / (nb_reussites + nb_echecs)) * 100 if (nb_reussites + nb_echecs) > 0 else 0
         taux_echec = 100 - taux_reussite
-        anomalies = controle_df_filtered[controle_df_filtered["remarque"].notna() & (controle_df_filtered["remarque"] != "")].shape[0]
         col1, col2, col3 = st.columns(3)
         col1.metric("Total cartes testées", total_tests, f"{total_tests} cartes testées", border=True)
         col2.metric("Taux de réussite", f"{taux_reussite:.2f}%", f"{taux_reussite:.2f}% de réussite", border=True)
@@ -683,8 +887,7 @@ if menu == "🏠 Accueil":
         
         with st.container(border=True):
         # Graphique pyramides 3D par mois
-            controle_df_filtered["Mois"] = controle_df_filtered["date_controle"].dt.to_period("M").astype(str)
-            tests_mensuels = controle_df_filtered.groupby("Mois")["quantite_a_tester"].sum().reset_index()
+            tests_mensuels = controle_par_mois.rename(columns={"mois": "Mois"})
             fig = go.Figure()
             base_size = 0.5
             for i, row in tests_mensuels.iterrows():
@@ -722,8 +925,8 @@ if menu == "🏠 Accueil":
 
             with st.container(border=True):
             # Calculs
-                total_enregistree = controle_df["quantite"].sum()
-                total_testee = controle_df["quantite_a_tester"].sum()
+                total_enregistree = int(totaux_controle["quantite"].iloc[0])
+                total_testee = int(totaux_controle["quantite_a_tester"].iloc[0])
                 pourcentage = round((total_testee / total_enregistree) * 100, 2) if total_enregistree > 0 else 0
         # Données pour le diagramme en anneau
                 donut_data = pd.DataFrame({
@@ -740,7 +943,7 @@ if menu == "🏠 Accueil":
 
             with st.container(border=True):
             # Agrégation des données
-                grouped = controle_df_filtered.groupby(["filiale", "type_carte"])["quantite_a_tester"].sum().reset_index()
+                grouped = controle_filiale_type[["filiale", "type_carte", "quantite_a_tester"]]
 
         # Graphique interactif
                 fig = px.bar(
@@ -763,7 +966,7 @@ if menu == "🏠 Accueil":
         with col4:
             with st.container(border=True):
         # Graphique barres par filiale
-                df_grouped = controle_df_filtered.groupby("filiale")["quantite_a_tester"].sum().reset_index()
+                df_grouped = grouped.groupby("filiale")["quantite_a_tester"].sum().reset_index()
                 fig = px.bar(df_grouped, x="filiale", y="quantite_a_tester", text="quantite_a_tester",
                      title="Total des tests par filiale", labels={"filiale": "Filiale", "quantite_a_tester": "Tests"}, height=200)
                 fig.update_traces(textposition="none")
@@ -775,12 +978,10 @@ if menu == "🏠 Accueil":
                 st.plotly_chart(fig, use_container_width=True)
 
             with st.container(border=True):
-        # Conversion des dates
-                controle_df_filtered["date_controle"] = pd.to_datetime(controle_df_filtered["date_controle"], errors="coerce")
-                controle_df_filtered["Mois"] = controle_df_filtered["date_controle"].dt.to_period("M").astype(str)
-
-        # Graphique barres par type de carte
-                fig = px.bar(controle_df_filtered["type_carte"].value_counts().reset_index(), x="type_carte", y="count",
+        # Graphique barres par type de carte (nombre de tests)
+                tests_par_type = controle_filiale_type.groupby("type_carte")["nb_tests"].sum() \
+                    .sort_values(ascending=False).rename("count").reset_index()
+                fig = px.bar(tests_par_type, x="type_carte", y="count",
                      labels={"count": "Type de carte", "type_carte": "Nombre de tests"},
                      title="Tests par type de carte")
                 fig.update_traces(textposition="none")
@@ -791,8 +992,7 @@ if menu == "🏠 Accueil":
                 st.plotly_chart(fig, use_container_width=True)
 
                     # 🔹 Récupération des données des expéditions
-            expeditions_data = supabase.table("expedition").select("agence", "pays", "statut").execute().data
-            expeditions_df = pd.DataFrame(expeditions_data)
+            expeditions_df = aggregates.fetch(supabase, "kpi_expeditions")
         # ✅ 2. Préparation des données pour le graphique
             if not expeditions_df.empty:
         # Filtrer uniquement les expéditions avec statut "expédié"
@@ -800,7 +1000,7 @@ if menu == "🏠 Accueil":
  
                 with st.container(border=True):
         # Calculer la quantité par agence et filiale (nombre d'enregistrements)
-                    repartition = expeditions_filtre.groupby(["agence", "pays"]).size().reset_index(name="quantite")
+                    repartition = expeditions_filtre.groupby(["agence", "pays"])["nb"].sum().reset_index(name="quantite")
 
         # ✅ Graphique combiné : barres groupées par agence et filiale
                     fig = px.bar(
@@ -819,7 +1019,7 @@ if menu == "🏠 Accueil":
             
     # 🔍 Récupération des expéditions
     try:
-        df = pd.DataFrame(supabase.table("expedition").select("statut, agence").execute().data)
+        df = aggregates.fetch(supabase, "kpi_expeditions")
     except Exception as e:
         st.error(f"Erreur lors de la récupération des expéditions : {e}")
         df = pd.DataFrame()
@@ -830,7 +1030,7 @@ if menu == "🏠 Accueil":
         st.divider()
         st.subheader("Répartition des expéditions")
 
-        agence_counts = df["agence"].value_counts().reset_index()
+        agence_counts = df.groupby("agence")["nb"].sum().sort_values(ascending=False).reset_index()
         agence_counts.columns = ["Agence", "Nombre"]
         cols = st.columns(len(agence_counts), border=True)
         for i, row in agence_counts.iterrows():
@@ -839,7 +1039,7 @@ if menu == "🏠 Accueil":
 
         with st.container(border=True):
         # Graphique prévision linéaire
-            monthly_tests = controle_df_filtered.groupby("Mois")["quantite_a_tester"].sum().reset_index()
+            monthly_tests = controle_par_mois.rename(columns={"mois": "Mois"})
             monthly_tests["Mois_Num"] = pd.to_datetime(monthly_tests["Mois"]).map(lambda x: x.toordinal())
             X = monthly_tests[["Mois_Num"]]
             y = monthly_tests["quantite_a_tester"]
@@ -864,10 +1064,9 @@ if menu == "🏠 Accueil":
 
         with st.container(border=True):
         # Graphique courbe 3D par jour de la semaine
-            controle_df_filtered["date_controle"] = pd.to_datetime(controle_df_filtered["date_controle"], errors="coerce")
-            controle_df_filtered["Jour_Semaine"] = controle_df_filtered["date_controle"].dt.day_name()
-            controle_df_filtered["Jour_Semaine"] = controle_df_filtered["Jour_Semaine"].map({'Monday': 'Lundi', 'Tuesday': 'Mardi', 'Wednesday': 'Mercredi', 'Thursday': 'Jeudi', 'Friday': 'Vendredi', 'Saturday': 'Samedi', 'Sunday': 'Dimanche'})
-            tests_par_jour = controle_df_filtered.groupby("Jour_Semaine")["quantite_a_tester"].sum().reset_index()
+            tests_par_jour = aggregates.fetch(supabase, "kpi_controle_par_jour_semaine", **filtres_controle)
+            tests_par_jour["Jour_Semaine"] = tests_par_jour["jour"].map(
+                {i: j for j, i in jours_iso.items()})
             jours_ordonne = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
             tests_par_jour["Jour_Semaine"] = pd.Categorical(tests_par_jour["Jour_Semaine"], categories=jours_ordonne, ordered=True)
             tests_par_jour = tests_par_jour.sort_values("Jour_Semaine")
@@ -894,8 +1093,11 @@ if menu == "🏠 Accueil":
             st.plotly_chart(fig, use_container_width=True)
         
         with st.container(border=True):
-            controle_df_filtered["semaine"] = controle_df_filtered["date_controle"].dt.to_period("W").astype(str)
-            evolution_tests = controle_df_filtered.groupby("semaine")["quantite_a_tester"].sum().reset_index()
+            evolution_tests = aggregates.fetch(supabase, "kpi_controle_par_semaine", **filtres_controle)
+            # Même libellé que pandas to_period("W") : lundi/dimanche
+            evolution_tests["semaine"] = [
+                f"{l}/{(pd.Timestamp(l) + pd.Timedelta(days=6)).date()}" for l in evolution_tests["lundi"]
+            ]
             fig = px.bar(evolution_tests, x="semaine", y="quantite_a_tester",
                      title="Évolution hebdomadaire des tests qualité",
                      labels={"semaine": "Semaine", "quantite_a_tester": "Nombre total de tests"},
@@ -906,63 +1108,41 @@ if menu == "🏠 Accueil":
             st.plotly_chart(fig, use_container_width=True)
     
 elif menu == "➕ Enregistrement des lots":
-    enregistrer_lot()
+    mode = st.radio("Mode d'enregistrement", ["Saisie d'un lot", "Import CSV / Excel"], horizontal=True)
+    if mode == "Saisie d'un lot":
+        enregistrer_lot()
+    else:
+        importer_lots()
 
 
 elif menu == "📋 Visualisation des lots":
-    from supabase import create_client
-    import pandas as pd
-
-    # Connexion à Supabase
-    url = st.secrets["supabase_url"]
-    key = st.secrets["supabase_key"]
-    supabase = create_client(url, key)
-
     st.markdown("## 📋 Visualisation des lots")
     st.divider()
 
     
-# Pagination pour récupérer tous les lots
-    page_size = 1000
-    offset = 0
-    all_lots = []
-
-    while True:
-        response = supabase.table("lots") \
-            .select("*") \
-            .range(offset, offset + page_size - 1) \
-            .execute()
-        
-        if not response.data:
-            break  # Stop si plus de données
-        all_lots.extend(response.data)
-        offset += page_size
-
-    lots_data = all_lots
-
-    if lots_data:
-        df = pd.DataFrame(lots_data)
-        df["date_enregistrement"] = pd.to_datetime(df["date_enregistrement"], errors="coerce")
+# Bornes et options des filtres : petites requêtes de valeurs distinctes (voir filter_pushdown.py)
+    min_date, max_date = filter_pushdown.date_bounds(supabase, "lots", "date_enregistrement")
 
+    if min_date is not None:
         # Filtres latéraux
         st.sidebar.header("🔍 Filtres")
-        min_date = df["date_enregistrement"].min().date()
-        max_date = df["date_enregistrement"].max().date()
         date_range = st.sidebar.date_input("Date d'enregistrement", [min_date, max_date])
 
-        filiales = df["filiale"].dropna().unique().tolist()
+        filiales = filter_pushdown.distinct_values(supabase, "lots", "filiale")
         filiale_selection = st.sidebar.multiselect("Filiale", filiales, default=filiales)
 
-        types_lot = df["type_lot"].dropna().unique().tolist()
+        types_lot = filter_pushdown.distinct_values(supabase, "lots", "type_lot")
         type_selection = st.sidebar.multiselect("Type de lot", types_lot, default=types_lot)
 
-        # Application des filtres
-        df_filtered = df[
-            (df["date_enregistrement"].dt.date >= date_range[0]) &
-            (df["date_enregistrement"].dt.date <= date_range[1]) &
-            (df["filiale"].isin(filiale_selection)) &
-            (df["type_lot"].isin(type_selection))
-        ]
+        # Application des filtres côté serveur : seuls les lots retenus sont téléchargés
+        filtres = filter_pushdown.FilterSet() \
+            .date_range("date_enregistrement", date_range) \
+            .isin("filiale", filiale_selection, filiales) \
+            .isin("type_lot", type_selection, types_lot)
+        df_filtered = filtres.fetch(supabase, "lots")
+        if not df_filtered.empty:
+            df_filtered["date_enregistrement"] = pd.to_datetime(df_filtered["date_enregistrement"], errors="coerce")
+        df = df_filtered
                 
 # --- KPIs : Quantité des cartes par type de lot ---
         with st.container(border=True):
@@ -1018,6 +1198,7 @@ elif menu == "📋 Visualisation des lots":
                     border=True
                 )
         st.dataframe(df_filtered, use_container_width=True)
+        bouton_export("lots", filtres, "lots")
         st.divider()
 
 # -- État de navigation local à la gestion des lots --
@@ -1096,7 +1277,7 @@ elif menu == "📋 Visualisation des lots":
                                 new_cartes_test = math.ceil(new_quantite / 50)
                                 submit_mod = st.form_submit_button("✅ Enregistrer les modifications")
                                 if submit_mod:
-                                    supabase.table("lots").update({
+                                    data_access.update_rows(supabase, "lots", {
                                         "nom_lot": new_nom,
                                         "type_lot": new_type,
                                         "quantite": int(new_quantite),
@@ -1106,7 +1287,7 @@ elif menu == "📋 Visualisation des lots":
                                         "impression_pin": new_impression,
                                         "nombre_pin": int(new_nombre_pin) if new_impression == "Oui" else 0,
                                         "cartes_a_tester": int(new_cartes_test)
-                                    }).eq("id", lot_id).execute()
+                                    }, [("eq", "id", lot_id)])
                                     st.success("✅ Lot modifié avec succès.")
                                     st.session_state["lot_action"] = None
                                     st.session_state["lot_id_cible"] = None
@@ -1136,7 +1317,7 @@ elif menu == "📋 Visualisation des lots":
                     colA, colB = st.columns(2)
                     with colA:
                         if st.button("🗑️ Supprimer définitivement", type="primary", use_container_width=True):
-                            supabase.table("lots").delete().eq("id", lot_id).execute()
+                            data_access.delete_rows(supabase, "lots", [("eq", "id", lot_id)])
                             st.warning("🗑️ Lot supprimé.")
                             st.session_state["lot_action"] = None
                             st.session_state["lot_id_cible"] = None
@@ -1150,20 +1331,10 @@ elif menu == "📋 Visualisation des lots":
 
 
 elif menu == "✏️ Modification/Suppression Lot":
-    from supabase import create_client
-    import pandas as pd
-    import math
-
-    # Connexion à Supabase
-    url = st.secrets["supabase_url"]
-    key = st.secrets["supabase_key"]
-    supabase = create_client(url, key)
-
     st.markdown("## ✏️ Modifier ou supprimer un lot")
 
     # Récupération des lots
-    response = supabase.table("lots").select("*").execute()
-    lots_data = response.data
+    lots_data = data_access.fetch_rows(supabase, "lots", "*")
 
     if lots_data:
         df = pd.DataFrame(lots_data)
@@ -1190,7 +1361,7 @@ elif menu == "✏️ Modification/Suppression Lot":
             mod_submit = st.form_submit_button("✅ Modifier le lot")
 
             if mod_submit:
-                supabase.table("lots").update({
+                data_access.update_rows(supabase, "lots", {
                     "nom_lot": new_nom,
                     "type_lot": new_type,
                     "quantite": new_quantite,
@@ -1200,12 +1371,12 @@ elif menu == "✏️ Modification/Suppression Lot":
                     "impression_pin": new_impression,
                     "nombre_pin": new_nombre_pin,
                     "cartes_a_tester": new_cartes_test
-                }).eq("id", selected_id).execute()
+                }, [("eq", "id", selected_id)])
                 st.success("✅ Lot modifié avec succès.")
                 st.rerun()
 
         if st.button("🗑️ Supprimer ce lot"):
-            supabase.table("lots").delete().eq("id", selected_id).execute()
+            data_access.delete_rows(supabase, "lots", [("eq", "id", selected_id)])
             st.warning("🗑️ Lot supprimé avec succès.")
             st.rerun()
     else:
@@ -1213,44 +1384,21 @@ elif menu == "✏️ Modification/Suppression Lot":
 
 
 elif menu == "🧪 Contrôle qualité":
-    from supabase import create_client
-    import math
-    from datetime import date
-
-    # Connexion à Supabase
-    url = st.secrets["supabase_url"]
-    key = st.secrets["supabase_key"]
-    supabase = create_client(url, key)
-
     st.markdown("## 🧪 Contrôle qualité")
     st.divider()
 
     # Récupération des lots
-    response = supabase.table("lots").select("id", "nom_lot").execute()
-    lots = response.data
+    lots = data_access.fetch_rows(supabase, "lots", "id, nom_lot")
     if not lots:
         st.warning("Aucun lot disponible.")
         st.stop()
 
     # 🔍 Récupérer tous les lots
-    lots_response = supabase.table("lots").select("id", "nom_lot").execute()
-    lots = lots_response.data
-    
-    # Pagination pour récupérer tous les lot_id contrôlés
-    page_size = 1000
-    offset = 0
-    lots_controles = []
-
-    while True:
-        controle_response = supabase.table("controle_qualite") \
-            .select("lot_id") \
-            .range(offset, offset + page_size - 1) \
-            .execute()
+    lots = data_access.fetch_rows(supabase, "lots", "id, nom_lot")
     
-        if not controle_response.data:
-            break
-        lots_controles.extend([row["lot_id"] for row in controle_response.data])
-        offset += page_size
+    # lot_id déjà contrôlés (miroir incrémental de controle_qualite)
+    df_controles = delta_sync.synced_df(supabase, "controle_qualite", "lot_id")
+    lots_controles = set(df_controles["lot_id"]) if not df_controles.empty else set()
 
     # ✅ Filtrer les lots non contrôlés
     lots_non_controles = [lot for lot in lots if lot["id"] not in lots_controles]
@@ -1297,26 +1445,58 @@ elif menu == "🧪 Contrôle qualité":
     remarque = st.text_area("Remarques / Anomalies", value="RAS")
     resultat_test = st.radio("Résultat du test :", ["Reussite", "Échec"], key="resultat_test")
     
-    if st.button("Enregistrer le contrôle qualité"):             
-            for type_carte in types_selectionnes:
-                last_id_data = supabase.table("controle_qualite").select("id").order("id", desc=True).limit(1).execute().data
-                next_id = (last_id_data[0]["id"] + 1) if last_id_data else 1
-                supabase.table("controle_qualite").insert({
-                    "id": next_id,
-                    "lot_id": lot_id,
-                    "type_carte": type_carte,
-                    "quantite": quantites[type_carte],
-                    "quantite_a_tester": quantites_a_tester[type_carte],
-                    "date_controle": str(date.today()),
-                    "remarque": remarque,
-                    "resultat": resultat_test
-                }).execute()
-            st.success("✅ Contrôle qualité enregistré avec succès.")
-            st.rerun()
+    if st.button("Enregistrer le contrôle qualité"):
+            # Ids réservés gardés en session pour ce formulaire jusqu'au succès de l'insertion :
+            # un nouvel essai après une erreur réseau (accusé perdu) reprend les mêmes ids et se
+            # heurte à la clé primaire au lieu de dupliquer le contrôle
+            formulaire = [lot_id, list(types_selectionnes)]
+            reservation = st.session_state.get("controle_ids_reserves")
+            if not reservation or reservation["formulaire"] != formulaire:
+                reservation = {
+                    "formulaire": formulaire,
+                    "ids": id_allocator.reserve(supabase, "controle_qualite", len(types_selectionnes)),
+                }
+                st.session_state["controle_ids_reserves"] = reservation
+            lignes = [{
+                "id": next_id,
+                "lot_id": lot_id,
+                "type_carte": type_carte,
+                "quantite": quantites[type_carte],
+                "quantite_a_tester": quantites_a_tester[type_carte],
+                "date_controle": str(date.today()),
+                "remarque": remarque,
+                "resultat": resultat_test
+            } for next_id, type_carte in zip(reservation["ids"], types_selectionnes)]
+            enregistre = True
+            try:
+                # Un seul INSERT multi-lignes : tous les types sont enregistrés, ou aucun
+                if lignes:
+                    data_access.insert_rows(supabase, "controle_qualite", lignes)
+            except Exception as e:
+                enregistre = False
+                if str(getattr(e, "code", "")) != "23505":
+                    st.error(f"❌ Contrôle non enregistré, vous pouvez réessayer : {e}")
+                else:
+                    # 23505 sur ces ids : l'essai précédent avait abouti ; succès seulement si les lignes
+                    # en base sont celles du formulaire (sinon les modifications faites depuis sont perdues)
+                    en_base = {r["id"]: r for r in data_access.select_rows(
+                        supabase, "controle_qualite", list(lignes[0]), [("in_", "id", reservation["ids"])])}
+                    enregistre = all(
+                        {k: str(v) for k, v in en_base.get(ligne["id"], {}).items()}
+                        == {k: str(v) for k, v in ligne.items()}
+                        for ligne in lignes)
+                    if not enregistre:
+                        st.session_state.pop("controle_ids_reserves", None)
+                        st.error("❌ Un essai précédent a enregistré ce contrôle avec d'autres valeurs : "
+                                 "vos modifications ne sont pas enregistrées. Vérifiez l'inventaire des tests.")
+            if enregistre:
+                st.session_state.pop("controle_ids_reserves", None)
+                st.success("✅ Contrôle qualité enregistré avec succès.")
+                st.rerun()
    
     if types_selectionnes:
     # Récupération des infos du lot sélectionné
-            lot_info = supabase.table("lots").select("*").eq("id", lot_id).execute().data
+            lot_info = data_access.fetch_rows(supabase, "lots", filters=[("eq", "id", lot_id)])
             lot_info = lot_info[0] if lot_info else {}
 
             st.markdown("## 📋 Fiche complète de contrôle qualité")
@@ -1371,7 +1551,7 @@ elif menu == "🧪 Contrôle qualité":
 
 
 # 1) Récupérer proprement les infos du lot (lot_id existe déjà dans ta page Contrôle qualité)
-            _lot_rows = supabase.table("lots").select("*").eq("id", lot_id).execute().data or []
+            _lot_rows = data_access.fetch_rows(supabase, "lots", filters=[("eq", "id", lot_id)]) or []
             lot_info = _lot_rows[0] if _lot_rows else {}
             lot_info.setdefault("id", lot_id)  # au cas où
 
@@ -1562,36 +1742,13 @@ elif menu == "🗂 Inventaire des tests":
     st.markdown("## 🗂 Inventaire du contrôle qualité")
     st.divider()
 
-    # Pagination pour récupérer toutes les lignes
-    page_size = 1000
-    offset = 0
-    all_data = []
+    # Récupération des noms de lots et filiales (miroir incrémental, 3 colonnes)
+    lots_rows = delta_sync.synced_df(supabase, "lots", "id, nom_lot, filiale")
+    lots_data = {lot["id"]: (lot["nom_lot"], lot["filiale"]) for lot in lots_rows.to_dict("records")}
 
-    while True:
-        response = supabase.table("controle_qualite") \
-            .select("id, date_controle, type_carte, quantite, quantite_a_tester, remarque, resultat, lot_id") \
-            .range(offset, offset + page_size - 1) \
-            .execute()
-    
-        if not response.data:
-            break  # Stop si plus de données
-        all_data.extend(response.data)
-        offset += page_size
+    # Bornes de la période : première et dernière date_controle
+    date_min, date_max = filter_pushdown.date_bounds(supabase, "controle_qualite", "date_controle")
 
-    controle_data = all_data
-
-    # Récupération des noms de lots et filiales
-    lots_response = supabase.table("lots").select("id, nom_lot, filiale").execute()
-    lots_data = {lot["id"]: (lot["nom_lot"], lot["filiale"]) for lot in lots_response.data}
-
-    # Fusion des données
-    for row in controle_data:
-        lot_info = lots_data.get(row["lot_id"], ("Inconnu", ""))
-        row["nom_lot"] = lot_info[0]
-        row["filiale"] = lot_info[1]
-
-    df = pd.DataFrame(controle_data)
-    
     mois_en_fr = {
             'January': 'Janvier', 'February': 'Février', 'March': 'Mars', 'April': 'Avril',
             'May': 'Mai', 'June': 'Juin', 'July': 'Juillet', 'August': 'Août',
@@ -1602,36 +1759,48 @@ elif menu == "🗂 Inventaire des tests":
             'Friday': 'Vendredi', 'Saturday': 'Samedi', 'Sunday': 'Dimanche'
         }
 
-    if df.empty:
+    if date_min is None:
         st.warning("Aucun test de contrôle qualité enregistré.")
     else:
-        df["date_controle"] = pd.to_datetime(df["date_controle"])
-        df["Année"] = df["date_controle"].dt.year
-        df["Mois"] = df["date_controle"].dt.month_name().map(mois_en_fr)
-        df["Trimestre"] = df["date_controle"].dt.quarter
-        df["Semaine"] = df["date_controle"].dt.isocalendar().week
-        df["Jour"] = df["date_controle"].dt.day
-        df["Jour_Semaine"] = df["date_controle"].dt.day_name().map(semaine_en_fr)
-
         # Filtres
         st.sidebar.header("🔎 Filtres Inventaire")
-        date_min = df["date_controle"].min().date()
-        date_max = df["date_controle"].max().date()
         date_range = st.sidebar.date_input("Période de contrôle", [date_min, date_max])
-        lots = df["nom_lot"].unique().tolist()
+        # Options limitées aux lots qui ont des tests (lot_id de controle_qualite, miroir incrémental)
+        lots_testes = lots_rows
+        if not lots_rows.empty:
+            ids_testes = delta_sync.synced_df(supabase, "controle_qualite", "lot_id")
+            ids_testes = set(ids_testes["lot_id"]) if not ids_testes.empty else set()
+            lots_testes = lots_rows[lots_rows["id"].isin(ids_testes)]
+        lots = lots_testes["nom_lot"].dropna().unique().tolist() if not lots_testes.empty else []
         lot_selection = st.sidebar.multiselect("Nom du lot", lots, default=lots)
-        filiales = df["filiale"].unique().tolist()
+        filiales = lots_testes["filiale"].dropna().unique().tolist() if not lots_testes.empty else []
         filiale_selection = st.sidebar.multiselect("Filiale", filiales, default=filiales)
-        resultats = df["resultat"].unique().tolist()
+        resultats = filter_pushdown.distinct_values(supabase, "controle_qualite", "resultat")
         resultat_selection = st.sidebar.multiselect("Résultat", resultats, default=resultats)
 
-        df_filtered = df[
-            (df["date_controle"].dt.date >= date_range[0]) &
-            (df["date_controle"].dt.date <= date_range[1]) &
-            (df["nom_lot"].isin(lot_selection)) &
-            (df["filiale"].isin(filiale_selection)) &
-            (df["resultat"].isin(resultat_selection))
-        ]
+        # Nom du lot et filiale vivent sur lots : traduits en lot_id côté serveur
+        filtres = filter_pushdown.FilterSet() \
+            .date_range("date_controle", date_range) \
+            .isin("resultat", resultat_selection, resultats)
+        if len(lot_selection) < len(lots) or len(filiale_selection) < len(filiales):
+            lots_retenus = lots_testes[lots_testes["nom_lot"].isin(lot_selection) & lots_testes["filiale"].isin(filiale_selection)]
+            filtres.isin("lot_id", lots_retenus["id"].tolist(), lots_testes["id"].tolist())
+        df = filtres.fetch(supabase, "controle_qualite",
+                           "id, date_controle, type_carte, quantite, quantite_a_tester, remarque, resultat, lot_id")
+
+        # Fusion des données
+        if not df.empty:
+            lot_infos = df["lot_id"].map(lambda i: lots_data.get(i, ("Inconnu", "")))
+            df["nom_lot"] = lot_infos.str[0]
+            df["filiale"] = lot_infos.str[1]
+            df["date_controle"] = pd.to_datetime(df["date_controle"])
+            df["Année"] = df["date_controle"].dt.year
+            df["Mois"] = df["date_controle"].dt.month_name().map(mois_en_fr)
+            df["Trimestre"] = df["date_controle"].dt.quarter
+            df["Semaine"] = df["date_controle"].dt.isocalendar().week
+            df["Jour"] = df["date_controle"].dt.day
+            df["Jour_Semaine"] = df["date_controle"].dt.day_name().map(semaine_en_fr)
+        df_filtered = df
 
         # KPIs
         with st.container(border=True):
@@ -1645,6 +1814,14 @@ elif menu == "🗂 Inventaire des tests":
             col3.metric("❌Tests échoués", nb_echecs, f"{nb_echecs} tests échoués", border=True)
 
         st.dataframe(df_filtered, use_container_width=True)
+
+        def noms_des_lots(page):
+            lot_infos = page["lot_id"].map(lambda i: lots_data.get(i, ("Inconnu", "")))
+            return page.assign(nom_lot=lot_infos.str[0], filiale=lot_infos.str[1])
+
+        bouton_export("controle_qualite", filtres, "controle_qualite",
+                      "id, date_controle, type_carte, quantite, quantite_a_tester, remarque, resultat, lot_id",
+                      transform=noms_des_lots)
         st.divider()
 
         
@@ -1715,13 +1892,13 @@ elif menu == "🗂 Inventaire des tests":
                                 new_remarque = st.text_area("Remarque", value=record["remarque"] or "")
                                 submit_mod = st.form_submit_button("✅ Mettre à jour")
                                 if submit_mod:
-                                    supabase.table("controle_qualite").update({
+                                    data_access.update_rows(supabase, "controle_qualite", {
                                         "type_carte": new_type,
                                         "quantite": new_quantite,
                                         "quantite_a_tester": new_quantite_test,
                                         "resultat": new_resultat,
                                         "remarque": new_remarque
-                                    }).eq("id", st.session_state["test_id_cible"]).execute()
+                                    }, [("eq", "id", st.session_state["test_id_cible"])])
                                     st.success("✅ Test modifié avec succès.")
                                     st.session_state["test_action"] = None
                                     st.session_state["test_id_cible"] = None
@@ -1785,7 +1962,7 @@ elif menu == "🗂 Inventaire des tests":
                             if st.button("🗑️ Supprimer le test sélectionné", type="primary",
                                 use_container_width=True, disabled=not confirm_one):
                                 try:
-                                    supabase.table("controle_qualite").delete().eq("id", int(st.session_state["test_id_cible"])).execute()
+                                    data_access.delete_rows(supabase, "controle_qualite", [("eq", "id", int(st.session_state["test_id_cible"]))])
                                     st.warning("🗑️ Test supprimé.")
                                     st.session_state["test_action"] = None
                                     st.session_state["test_id_cible"] = None
@@ -1800,7 +1977,7 @@ elif menu == "🗂 Inventaire des tests":
                                 try:
                                     ids = [int(i) for i in df_filtered["id"].tolist()]
                                     if ids:
-                                        supabase.table("controle_qualite").delete().in_("id", ids).execute()
+                                        data_access.delete_rows(supabase, "controle_qualite", [("in_", "id", ids)])
                                         st.warning(f"🧹 {len(ids)} tests supprimés (jeu filtré).")
                                         st.session_state["test_action"] = None
                                         st.session_state["test_id_cible"] = None
@@ -1819,13 +1996,16 @@ elif menu == "🗂 Inventaire des tests":
 if menu == "📦 Conditionnement des cartes":
     st.markdown("## 📦 Conditionnement des cartes")
     st.divider()
+    etat_file_ecritures("conditionnement")
 
     # Sélection de la date
     selected_date = st.date_input("📅 Sélectionnez une date", value=date.today())
 
     # Récupération des lots enregistrés à cette date
-    response = supabase.table("lots").select("id, nom_lot, type_lot, quantite, filiale, date_enregistrement").eq("date_enregistrement", str(selected_date)).execute()
-    lots_data = response.data
+    lots_data = data_access.fetch_rows(
+        supabase, "lots", "id, nom_lot, type_lot, quantite, filiale, date_enregistrement",
+        [("eq", "date_enregistrement", str(selected_date))],
+    )
 
     if not lots_data:
         st.warning("Aucune filiale n'a enregistré de lots à cette date.")
@@ -1853,8 +2033,10 @@ if menu == "📦 Conditionnement des cartes":
 
             
 # Récupération des cartes VIP enregistrées
-            vip_response = supabase.table("controle_qualite").select("type_carte, quantite").in_("lot_id", [lot[0] for lot in lots_groupes]).execute()
-            vip_data = vip_response.data if vip_response.data else []
+            vip_data = data_access.fetch_rows(
+                supabase, "controle_qualite", "type_carte, quantite",
+                [("in_", "lot_id", [int(lot[0]) for lot in lots_groupes])],
+            )
 
             qte_gold = sum(row["quantite"] for row in vip_data if "gold" in row["type_carte"].lower())
             qte_infinite = sum(row["quantite"] for row in vip_data if "infinite" in row["type_carte"].lower())
@@ -1914,92 +2096,84 @@ if menu == "📦 Conditionnement des cartes":
 
         # ✅ Enregistrement dans Supabase
         if st.button("✅ Enregistrer le conditionnement"):
+            # Un paquet par clé (nom_lot, date, emballage, filiale) : contrainte conditionnement_unique_paquet
+            paquets_a_enregistrer = {}
             for _, row in df_conditionnement.iterrows():
-                nom_lot = row.get("Nom du lot")
-                type_emballage = row.get("Conditionnement")
-                filiale = row.get("Filiale")
-
-        # 🔍 Vérification des doublons
-                doublon = supabase.table("conditionnement").select("id")\
-                .eq("nom_lot", nom_lot)\
-                .eq("date_conditionnement", str(selected_date))\
-                .eq("type_emballage", type_emballage)\
-                .eq("filiale", filiale).execute().data
-
-                if doublon:
+                cle = (row.get("Nom du lot"), row.get("Conditionnement"), row.get("Filiale"))
+                paquets_a_enregistrer.setdefault(cle, {
+                    "lot_id": None,
+                    "type_lot": row["Type de lot"],
+                    "filiale": row.get("Filiale"),
+                    "type_emballage": row.get("Conditionnement"),
+                    "nombre_cartes": row["Quantité"],
+                    "date_conditionnement": str(selected_date),
+                    "operateur": st.session_state["utilisateur"],
+                    "remarque": row["Remarque"],
+                    "packs": row["Packs VIP"],
+                    "nom_lot": row.get("Nom du lot")
+                })
+
+            # ✅ Un seul upsert (via la file d'écritures) : les doublons sont ignorés côté base,
+            # seules les lignes créées reviennent
+            statut_envoi, crees, erreur_envoi = file_ecritures.submit(
+                supabase, "conditionnement", list(paquets_a_enregistrer.values()),
+                on_conflict="nom_lot,date_conditionnement,type_emballage,filiale",
+                user_id=st.session_state.get("user_id"),
+            ) if paquets_a_enregistrer else (write_queue.ENVOYE, [], None)
+            if statut_envoi == write_queue.EN_ATTENTE:
+                st.info("📥 Connexion indisponible : conditionnement enregistré localement, "
+                        "il sera envoyé dès le retour de la connexion.")
+                paquets_a_enregistrer = {}
+            elif statut_envoi != write_queue.ENVOYE:
+                st.error(f"❌ Conditionnement refusé : {erreur_envoi}")
+                paquets_a_enregistrer = {}
+            cles_creees = {(r.get("nom_lot"), r.get("type_emballage"), r.get("filiale")) for r in crees}
+
+            for nom_lot, type_emballage, filiale in paquets_a_enregistrer:
+                if (nom_lot, type_emballage, filiale) not in cles_creees:
                     st.warning(f"⚠️ Le conditionnement du lot {nom_lot} ({type_emballage}) pour la filiale {filiale} à la date {selected_date} existe déjà.")
-                else:
-            # ✅ Enregistrement si pas de doublon
-                    supabase.table("conditionnement").insert({
-                        "lot_id": None,
-                        "type_lot": row["Type de lot"],
-                        "filiale": filiale,
-                        "type_emballage": type_emballage,
-                        "nombre_cartes": row["Quantité"],
-                        "date_conditionnement": str(selected_date),
-                        "operateur": st.session_state["utilisateur"],
-                        "remarque": row["Remarque"],
-                        "packs": row["Packs VIP"],
-                        "nom_lot": nom_lot
-                    }).execute()
-                    st.success("✅ Conditionnement enregistré avec succès.")
+            if crees:
+                st.success(f"✅ Conditionnement enregistré avec succès ({len(crees)} nouveau(x), "
+                           f"{len(paquets_a_enregistrer) - len(crees)} déjà existant(s)).")
 
 #Inventaire de conditionnements
 elif menu == "🗂 Inventaire des conditionnements":
     st.markdown("## 🗂 Inventaire des conditionnements")
     st.divider()
 
-# Pagination pour récupérer tous les conditionnements
-    page_size = 1000
-    offset = 0
-    all_conditionnements = []
-
-    while True:
-        response = supabase.table("conditionnement") \
-            .select("*") \
-            .range(offset, offset + page_size - 1) \
-            .execute()
-        
-        if not response.data:
-            break  # Stop si plus de données
-        all_conditionnements.extend(response.data)
-        offset += page_size
-
-    data = all_conditionnements
+# Bornes et options des filtres : valeurs distinctes (voir filter_pushdown.py)
+    date_min, date_max = filter_pushdown.date_bounds(supabase, "conditionnement", "date_conditionnement")
 
-    if not data:
+    if date_min is None:
         st.warning("Aucun conditionnement enregistré.")
     else:
-        df = pd.DataFrame(data)
-        df["date_conditionnement"] = pd.to_datetime(df["date_conditionnement"], errors="coerce")
-
         # Filtres
         st.sidebar.header("🔍 Filtres")
-        date_min = df["date_conditionnement"].min().date()
-        date_max = df["date_conditionnement"].max().date()
         date_range = st.sidebar.date_input("📅 Période", [date_min, date_max])
 
-        filiales = df["filiale"].dropna().unique().tolist()
+        filiales = filter_pushdown.distinct_values(supabase, "conditionnement", "filiale")
         filiale_selection = st.sidebar.multiselect("🏢 Filiale", filiales, default=filiales)
 
-        types_lot = df["type_lot"].dropna().unique().tolist()
+        types_lot = filter_pushdown.distinct_values(supabase, "conditionnement", "type_lot")
         type_selection = st.sidebar.multiselect("🎯 Type de lot", types_lot, default=types_lot)
 
-        emballages = df["type_emballage"].dropna().unique().tolist()
+        emballages = filter_pushdown.distinct_values(supabase, "conditionnement", "type_emballage")
         emballage_selection = st.sidebar.multiselect("📦 Type d'emballage", emballages, default=emballages)
 
-        operateurs = df["operateur"].dropna().unique().tolist()
+        operateurs = filter_pushdown.distinct_values(supabase, "conditionnement", "operateur")
         operateur_selection = st.sidebar.multiselect("👤 Opérateur", operateurs, default=operateurs)
 
-        # Application des filtres
-        df_filtered = df[
-            (df["date_conditionnement"].dt.date >= date_range[0]) &
-            (df["date_conditionnement"].dt.date <= date_range[1]) &
-            (df["filiale"].isin(filiale_selection)) &
-            (df["type_lot"].isin(type_selection)) &
-            (df["type_emballage"].isin(emballage_selection)) &
-            (df["operateur"].isin(operateur_selection))
-        ]
+        # Application des filtres côté serveur (gte / lte / in_)
+        filtres = filter_pushdown.FilterSet() \
+            .date_range("date_conditionnement", date_range) \
+            .isin("filiale", filiale_selection, filiales) \
+            .isin("type_lot", type_selection, types_lot) \
+            .isin("type_emballage", emballage_selection, emballages) \
+            .isin("operateur", operateur_selection, operateurs)
+        df_filtered = filtres.fetch(supabase, "conditionnement")
+        if not df_filtered.empty:
+            df_filtered["date_conditionnement"] = pd.to_datetime(df_filtered["date_conditionnement"], errors="coerce")
+        df = df_filtered
                         
 # --- KPIs Inventaire des conditionnements ---
     with st.container(border=True):
@@ -2044,10 +2218,12 @@ elif menu == "🗂 Inventaire des conditionnements":
 
     colonnes = ["id", "nom_lot", "type_lot", "filiale", "type_emballage", "nombre_cartes", "packs", "remarque", "operateur", "date_conditionnement"]
     st.dataframe(df_filtered[colonnes], use_container_width=True)
+    if date_min is not None:
+        bouton_export("conditionnements", filtres, "conditionnement", colonnes)
 
         # Bouton global pour tout effacer
     if st.button("🧹 Effacer le contenu du tableau"):
-        supabase.table("conditionnement").delete().execute()
+        data_access.delete_rows(supabase, "conditionnement")
         st.warning("🧹 Tous les conditionnements ont été supprimés.")
         st.rerun()
       
@@ -2114,11 +2290,11 @@ elif menu == "🗂 Inventaire des conditionnements":
                     submit = st.form_submit_button("✅ Enregistrer les modifications")
 
                     if submit:
-                        supabase.table("conditionnement").update({
+                        data_access.update_rows(supabase, "conditionnement", {
                             "remarque": new_remarque,
                             "type_emballage": new_emballage,
                             "nombre_cartes": int(new_qte)
-                        }).eq("id", cond_id).execute()
+                        }, [("eq", "id", cond_id)])
 
                         st.success("✅ Conditionnement modifié avec succès.")
                         st.session_state["cond_action"] = None
@@ -2153,7 +2329,7 @@ elif menu == "🗂 Inventaire des conditionnements":
         # Suppression unitaire
                 with col1:
                     if st.button("🗑️ Supprimer le conditionnement sélectionné", type="primary", use_container_width=True):
-                        supabase.table("conditionnement").delete().eq("id", cond_id).execute()
+                        data_access.delete_rows(supabase, "conditionnement", [("eq", "id", cond_id)])
                         st.warning("🗑️ Conditionnement supprimé.")
                         st.session_state["cond_action"] = None
                         st.session_state["cond_id"] = None
@@ -2163,7 +2339,7 @@ elif menu == "🗂 Inventaire des conditionnements":
                 with col2:
                     if st.button("🧹 Supprimer tous les conditionnements filtrés", use_container_width=True):
                         ids = [int(i) for i in df_filtered["id"].tolist()]
-                        supabase.table("conditionnement").delete().in_("id", ids).execute()
+                        data_access.delete_rows(supabase, "conditionnement", [("in_", "id", ids)])
                         st.warning(f"🧹 {len(ids)} conditionnements supprimés.")
                         st.session_state["cond_action"] = None
                         st.session_state["cond_id"] = None
@@ -2179,10 +2355,10 @@ elif menu == "⚙️ Gestion des agences":
     st.markdown("## ⚙️ Gestion des agences")
     st.divider()
 
-    # 📋 Liste des agences existantes   
+    # 📋 Liste des agences existantes (cache des données de référence, vidé par les ajouts/modifications/suppressions)
     try:
-        response = supabase.table("agences_livraison").select("*").execute()
-        df_agences = pd.DataFrame(response.data)
+        refs = reference_data.get(supabase)
+        df_agences = pd.DataFrame(refs.rows("agences_livraison"))
         
     except Exception as e:
         st.error(f"Erreur lors de la lecture des données : {e}")
@@ -2190,16 +2366,14 @@ elif menu == "⚙️ Gestion des agences":
     # --- 📊 Indicateurs des agences (style Inventaire des tests) ---
     try:
         # Récupération des agences
-        resp_ag = supabase.table("agences_livraison").select("*").execute()
-        df_agences = pd.DataFrame(resp_ag.data or [])
+        refs = reference_data.get(supabase)
+        df_agences = pd.DataFrame(refs.rows("agences_livraison"))
 
         # Récupération des livreurs (pour les indicateurs liés)
-        resp_lv = supabase.table("livreurs").select("agence, id").execute()
-        df_livreurs = pd.DataFrame(resp_lv.data or [])
+        df_livreurs = pd.DataFrame(refs.rows("livreurs", "agence", "id"))
 
         # Récupération des expéditions (pour les indicateurs liés)
-        resp_ex = supabase.table("expedition").select("agence, statut").execute()
-        df_expeditions = pd.DataFrame(resp_ex.data or [])
+        df_expeditions = data_access.fetch_df(supabase, "expedition", "agence, statut")
     except Exception as e:
         st.error(f"Erreur de lecture des indicateurs : {e}")
         df_agences = pd.DataFrame()
@@ -2306,12 +2480,12 @@ elif menu == "⚙️ Gestion des agences":
                             if doublon:
                                 st.warning(f"⚠️ L'agence '{nouvelle_agence}' pour le pays '{nouveau_pays}' existe déjà.")
                             else:
-                                supabase.table("agences_livraison").insert({
+                                data_access.insert_rows(supabase, "agences_livraison", {
                                     "pays": nouveau_pays,
                                     "agence": nouvelle_agence,                                    
                                     "created_by": created_by,
                                     "operateur": operateur
-                                }).execute()
+                                })
                                 st.success(f"✅ Agence ajoutée pour {nouveau_pays}")
                                 st.session_state["agence_action"] = None
                                 st.rerun()
@@ -2328,8 +2502,7 @@ elif menu == "⚙️ Gestion des agences":
             st.subheader("✏️ Modifier une agence existante")
 
     # Charger la liste des agences
-            response = supabase.table("agences_livraison").select("pays, agence").execute()
-            agences = [(row["pays"], row["agence"]) for row in (response.data or [])]
+            agences = [(row["pays"], row["agence"]) for row in reference_data.get(supabase).rows("agences_livraison")]
 
             if not agences:
                 st.info("Aucune agence disponible pour modification.")
@@ -2344,10 +2517,10 @@ elif menu == "⚙️ Gestion des agences":
                     submit_mod = st.form_submit_button("✅ Mettre à jour")
                     if submit_mod:
                         try:
-                            supabase.table("agences_livraison").update({
+                            data_access.update_rows(supabase, "agences_livraison", {
                                 "pays": new_pays,
                                 "agence": new_nom
-                            }).eq("pays", pays_sel).eq("agence", agence_sel).execute()
+                            }, [("eq", "pays", pays_sel), ("eq", "agence", agence_sel)])
                             st.success("✅ Agence modifiée avec succès.")
                             st.session_state["agence_action"] = None
                             st.rerun()
@@ -2361,8 +2534,7 @@ elif menu == "⚙️ Gestion des agences":
             st.subheader("🗑️ Supprimer une agence existante")
 
     # Charger la liste des agences
-            response = supabase.table("agences_livraison").select("pays, agence").execute()
-            agences = [(row["pays"], row["agence"]) for row in (response.data or [])]
+            agences = [(row["pays"], row["agence"]) for row in reference_data.get(supabase).rows("agences_livraison")]
 
             if not agences:
                 st.info("Aucune agence disponible pour suppression.")
@@ -2378,7 +2550,7 @@ elif menu == "⚙️ Gestion des agences":
                     confirm_one = st.checkbox("Je confirme la suppression", key="confirm_del_agence")
                     if st.button("🗑️ Supprimer", type="primary", use_container_width=True, disabled=not confirm_one):
                         try:
-                            supabase.table("agences_livraison").delete().eq("pays", pays_sel).eq("agence", agence_sel).execute()
+                            data_access.delete_rows(supabase, "agences_livraison", [("eq", "pays", pays_sel), ("eq", "agence", agence_sel)])
                             st.warning("🗑️ Agence supprimée.")
                             st.session_state["agence_action"] = None
                             st.rerun()
@@ -2391,6 +2563,7 @@ elif menu == "⚙️ Gestion des agences":
 #Module expédition des lots
 elif menu == "🚚 Expédition des lots":
     st.markdown("## 🚚 Préparation des expéditions")
+    etat_file_ecritures("expedition")
 
     # 📅 Sélection de la date d'enregistrement
     selected_date = st.date_input("📅 Sélectionnez une date d'enregistrement :", value=date.today())
@@ -2401,14 +2574,17 @@ elif menu == "🚚 Expédition des lots":
         "Bénin", "Togo", "Guinée Conakry", "Guinée Bissau"
     ])
 
-# 📦 Récupération des lots enregistrés à cette date et pour le pays sélectionné
-    try:
-        lots_response = supabase.table("lots").select("id, nom_lot, date_enregistrement, filiale")\
-           .eq("date_enregistrement", str(selected_date)).eq("filiale", pays).execute()
-        lots = [(lot["id"], lot["nom_lot"]) for lot in lots_response.data]
-    except Exception as e:
-        st.error(f"Erreur lors de la récupération des lots : {e}")
-        lots = []
+# 📦 Lots de la date et du pays, et données de référence (référence, agence, livreurs) : lectures parallèles
+    lectures = fanout.run({
+        "lots": lambda: data_access.fetch_rows(
+            supabase, "lots", "id, nom_lot, date_enregistrement, filiale",
+            [("eq", "date_enregistrement", str(selected_date)), ("eq", "filiale", pays)],
+        ),
+        "refs": lambda: reference_data.get(supabase),
+    })
+    if lectures.error("lots"):
+        st.error(f"Erreur lors de la récupération des lots : {lectures.error('lots')}")
+    lots = [(lot["id"], lot["nom_lot"]) for lot in lectures.get("lots", [])]
 
     lot_selectionne = st.selectbox("📦 Sélectionnez un lot à expédier :", lots, format_func=lambda x: x[1])
     lot_id = lot_selectionne[0] if lot_selectionne else None
@@ -2420,27 +2596,16 @@ elif menu == "🚚 Expédition des lots":
     bordereau = st.text_input("Numéro de bordereau")
 
     # 📌 Référence d'expédition
-    try:
-        ref_response = supabase.table("references_expedition").select("reference").eq("pays", pays).execute()
-        reference = ref_response.data[0]["reference"] if ref_response.data else "Référence non disponible"
-    except Exception:
-        reference = "Référence non disponible"
+    refs = lectures.get("refs")
+    reference = (refs.reference(pays) if refs else None) or "Référence non disponible"
     st.text_area("📌 Référence d'expédition", value=reference, disabled=True)
 
     # 🚚 Agence de livraison
-    try:
-        agence_response = supabase.table("agences_livraison").select("agence").eq("pays", pays).execute()
-        agence = agence_response.data[0]["agence"] if agence_response.data else "Agence non définie"
-    except Exception:
-        agence = "Agence non définie"
+    agence = (refs.agence(pays) if refs else None) or "Agence non définie"
     st.text_input("🚚 Agence de livraison", value=agence, disabled=True)
 
-    # 👤 Sélection de l'agent livreur
-    try:
-        agents_response = supabase.table("livreurs").select("id, nom, prenom").eq("agence", agence).execute()
-        agents = [(agent["id"], agent["nom"], agent["prenom"]) for agent in agents_response.data]
-    except Exception:
-        agents = []
+    # 👤 Sélection de l'agent livreur (index agence → livreurs)
+    agents = [(agent["id"], agent["nom"], agent["prenom"]) for agent in refs.livreurs_de(agence)] if refs else []
 
     if agents:
         agent_selectionne = st.selectbox("👤 Sélectionnez un agent livreur :", agents, format_func=lambda x: f"{x[1]} {x[2]}")
@@ -2451,19 +2616,13 @@ elif menu == "🚚 Expédition des lots":
 
     # ✅ Enregistrement de l'expédition
     if st.button("✅ Enregistrer l'expédition") and lot_id and agent_id:
-        try:         
-            # Récupérer le dernier ID existant
-            last_id_data = supabase.table("expedition").select("id").order("id", desc=True).limit(1).execute().data
-            next_id = (last_id_data[0]["id"] + 1) if last_id_data else 1           
-            
-            doublon = supabase.table("expedition").select("lot_id")\
-                .eq("lot_id", lot_id).execute().data
-
-            if doublon:
-                st.warning("⚠️ Ce lot a déjà été enregistré pour une expédition.")
+        try:
+            # Lot déjà expédié : vérifié en ligne ; hors connexion, l'expédition part en file et le
+            # doublon est refusé au rejeu par expedition_lot_unique (conflit signalé par etat_file_ecritures)
+            if file_ecritures.exists(supabase, "expedition", [("eq", "lot_id", lot_id)]):
+                statut_envoi, erreur_envoi = write_queue.CONFLIT, None
             else:
-            # ✅ Enregistrement si pas de doublon
-                supabase.table("expedition").insert({
+                statut_envoi, _, erreur_envoi = file_ecritures.submit(supabase, "expedition", {
                     "lot_id": lot_id,
                     "pays": pays,
                     "statut": statut,
@@ -2472,9 +2631,17 @@ elif menu == "🚚 Expédition des lots":
                     "agence": agence,
                     "agent_id": agent_id,
                     "date_expedition": str(date.today())
-                }).execute()
+                }, user_id=st.session_state.get("user_id"))
+            if statut_envoi == write_queue.ENVOYE:
                 st.success("✅ Expédition enregistrée avec succès.")
                 st.rerun()
+            elif statut_envoi == write_queue.EN_ATTENTE:
+                st.info("📥 Connexion indisponible : expédition enregistrée localement, "
+                        "elle sera envoyée dès le retour de la connexion.")
+            elif statut_envoi == write_queue.CONFLIT:
+                st.warning("⚠️ Ce lot a déjà été enregistré pour une expédition.")
+            else:
+                st.error(f"❌ Expédition refusée : {erreur_envoi}")
         except Exception as e:
             st.error(f"Erreur lors de l'enregistrement : {e}")
 
@@ -2486,8 +2653,8 @@ elif menu == "📇 Annuaire des livreurs":
     # 🔍 Récupération des livreurs
    
     try:
-        livreurs_response = supabase.table("livreurs").select("id, agence, nom, prenom, contact").execute()
-        livreurs = livreurs_response.data or []
+        refs = reference_data.get(supabase)
+        livreurs = refs.rows("livreurs", "id", "agence", "nom", "prenom", "contact")
         df_livreurs = pd.DataFrame(livreurs)
     except Exception as e:
         st.error(f"Erreur lors de la récupération des livreurs : {e}")
@@ -2498,8 +2665,7 @@ elif menu == "📇 Annuaire des livreurs":
     # 🔍 Récupération des agences existantes
 
     try:
-        agences_response = supabase.table("agences_livraison").select("agence, pays").execute()
-        agences_data = agences_response.data or []
+        agences_data = reference_data.get(supabase).rows("agences_livraison", "agence", "pays")
         df_agences = pd.DataFrame(agences_data)
     except Exception as e:
         st.error(f"Erreur lors de la récupération des agences : {e}")
@@ -2641,26 +2807,17 @@ elif menu == "📇 Annuaire des livreurs":
                             if doublon:
                                 st.warning(f"⚠️ Le livreur {nom} {prenom} existe déjà pour l'agence {agence}.")
                             else:
-                            # Si votre table 'livreurs.id' n'est PAS en IDENTITY, on génère next_id
-                                try:
-                                    last_id_data = supabase.table("livreurs").select("id").order("id", desc=True).limit(1).execute().data
-                                    next_id = (last_id_data[0]["id"] + 1) if last_id_data else 1
-                                except Exception:
-                                    next_id = None  # si IDENTITY, on n'enverra pas 'id'
-
-                                    payload = {
-                                        "agence": agence,
-                                        "nom": nom,
-                                        "prenom": prenom,
-                                        "contact": contact
-                                    }
-                                    if next_id is not None:
-                                        payload["id"] = next_id
-
-                                        supabase.table("livreurs").insert(payload).execute()
-                                        st.success(f"✅ Livreurs ajouté pour l'agence {agence}")
-                                        st.session_state["livreur_action"] = None
-                                        st.rerun()
+                            # id attribué par la séquence de la table (004_sequences_identifiants.sql)
+                                payload = {
+                                    "agence": agence,
+                                    "nom": nom,
+                                    "prenom": prenom,
+                                    "contact": contact
+                                }
+                                data_access.insert_rows(supabase, "livreurs", payload)
+                                st.success(f"✅ Livreurs ajouté pour l'agence {agence}")
+                                st.session_state["livreur_action"] = None
+                                st.rerun()
                         except Exception as e:
                             st.error(f"Erreur lors de l'ajout : {e}")
 
@@ -2720,8 +2877,8 @@ elif menu == "📇 Annuaire des livreurs":
                                 # (Optionnel) tracer opérateur :
                                 # update_payload["operateur"] = st.session_state.get("display_name") or st.session_state.get("user_id") or "system"
 
-                                        supabase.table("livreurs").update(update_payload) \
-                                            .eq("id", int(st.session_state["livreur_id"])).execute()
+                                        data_access.update_rows(supabase, "livreurs", update_payload,
+                                            [("eq", "id", int(st.session_state["livreur_id"]))])
                                         st.success("✅ Livreurs modifié avec succès.")
                                         st.session_state["livreur_action"] = None
                                         st.session_state["livreur_id"] = None
@@ -2762,7 +2919,7 @@ elif menu == "📇 Annuaire des livreurs":
                             confirm = st.checkbox("Je confirme la suppression", key="confirm_del_livreur")
                             if st.button("🗑️ Supprimer", type="primary", use_container_width=True, disabled=not confirm):
                                 try:
-                                    supabase.table("livreurs").delete().eq("id", int(st.session_state["livreur_id"])).execute()
+                                    data_access.delete_rows(supabase, "livreurs", [("eq", "id", int(st.session_state["livreur_id"]))])
                                     st.warning("🗑️ Livreurs supprimé.")
                                     st.session_state["livreur_action"] = None
                                     st.session_state["livreur_id"] = None
@@ -2779,9 +2936,9 @@ elif menu == "📦 Visualisation des expéditions":
     st.markdown("## 📦 Visualisation des expéditions")
     st.divider()
 
-    # 🔍 Récupération des expéditions
+    # 🔍 Récupération des expéditions (projection de la page : resservie au tableau plus bas par le mémo du rerun)
     try:
-        df = pd.DataFrame(supabase.table("expedition").select("statut, agence").execute().data)
+        df = data_access.fetch_df(supabase, "expedition")
     except Exception as e:
         st.error(f"Erreur lors de la récupération des expéditions : {e}")
         df = pd.DataFrame()
@@ -2812,9 +2969,9 @@ elif menu == "📦 Visualisation des expéditions":
 
 
     try:
-        expeditions = supabase.table("expedition").select("*").execute().data
-        lots = supabase.table("lots").select("id, nom_lot").execute().data
-        livreurs = supabase.table("livreurs").select("id, nom, prenom").execute().data
+        expeditions = data_access.fetch_rows(supabase, "expedition")
+        lots = data_access.fetch_rows(supabase, "lots", "id, nom_lot")
+        livreurs = reference_data.get(supabase).rows("livreurs", "id", "nom", "prenom")
 
         lots_dict = {lot["id"]: lot["nom_lot"] for lot in lots}
         livreurs_dict = {livreur["id"]: f"{livreur['nom']} {livreur['prenom']}" for livreur in livreurs}
@@ -2892,6 +3049,22 @@ elif menu == "📦 Visualisation des expéditions":
     else:
         st.dataframe(df_filtered, use_container_width=True)
 
+        # Mêmes filtres pour l'export ; colis et livreur traduits en lot_id / agent_id
+        filtres = filter_pushdown.FilterSet()
+        for colonne, selection in (("pays", pays_selection), ("statut", statut_selection),
+                                   ("agence", agence_selection), ("bordereau", bordereau_selection)):
+            filtres.isin(colonne, list(selection), df_expeditions[colonne].dropna().unique().tolist())
+        for colonne, nom, selection in (("lot_id", "nom_lot", colis_selection),
+                                        ("agent_id", "agent_livreur", agent_selection)):
+            retenus = df_expeditions[df_expeditions[nom].isin(selection)][colonne].dropna().unique().tolist()
+            filtres.isin(colonne, retenus, df_expeditions[colonne].dropna().unique().tolist())
+
+        def noms_des_expeditions(page):
+            return page.assign(nom_lot=page["lot_id"].map(lambda i: lots_dict.get(i, "Inconnu")),
+                               agent_livreur=page["agent_id"].map(lambda i: livreurs_dict.get(i, "Non attribué")))
+
+        bouton_export("expeditions", filtres, "expedition", transform=noms_des_expeditions)
+
 
 # =========================
 # 🛠️ Gestion des expéditions
@@ -2947,8 +3120,8 @@ elif menu == "📦 Visualisation des expéditions":
                     else:
             # Livreurs de cette agence (pour mise à jour agent)
                         try:
-                            agents_resp = supabase.table("livreurs").select("id, nom, prenom").eq("agence", exp["agence"]).execute()
-                            agents_choices = [(row["id"], f"{row['nom']} {row['prenom']}") for row in (agents_resp.data or [])]
+                            agents_rows = reference_data.get(supabase).livreurs_de(exp["agence"], "id", "nom", "prenom")
+                            agents_choices = [(row["id"], f"{row['nom']} {row['prenom']}") for row in agents_rows]
                         except Exception:
                             agents_choices = []
 
@@ -2981,12 +3154,12 @@ elif menu == "📦 Visualisation des expéditions":
                             submit_mod = st.form_submit_button("✅ Enregistrer les modifications")
                             if submit_mod:
                                 try:
-                                    supabase.table("expedition").update({
+                                    data_access.update_rows(supabase, "expedition", {
                                         "statut": new_statut,
                                         "bordereau": new_bordereau,
                                         "date_expedition": str(new_date_exp),
                                         "agent_id": new_agent_id
-                                    }).eq("id", exp_id).execute()
+                                    }, [("eq", "id", exp_id)])
                                     st.success("✅ Expédition modifiée avec succès.")
                                     st.session_state["exp_action"] = None
                                     st.session_state["exp_id"] = None
@@ -3012,7 +3185,7 @@ elif menu == "📦 Visualisation des expéditions":
                     with colA:
                         if st.button("🗑️ Supprimer l'expédition sélectionnée", type="primary", use_container_width=True):
                             try:
-                                supabase.table("expedition").delete().eq("id", sel_del[0]).execute()
+                                data_access.delete_rows(supabase, "expedition", [("eq", "id", sel_del[0])])
                                 st.warning("🗑️ Expédition supprimée.")
                                 st.session_state["exp_action"] = None
                                 st.session_state["exp_id"] = None
@@ -3025,7 +3198,7 @@ elif menu == "📦 Visualisation des expéditions":
                         if st.button("🧹 Supprimer toutes les expéditions filtrées", use_container_width=True):
                             try:
                                 ids = [int(i) for i in df_filtered["id"].tolist()]
-                                supabase.table("expedition").delete().in_("id", ids).execute()
+                                data_access.delete_rows(supabase, "expedition", [("in_", "id", ids)])
                                 st.warning(f"🧹 {len(ids)} expéditions supprimées (jeu filtré).")
                                 st.session_state["exp_action"] = None
                                 st.session_state["exp_id"] = None
@@ -3045,6 +3218,8 @@ elif menu == "🔐 Gestion des comptes utilisateurs":
         st.error("⛔ Accès réservé aux administrateurs.")
         st.stop()
 
+    panneau_profilage()
+
     # ==============================
     # 1) Lecture des données
     # ==============================
@@ -3396,6 +3571,10 @@ elif menu == "🔐 Gestion des comptes utilisateurs":
                     st.button("❌ Fermer", on_click=lambda: st.session_state.update({"user_action": None, "user_target": None}))
 
 
+# ⏱ Mesures des appels de ce rerun (affichées une fois la page rendue)
+if st.session_state.get("role") == "admin":
+    panneau_performance()
+
 # Message de bienvenue et déconnexion
 st.sidebar.success(
     f"👤 {st.session_state.get('display_name', 'Utilisateur')} est connecté"
@@ -3405,3 +3584,6 @@ st.sidebar.success(
 if st.sidebar.button("🔓 Se déconnecter"):
     logout()
     st.rerun()
+
+# Fin du rerun : ses totaux rejoignent les percentiles par page (st.stop / st.rerun : au rerun suivant)
+data_access.end_rerun()
@@ -0,0 +1,182 @@
+"""
+Export des inventaires (tests, conditionnements, expéditions, lots).
+
+Les pages de la lecture paginée (FilterSet.iter_frames) sont écrites dans un
+fichier temporaire au fur et à mesure de leur arrivée : le résultat complet
+n'est jamais assemblé en DataFrame. Formats : CSV, Parquet (colonnaire,
+compressé zstd, via pyarrow) et Excel (xlsxwriter en mode constant_memory).
+
+Limite : le fichier terminé est remis au bouton de téléchargement de
+Streamlit, qui le charge en mémoire le temps de le servir. Le découpage en
+pages borne la mémoire de la lecture et de la mise en forme, pas celle de
+l'envoi ; les exports très volumineux doivent passer par un filtre plus
+étroit. Un fichier est remplacé quand la session prépare un nouvel export ;
+ceux des sessions abandonnées sont supprimés après MAX_AGE secondes (à
+chaque nouvel export, toutes sessions confondues).
+
+Parquet : le schéma du fichier est fixé par la première page. Une colonne
+vide sur cette page est typée texte, et les valeurs des pages suivantes
+destinées à une colonne texte y sont converties ; une page encore
+incompatible (texte dans une colonne numérique) arrête l'export par une
+ValueError, sans laisser de fichier tronqué.
+"""
+import glob
+import logging
+import math
+import os
+import tempfile
+import time
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Tuple
+
+import pandas as pd
+
+log = logging.getLogger("erp.data")
+
+PREFIX = "erp_export_"
+MAX_AGE = 3600.0  # secondes avant suppression d'un export jamais téléchargé
+
+FORMATS: Dict[str, Tuple[str, str]] = {
+    "CSV": (".csv", "text/csv"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+    "Excel": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+# Limite d'une feuille Excel (en-tête compris) : au-delà, feuille suivante
+EXCEL_MAX_ROWS = 1_048_576
+
+
+def write_csv(frames: Iterable[pd.DataFrame], fh: BinaryIO) -> int:
+    rows, header = 0, True
+    for df in frames:
+        # utf-8-sig : accents lisibles à l'ouverture dans Excel
+        fh.write(df.to_csv(index=False, header=header).encode("utf-8-sig" if header else "utf-8"))
+        rows += len(df)
+        header = False
+    return rows
+
+
+def _parquet_schema(df: pd.DataFrame):
+    import pyarrow as pa
+
+    # Colonne vide sur la première page (None ou NaN) : typée texte, le type des pages suivantes est inconnu
+    inferred = pa.Schema.from_pandas(df, preserve_index=False)
+    return pa.schema([f.with_type(pa.string()) if pa.types.is_null(f.type) or df[f.name].isna().all() else f
+                      for f in inferred])
+
+
+def _parquet_table(df: pd.DataFrame, schema):
+    """Page convertie au schéma du fichier (fixé par la première page) ; colonnes texte forcées en texte."""
+    import pyarrow as pa
+
+    try:
+        return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    df = df.copy()
+    for field in schema:
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            df[field.name] = df[field.name].map(lambda v: None if _cell(v) is None else str(v)).astype(object)
+    try:
+        return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        raise ValueError(f"Export Parquet : une page ne correspond pas aux types de la première ({e})") from e
+
+
+def write_parquet(frames: Iterable[pd.DataFrame], fh: BinaryIO) -> int:
+    import pyarrow.parquet as pq  # dépendance du seul export Parquet
+
+    rows, writer, schema = 0, None, None
+    try:
+        for df in frames:
+            if writer is None:
+                schema = _parquet_schema(df)
+                writer = pq.ParquetWriter(fh, schema, compression="zstd")
+            writer.write_table(_parquet_table(df, schema))
+            rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def _cell(value: Any) -> Any:
+    if value is None or (isinstance(value, float) and math.isnan(value)) or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value
+
+
+def write_excel(frames: Iterable[pd.DataFrame], fh: BinaryIO) -> int:
+    import xlsxwriter  # dépendance du seul export Excel
+
+    # constant_memory : chaque ligne est vidée sur disque dès la suivante écrite
+    workbook = xlsxwriter.Workbook(fh, {"constant_memory": True, "remove_timezone": True})
+    date_format = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm"})
+    rows, sheet, line, header = 0, None, 0, None
+    try:
+        for df in frames:
+            if header is None:
+                header = list(df.columns)
+            for values in df[header].itertuples(index=False, name=None):
+                if sheet is None or line >= EXCEL_MAX_ROWS:
+                    sheet = workbook.add_worksheet()
+                    sheet.write_row(0, 0, header)
+                    line = 1
+                for col, value in enumerate(values):
+                    value = _cell(value)
+                    if value is None:
+                        continue
+                    if hasattr(value, "year"):
+                        sheet.write_datetime(line, col, value, date_format)
+                    else:
+                        sheet.write(line, col, value)
+                line += 1
+                rows += 1
+        if sheet is None:
+            workbook.add_worksheet().write_row(0, 0, header or [])
+    finally:
+        workbook.close()
+    return rows
+
+
+WRITERS: Dict[str, Callable[[Iterable[pd.DataFrame], BinaryIO], int]] = {
+    "CSV": write_csv,
+    "Parquet": write_parquet,
+    "Excel": write_excel,
+}
+
+
+def purge(max_age: float = MAX_AGE) -> int:
+    """Supprime les exports plus anciens que max_age (sessions abandonnées) ; renvoie leur nombre."""
+    removed = 0
+    limit = time.time() - max_age
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), f"{PREFIX}*")):
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+                removed += 1
+        except OSError as e:
+            log.warning("Export %s non supprimé : %s", path, e)
+    return removed
+
+
+def remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def export_to_file(frames: Iterable[pd.DataFrame], fmt: str) -> Tuple[str, int]:
+    """Écrit les pages dans un fichier temporaire ; renvoie (chemin, nombre de lignes)."""
+    purge()
+    suffix, _ = FORMATS[fmt]
+    fd, path = tempfile.mkstemp(prefix=PREFIX, suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            rows = WRITERS[fmt](frames, fh)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, rows
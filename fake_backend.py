@@ -0,0 +1,127 @@
+"""
+Faux PostgREST en mémoire : les pages exécutées sans projet Supabase, latence réseau simulée.
+
+FakeClient reprend le client SQLite (mêmes constructeurs de requêtes, mêmes
+fonctions SQL locales dont login_utilisateur) sur une base ":memory:"
+recopiée depuis erp_lots, ou depuis une base du banc d'essai (bench_data).
+Chaque execute() compte pour un aller-retour :
+- une attente de latency secondes (plus un aléa jusqu'à jitter), prise hors
+  du verrou de la connexion : des requêtes parallèles (fanout, pagination)
+  attendent ensemble, comme sur des connexions HTTP distinctes ;
+- la taille JSON de la réponse, comme le corps renvoyé par PostgREST ;
+- un compteur par (méthode, table ou fonction), lu par stats().
+Les allers-retours sont aussi ajoutés à l'appel mesuré en cours
+(data_access.count_request) : le panneau « ⏱ Performance » les affiche.
+
+    backend = "fake"            # secrets.toml
+    fake_template = "erp_lots"  # base recopiée en mémoire
+    fake_latency_ms = 40        # aller-retour simulé
+    fake_jitter_ms = 10         # aléa ajouté à chaque aller-retour
+"""
+import json
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+from typing import Any, Dict, Optional, Tuple
+
+import data_access
+import sqlite_backend
+
+
+class _Timing:
+    """Attente et comptage d'un aller-retour autour de l'exécution réelle."""
+
+    client: "FakeClient"
+
+    def _round_trip(self, method: str, target: str, run) -> sqlite_backend.Response:
+        self.client.wait()
+        response = run()
+        size = len(json.dumps(response.data, default=str))
+        self.client.record(method, target, size)
+        data_access.count_request(size)
+        return response
+
+
+class FakeQuery(_Timing, sqlite_backend.QueryBuilder):
+    def execute(self) -> sqlite_backend.Response:
+        method = {"select": "GET", "insert": "POST", "update": "PATCH", "delete": "DELETE"}.get(self._action, "POST")
+        return self._round_trip(method, self.table, super().execute)
+
+
+class FakeRPC(_Timing, sqlite_backend.RPCBuilder):
+    def execute(self) -> sqlite_backend.Response:
+        return self._round_trip("RPC", self.fn, super().execute)
+
+
+class FakeClient(sqlite_backend.SQLiteClient):
+    """Client SQLite en mémoire avec latence par requête et compteur d'allers-retours."""
+
+    def __init__(self, template: str = "erp_lots", latency: float = 0.0, jitter: float = 0.0,
+                 seed: Optional[int] = None):
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        with closing(sqlite3.connect(f"file:{template}?mode=ro", uri=True)) as source:
+            source.backup(conn)
+        self.latency, self.jitter = latency, jitter
+        self._random = random.Random(seed)
+        self._stats_lock = threading.Lock()
+        self.round_trips: Counter = Counter()
+        self.bytes_sent = 0
+        self.waited = 0.0
+        super().__init__(":memory:", conn)
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    from_ = table
+
+    def rpc(self, fn: str, params: Optional[Dict[str, Any]] = None) -> FakeRPC:
+        return FakeRPC(self, fn, params or {})
+
+    # --- Latence et compteurs ---
+    def wait(self) -> None:
+        delay = self.latency
+        if self.jitter:
+            with self._stats_lock:
+                delay += self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        with self._stats_lock:
+            self.waited += delay
+
+    def record(self, method: str, target: str, size: int) -> None:
+        with self._stats_lock:
+            self.round_trips[(method, target)] += 1
+            self.bytes_sent += size
+
+    def stats(self) -> Dict[str, Any]:
+        """Allers-retours depuis le dernier reset_stats : total, par (méthode, cible), octets, attente."""
+        with self._stats_lock:
+            par_cible: Dict[Tuple[str, str], int] = dict(self.round_trips)
+            return {
+                "requetes": sum(par_cible.values()),
+                "par_cible": {f"{m} {t}": n for (m, t), n in sorted(par_cible.items())},
+                "octets": self.bytes_sent,
+                "attente_s": round(self.waited, 3),
+            }
+
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            self.round_trips.clear()
+            self.bytes_sent = 0
+            self.waited = 0.0
+
+
+_clients: Dict[Tuple[str, float, float], FakeClient] = {}
+_clients_lock = threading.Lock()
+
+
+def connect(template: str = "erp_lots", latency: float = 0.0, jitter: float = 0.0) -> FakeClient:
+    """Faux client du processus pour ce modèle et cette latence (une base en mémoire partagée)."""
+    key = (template, latency, jitter)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = FakeClient(template, latency, jitter)
+        return _clients[key]
@@ -0,0 +1,78 @@
+"""
+Lectures indépendantes d'une page lancées en parallèle.
+
+Une page déclare ses requêtes sans dépendance entre elles (nom → appel) ;
+elles partent ensemble sur un pool de threads (connexions keep-alive
+partagées, voir data_access.py) et la page attend la plus lente plutôt que
+la somme de toutes. Les lectures dépendantes d'un résultat se font ensuite.
+Chaque appel s'exécute avec le contexte de la session (page courante pour les
+projections, mémo du rerun).
+
+Un appel déjà exécuté sur un thread du pool ne réserve pas d'autres threads
+de ce pool pour ses propres lectures : elles s'exécutent en série dans le
+même thread (sinon des appels imbriqués qui occupent tous les threads en
+attendant leurs sous-lectures bloqueraient le pool entier). Un chargement
+partagé qui fait attendre d'autres appels (reference_data) passe par son
+propre pool (executor).
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import data_access
+
+log = logging.getLogger("erp.data")
+
+MAX_WORKERS = 8  # requêtes simultanées (toutes sessions confondues)
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="erp-fanout")
+_worker = threading.local()  # pool dont le thread courant exécute un appel
+
+
+class Results:
+    """Résultats d'un lot de requêtes : valeur par nom, ou l'exception levée par la requête."""
+
+    def __init__(self, futures: Dict[str, Future]):
+        self.values: Dict[str, Any] = {}
+        self.errors: Dict[str, Exception] = {}
+        for name, future in futures.items():
+            try:
+                self.values[name] = future.result()
+            except Exception as e:
+                log.warning("Requête %s en échec : %s", name, e)
+                self.errors[name] = e
+
+    def get(self, name: str, default: Any = None) -> Any:
+        """Résultat de la requête, ou default si elle a échoué."""
+        return self.values.get(name, default)
+
+    def error(self, name: str) -> Optional[Exception]:
+        return self.errors.get(name)
+
+
+def run(queries: Dict[str, Callable[[], Any]], executor: Optional[ThreadPoolExecutor] = None) -> Results:
+    """Lance les requêtes indépendantes en parallèle et attend qu'elles soient toutes terminées."""
+    executor = executor or _executor
+    snapshot = data_access.snapshot_context()
+
+    def call(fn: Callable[[], Any]) -> Any:
+        _worker.pool = executor
+        try:
+            with data_access.use_context(snapshot):
+                return fn()
+        finally:
+            _worker.pool = None
+
+    if len(queries) <= 1 or getattr(_worker, "pool", None) is executor:
+        # Rien à paralléliser, ou déjà sur un thread de ce pool : exécution dans le thread courant
+        futures = {}
+        for name, fn in queries.items():
+            future: Future = Future()
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+            futures[name] = future
+        return Results(futures)
+    return Results({name: executor.submit(call, fn) for name, fn in queries.items()})
@@ -0,0 +1,130 @@
+"""
+Filtres de la barre latérale poussés vers PostgREST.
+
+Les sélections (période, filiale, type de lot, résultat, opérateur...) sont
+traduites en prédicats gte / lte / in_ exécutés côté serveur : le volume
+transféré suit la période choisie et non tout l'historique. Les options des
+multiselects viennent de petites requêtes de valeurs distinctes. Le filtrage
+pandas ne sert plus que de repli (prédicat trop long pour une URL, erreur
+PostgREST).
+"""
+import logging
+from datetime import date
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+import data_access
+import delta_sync
+import pagination
+
+log = logging.getLogger("erp.data")
+
+# Au-delà, un in_ alourdit trop l'URL : le filtre est appliqué localement
+MAX_IN_VALUES = 200
+
+
+def distinct_values(client, table: str, column: str) -> List[str]:
+    """Valeurs distinctes non nulles d'une colonne (RPC distinct_values, mise en cache)."""
+    cache = data_access.table_cache()
+    key = ("distinct", column)
+    values = cache.get(table, key)
+    if values is None:
+        generation = cache.generation(table)
+        try:
+            rows = client.rpc("distinct_values", {"p_table": table, "p_column": column}).execute().data or []
+            values = [r if isinstance(r, str) else next(iter(r.values())) for r in rows]
+        except Exception as e:
+            # RPC absente (001_rpc_distinct_values.sql non déployé) : lecture de la seule colonne
+            log.warning("distinct_values(%s, %s) indisponible : %s", table, column, e)
+            rows = data_access.fetch_rows(client, table, column, page_size=pagination.PAGE_SIZE)
+            values = sorted({str(r[column]) for r in rows if r.get(column) is not None})
+        cache.put(table, key, values, generation)
+    return list(values)
+
+
+# Borne basse des dates valides : exclut aussi les NULL (tri desc : NULL en tête côté PostgREST)
+DATE_FLOOR = "1900-01-01"
+
+
+def date_bounds(client, table: str, column: str) -> Tuple[Optional[date], Optional[date]]:
+    """Première et dernière date présentes dans la colonne (deux lectures d'une ligne, triées)."""
+    bounds = []
+    for desc in (False, True):
+        rows = data_access.fetch_rows(client, table, column, filters=[("gt", column, DATE_FLOOR)],
+                                      order=column, desc=desc, limit=1)
+        value = pd.to_datetime(rows[0][column], errors="coerce") if rows else pd.NaT
+        bounds.append(None if pd.isna(value) else value.date())
+    if None in bounds:
+        return None, None
+    return bounds[0], bounds[1]
+
+
+def apply_pandas(df: pd.DataFrame, filters: Iterable[data_access.Filter]) -> pd.DataFrame:
+    """Équivalent pandas des prédicats (repli quand le serveur ne peut pas filtrer)."""
+    mask = pd.Series(True, index=df.index)
+    for op, column, value in filters:
+        if column not in df.columns:
+            continue
+        series = df[column]
+        if op == "in_":
+            mask &= series.astype(str).isin([str(v) for v in value])
+        elif op == "eq":
+            mask &= series.astype(str) == str(value)
+        elif op in ("gte", "lte", "gt", "lt"):
+            left, right = pd.to_datetime(series, errors="coerce"), pd.Timestamp(value)
+            mask &= {"gte": left >= right, "lte": left <= right,
+                     "gt": left > right, "lt": left < right}[op]
+    return df[mask]
+
+
+class FilterSet:
+    """Sélections de la barre latérale, réparties entre prédicats serveur et filtres locaux."""
+
+    def __init__(self):
+        self.server: List[data_access.Filter] = []
+        self.local: List[data_access.Filter] = []
+
+    def date_range(self, column: str, selection: Sequence[date]) -> "FilterSet":
+        if selection:
+            start, end = selection[0], selection[-1]
+            self.server += [("gte", column, start.isoformat()), ("lte", column, end.isoformat())]
+        return self
+
+    def isin(self, column: str, selection: Sequence[Any], options: Sequence[Any]) -> "FilterSet":
+        if set(map(str, options)) <= set(map(str, selection)):
+            return self  # tout est sélectionné : aucun prédicat
+        target = self.server if len(selection) <= MAX_IN_VALUES else self.local
+        target.append(("in_", column, tuple(selection)))
+        return self
+
+    def fetch(self, client, table: str, columns: Any = None) -> pd.DataFrame:
+        """Lit uniquement les lignes retenues ; repli sur le miroir local + pandas en cas d'erreur."""
+        try:
+            df = data_access.fetch_df(client, table, columns, self.server,
+                                      order="id", page_size=pagination.PAGE_SIZE)
+            if self.local and not df.empty:
+                df = apply_pandas(df, self.local)
+        except Exception as e:
+            log.warning("Filtrage serveur impossible sur %s, repli pandas : %s", table, e)
+            df = delta_sync.synced_df(client, table, columns or "*")
+            if not df.empty:
+                df = apply_pandas(df, self.server + self.local)
+        if df.empty and len(df.columns) == 0:
+            # Résultat vide : on garde les colonnes attendues par les KPIs des pages
+            cols = data_access.resolve_columns(table, columns)
+            df = pd.DataFrame(columns=[c for c in cols if c != "*"])
+        return df
+
+    def iter_frames(self, client, table: str, columns: Any = None,
+                    transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None) -> Iterator[pd.DataFrame]:
+        """Lignes retenues page par page (exports) : seules les pages en vol sont en mémoire."""
+        cols = data_access.resolve_columns(table, columns)
+        for page in pagination.fetch_pages(client, table, cols, self.server, order="id"):
+            df = pd.DataFrame(page)
+            if transform is not None and not df.empty:
+                df = transform(df)
+            if self.local and not df.empty:
+                df = apply_pandas(df, self.local)
+            if not df.empty:
+                yield df
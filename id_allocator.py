@@ -0,0 +1,29 @@
+"""
+Attribution des identifiants par la base (voir 004_sequences_identifiants.sql).
+
+Une insertion simple n'envoie plus d'id : la séquence de la table l'attribue.
+Les insertions par lots qui ont besoin des ids à l'avance (lignes liées,
+rejeu idempotent) les prennent dans un bloc réservé par processus : un seul
+appel reserver_ids pour BLOCK_SIZE identifiants, sans collision entre sessions.
+"""
+import threading
+from collections import deque
+from typing import Deque, Dict, List
+
+BLOCK_SIZE = 50
+
+_blocks: Dict[str, Deque[int]] = {}
+_lock = threading.Lock()
+
+
+def reserve(client, table: str, count: int = 1) -> List[int]:
+    """Renvoie count identifiants réservés pour table (bloc local, complété au besoin)."""
+    with _lock:
+        block = _blocks.setdefault(table, deque())
+        if len(block) < count:
+            rows = client.rpc("reserver_ids", {"p_table": table, "p_nombre": max(count - len(block), BLOCK_SIZE)}) \
+                .execute().data or []
+            block.extend(int(r if not isinstance(r, dict) else next(iter(r.values()))) for r in rows)
+        if len(block) < count:
+            raise RuntimeError(f"Réservation d'identifiants impossible pour {table}")
+        return [block.popleft() for _ in range(count)]
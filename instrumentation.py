@@ -0,0 +1,144 @@
+"""
+Mesure des appels de la couche de données.
+
+Chaque appel (lecture, écriture, agrégat, miroir) produit un enregistrement :
+page du menu, type d'appel, table, projection, filtres, provenance (réseau,
+cache, mémo du rerun), lignes, octets reçus, durée. Les enregistrements sont
+- gardés pour le rerun en cours (panneau « ⏱ Performance » des administrateurs) ;
+- agrégés sur une fenêtre glissante par (page, appel, table) pour les percentiles ;
+- journalisés en JSON, une ligne par appel et une par rerun (logger erp.perf).
+"""
+import json
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+log = logging.getLogger("erp.perf")
+
+WINDOW = 500  # derniers appels gardés par (page, appel, table) ; derniers reruns par page
+PERCENTILES = (50, 95, 99)
+
+Record = Dict[str, Any]
+
+_windows: Dict[Tuple[Optional[str], str, str], Deque[Tuple[float, int, int]]] = {}
+_reruns: Dict[Optional[str], Deque[Tuple[float, int, int]]] = {}
+_captures: List[List[Record]] = []
+_lock = threading.Lock()
+
+
+def start(kind: str, table: str, page: Optional[str], columns: Any = None, filters: Iterable = ()) -> Record:
+    """Nouvel enregistrement ; l'appelant complète lignes / provenance puis appelle finish."""
+    if isinstance(columns, (tuple, list)):
+        columns = ",".join(columns)
+    return {
+        "page": page,
+        "appel": kind,
+        "table": table,
+        "projection": columns,
+        "filtres": [list(f) for f in filters],
+        "provenance": "reseau",
+        "lignes": None,
+        "octets": 0,
+        "requetes": 0,
+        "debut": time.perf_counter(),
+        "ms": None,
+        "erreur": None,
+        "imbrique": False,
+    }
+
+
+def finish(record: Record) -> Record:
+    record["ms"] = round((time.perf_counter() - record.pop("debut")) * 1000, 2)
+    if not record["imbrique"]:
+        key = (record["page"], record["appel"], record["table"])
+        with _lock:
+            _windows.setdefault(key, deque(maxlen=WINDOW)).append(
+                (record["ms"], record["lignes"] or 0, record["octets"]))
+            for captured in _captures:
+                captured.append(record)
+    log.info(json.dumps({"evenement": "requete", **record}, default=str, ensure_ascii=False))
+    return record
+
+
+@contextmanager
+def capture():
+    """Recueille tous les appels terminés du processus pendant le bloc (banc d'essai)."""
+    records: List[Record] = []
+    with _lock:
+        _captures.append(records)
+    try:
+        yield records
+    finally:
+        with _lock:
+            _captures.remove(records)
+
+
+def finish_rerun(page: Optional[str], records: Sequence[Record]) -> None:
+    """Totaux d'un rerun terminé (appels de premier niveau seulement)."""
+    top = [r for r in records if not r["imbrique"] and r["ms"] is not None]
+    if not top:
+        return
+    total = (round(sum(r["ms"] for r in top), 2), sum(r["requetes"] for r in top), sum(r["octets"] for r in top))
+    with _lock:
+        _reruns.setdefault(page, deque(maxlen=WINDOW)).append(total)
+    log.info(json.dumps({"evenement": "rerun", "page": page, "appels": len(top), "ms": total[0],
+                         "requetes": total[1], "octets": total[2]}, ensure_ascii=False))
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Percentile par rang le plus proche (0 si aucune valeur)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summary() -> List[Dict[str, Any]]:
+    """Percentiles de durée et moyennes par (page, appel, table) sur la fenêtre glissante."""
+    with _lock:
+        windows = {k: list(v) for k, v in _windows.items()}
+    out = []
+    for (page, kind, table), samples in sorted(windows.items(), key=lambda kv: str(kv[0])):
+        durations = [s[0] for s in samples]
+        row = {"page": page, "appel": kind, "table": table, "appels": len(samples)}
+        row.update({f"p{q} (ms)": percentile(durations, q) for q in PERCENTILES})
+        row["lignes (moy.)"] = round(sum(s[1] for s in samples) / len(samples), 1)
+        row["octets (moy.)"] = round(sum(s[2] for s in samples) / len(samples))
+        out.append(row)
+    return out
+
+
+def rerun_summary() -> List[Dict[str, Any]]:
+    """Percentiles de la durée cumulée des appels d'un rerun, par page."""
+    with _lock:
+        reruns = {k: list(v) for k, v in _reruns.items()}
+    out = []
+    for page, samples in sorted(reruns.items(), key=lambda kv: str(kv[0])):
+        durations = [s[0] for s in samples]
+        row = {"page": page, "reruns": len(samples)}
+        row.update({f"p{q} (ms)": percentile(durations, q) for q in PERCENTILES})
+        row["requêtes (moy.)"] = round(sum(s[1] for s in samples) / len(samples), 1)
+        row["octets (moy.)"] = round(sum(s[2] for s in samples) / len(samples))
+        out.append(row)
+    return out
+
+
+def reset() -> None:
+    with _lock:
+        _windows.clear()
+        _reruns.clear()
+
+
+def configure_logging(path: Optional[str] = None) -> None:
+    """Sortie des lignes JSON (fichier path, sinon stderr), une seule fois par processus."""
+    if log.handlers:
+        return
+    handler: logging.Handler = logging.FileHandler(path, encoding="utf-8") if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
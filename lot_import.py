@@ -0,0 +1,197 @@
+"""
+Import de lots en masse depuis un fichier CSV ou Excel.
+
+Le fichier est lu au fil de l'eau (morceaux pandas pour le CSV, openpyxl en
+lecture seule pour l'Excel) ; chaque ligne passe les règles du formulaire
+enregistrer_lot, les noms de lot déjà connus ou répétés dans le fichier sont
+écartés à l'aide d'un ensemble en mémoire, et les lignes valides partent par
+INSERT multi-lignes de chunk_size lignes. L'ensemble vient du miroir local :
+un nom créé entre-temps ailleurs est refusé par la contrainte lots_nom_lot_unique
+(008_lots_nom_unique.sql), et le morceau concerné est alors repris ligne par
+ligne pour compter ce nom en doublon sans perdre les autres lignes.
+
+Un fichier illisible (format, encodage, colonnes obligatoires absentes) lève
+ValueError ou l'erreur du lecteur ; l'appelant l'affiche.
+"""
+import math
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import pandas as pd
+
+import data_access
+import delta_sync
+
+FILIALES = ["Burkina Faso", "Mali", "Niger", "Côte d'Ivoire", "Sénégal", "Bénin", "Togo", "Guinée Bissau", "Guinée Conakry"]
+TYPES_LOT = ["Ordinaire", "Émission instantanée", "Renouvellement"]
+
+CHUNK_SIZE = 200
+COLONNES = ("nom_lot", "type_lot", "quantite", "date_production", "date_enregistrement",
+            "filiale", "impression_pin", "nombre_pin")
+OBLIGATOIRES = ("nom_lot", "type_lot", "quantite", "filiale")  # les autres ont une valeur par défaut
+
+
+def cartes_a_tester(quantite: int) -> int:
+    """Une carte à tester par tranche de 50 cartes entamée."""
+    return math.ceil(quantite / 50)
+
+
+class ImportReport:
+    """Avancement de l'import : lignes lues, insérées, doublons et erreurs (numéro de ligne, motif)."""
+
+    def __init__(self):
+        self.lues = 0
+        self.inserees = 0
+        self.doublons: List[Tuple[int, str]] = []
+        self.erreurs: List[Tuple[int, str]] = []
+
+
+# --- Lecture en continu ---
+def _header(values: Iterable[Any]) -> List[str]:
+    header = [str(v or "").strip().lower() for v in values]
+    manquantes = [c for c in OBLIGATOIRES if c not in header]
+    if manquantes:
+        raise ValueError(f"colonne(s) manquante(s) : {', '.join(manquantes)}")
+    return header
+
+
+def read_rows(file, name: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """Lignes du fichier (dictionnaires colonne → valeur), sans charger le fichier entier."""
+    if name.lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook  # dépendance du seul import Excel
+
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = _header(next(rows, ()))
+            for values in rows:
+                if any(v not in (None, "") for v in values):
+                    yield dict(zip(header, values))
+        finally:
+            workbook.close()
+    else:
+        header = None
+        for chunk in pd.read_csv(file, chunksize=chunk_size, dtype=str, keep_default_na=False,
+                                 sep=None, engine="python"):
+            header = header or _header(chunk.columns)
+            chunk.columns = header
+            yield from chunk.to_dict("records")
+
+
+# --- Validation (mêmes règles que le formulaire) ---
+def _entier(value: Any) -> Optional[int]:
+    try:
+        return int(float(str(value).replace(" ", "").replace(",", ".")))
+    except (TypeError, ValueError):
+        return None
+
+
+def _date(value: Any) -> Optional[date]:
+    if value in (None, ""):
+        return date.today()
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    parsed = pd.to_datetime(str(value).strip(), dayfirst=True, errors="coerce")
+    return None if pd.isna(parsed) else parsed.date()
+
+
+def validate(row: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Renvoie (ligne à insérer, None) ou (None, motif du rejet)."""
+    nom_lot = str(row.get("nom_lot") or "").strip()
+    if not nom_lot:
+        return None, "nom_lot manquant"
+    type_lot = str(row.get("type_lot") or "").strip()
+    if type_lot not in TYPES_LOT:
+        return None, f"type_lot inconnu : {type_lot!r}"
+    filiale = str(row.get("filiale") or "").strip()
+    if filiale not in FILIALES:
+        return None, f"filiale inconnue : {filiale!r}"
+    quantite = _entier(row.get("quantite"))
+    if quantite is None or quantite < 1:
+        return None, f"quantite invalide : {row.get('quantite')!r}"
+    date_production, date_enregistrement = _date(row.get("date_production")), _date(row.get("date_enregistrement"))
+    if date_production is None or date_enregistrement is None:
+        return None, "date invalide"
+    impression_pin = str(row.get("impression_pin") or "Non").strip().capitalize()
+    if impression_pin not in ("Oui", "Non"):
+        return None, f"impression_pin doit valoir Oui ou Non : {impression_pin!r}"
+    nombre_pin = _entier(row.get("nombre_pin")) or 0
+    if impression_pin == "Oui" and nombre_pin < 1:
+        return None, "nombre_pin doit être au moins 1 quand impression_pin = Oui"
+    return {
+        "nom_lot": nom_lot,
+        "type_lot": type_lot,
+        "quantite": quantite,
+        "date_production": str(date_production),
+        "date_enregistrement": str(date_enregistrement),
+        "filiale": filiale,
+        "impression_pin": impression_pin,
+        "nombre_pin": nombre_pin if impression_pin == "Oui" else 0,
+        "cartes_a_tester": cartes_a_tester(quantite),
+    }, None
+
+
+# --- Import ---
+def _code(e: Exception) -> str:
+    return str(getattr(e, "code", "") or "")
+
+
+def import_lots(client, rows: Iterable[Dict[str, Any]], chunk_size: int = CHUNK_SIZE,
+                progress: Optional[Callable[[ImportReport], None]] = None) -> ImportReport:
+    """Valide et insère les lignes par morceaux ; progress(report) est appelé après chaque morceau."""
+    report = ImportReport()
+    # Noms déjà en base (miroir incrémental, une colonne utile) puis noms vus dans le fichier
+    noms: Set[str] = set(delta_sync.synced_df(client, "lots", "id, nom_lot")["nom_lot"].dropna())
+    chunk: List[Dict[str, Any]] = []
+    lignes: List[int] = []
+
+    def flush():
+        if not chunk:
+            return
+        try:
+            data_access.insert_rows(client, "lots", list(chunk))
+            report.inserees += len(chunk)
+        except Exception as e:
+            if _code(e) == "23505":
+                # Nom créé ailleurs depuis la synchronisation du miroir : reprise ligne par ligne
+                for numero, record in zip(lignes, chunk):
+                    insert_one(numero, record)
+            else:
+                report.erreurs.append((lignes[0], f"lignes {lignes[0]} à {lignes[-1]} non insérées : {e}"))
+                noms.difference_update(r["nom_lot"] for r in chunk)
+        chunk.clear()
+        lignes.clear()
+        if progress:
+            progress(report)
+
+    def insert_one(numero: int, record: Dict[str, Any]):
+        try:
+            data_access.insert_rows(client, "lots", [record])
+            report.inserees += 1
+        except Exception as e:
+            if _code(e) == "23505":
+                report.doublons.append((numero, record["nom_lot"]))
+            else:
+                report.erreurs.append((numero, f"ligne non insérée : {e}"))
+                noms.discard(record["nom_lot"])
+
+    for numero, row in enumerate(rows, start=2):  # ligne 1 = en-tête
+        report.lues += 1
+        record, erreur = validate(row)
+        if erreur:
+            report.erreurs.append((numero, erreur))
+            continue
+        if record["nom_lot"] in noms:
+            report.doublons.append((numero, record["nom_lot"]))
+            continue
+        noms.add(record["nom_lot"])
+        chunk.append(record)
+        lignes.append(numero)
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+    if progress:
+        progress(report)
+    return report
@@ -0,0 +1,189 @@
+"""
+Moteur de pagination concurrente pour les lectures de tables complètes.
+
+La première page est demandée avec count="exact" : le total connu, les pages
+suivantes partent en parallèle sur un pool de threads borné (connexions
+keep-alive partagées, voir data_access.py). Les pages sont restituées dans
+l'ordre, avec un ORDER BY stable pour que les offsets ne se chevauchent pas.
+
+Tri sur id (KEYSET_COLUMNS) : pagination par bornes de clé au lieu d'offsets.
+Après la première page, l'intervalle d'id restant (jusqu'à la dernière clé
+lue au départ) est découpé en tranches d'environ une page, chacune lue par
+id > borne AND id <= borne suivante ORDER BY id LIMIT n : l'index sert chaque
+page au même coût quelle que soit sa profondeur, et une insertion pendant le
+parcours ne décale ni ne duplique aucune ligne.
+"""
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import pandas as pd
+
+import data_access
+
+PAGE_SIZE = 1000
+MAX_WORKERS = 6          # pages téléchargées en parallèle (tous appels confondus)
+MAX_PAGES_IN_FLIGHT = 12  # pages en avance sur le consommateur (mémoire bornée)
+KEYSET_COLUMNS = ("id",)  # clés uniques et entières : pagination par bornes
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="erp-pages")
+
+
+def _submit(fn, *args):
+    """Page lancée sur le pool avec le contexte de la session (octets attribués à l'appel mesuré)."""
+    snapshot = data_access.snapshot_context()
+
+    def call():
+        with data_access.use_context(snapshot):
+            return fn(*args)
+
+    return _executor.submit(call)
+
+
+def _query(client, table: str, columns, filters, order: Optional[str], desc: bool, count: Optional[str] = None):
+    cols = ",".join(data_access.normalize_columns(columns))
+    query = client.table(table).select(cols, count=count) if count else client.table(table).select(cols)
+    query = data_access.apply_filters(query, data_access.normalize_filters(filters))
+    if order:
+        query = query.order(order, desc=desc)
+    return query
+
+
+def fetch_pages(client, table: str, columns: Any = "*", filters: Sequence[data_access.Filter] = (),
+                order: Optional[str] = "id", desc: bool = False,
+                page_size: int = PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """Génère les pages d'un résultat dans l'ordre ; le total est connu dès la première page."""
+    if order in KEYSET_COLUMNS:
+        yield from _keyset_pages(client, table, columns, filters, order, desc, page_size)
+        return
+    first = _query(client, table, columns, filters, order, desc, count="exact") \
+        .range(0, page_size - 1).execute()
+    rows = first.data or []
+    yield rows
+
+    total = first.count
+    if total is None:
+        # Pas de total renvoyé : repli sur la boucle séquentielle historique
+        offset = len(rows)
+        while rows:
+            rows = _query(client, table, columns, filters, order, desc) \
+                .range(offset, offset + page_size - 1).execute().data or []
+            if rows:
+                yield rows
+            offset += len(rows)
+        return
+
+    # Le serveur peut plafonner la taille des pages (max-rows) : on s'aligne sur lui
+    step = len(rows) if 0 < len(rows) < min(page_size, total) else page_size
+
+    def load(offset: int) -> List[Dict[str, Any]]:
+        return _query(client, table, columns, filters, order, desc) \
+            .range(offset, offset + step - 1).execute().data or []
+
+    offsets = iter(range(len(rows), total, step))
+    in_flight: deque = deque()
+    for offset in offsets:
+        in_flight.append(_submit(load, offset))
+        if len(in_flight) >= MAX_PAGES_IN_FLIGHT:
+            break
+    while in_flight:
+        page = in_flight.popleft().result()
+        next_offset = next(offsets, None)
+        if next_offset is not None:
+            in_flight.append(_submit(load, next_offset))
+        if page:
+            yield page
+
+
+def _keyset_pages(client, table: str, columns: Any, filters: Sequence[data_access.Filter],
+                  key: str, desc: bool, page_size: int) -> Iterator[List[Dict[str, Any]]]:
+    cols = data_access.normalize_columns(columns)
+    # La clé sert de curseur : sélectionnée même hors projection, retirée des lignes rendues
+    extra = cols != ("*",) and key not in cols
+    select = cols + (key,) if extra else cols
+    after, until = ("lt", "gte") if desc else ("gt", "lte")
+    filters = list(filters)
+
+    def rows_out(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if extra:
+            for row in rows:
+                row.pop(key, None)
+        return rows
+
+    def seek(cursor: Any, bound: Any, limit: int) -> List[Dict[str, Any]]:
+        flt = filters + [(after, key, cursor)] + ([(until, key, bound)] if bound is not None else [])
+        return _query(client, table, select, flt, key, desc).limit(limit).execute().data or []
+
+    first = _query(client, table, select, filters, key, desc, count="exact").limit(page_size).execute()
+    rows = first.data or []
+    total = first.count
+    if not rows or (total is not None and len(rows) >= total):
+        yield rows_out(rows)
+        return
+    last = rows[-1][key]
+    # Le serveur peut plafonner la taille des pages (max-rows) : on s'aligne sur lui
+    step = len(rows) if len(rows) < page_size else page_size
+    yield rows_out(rows)
+
+    edge = _query(client, table, key, filters, key, not desc).limit(1).execute().data if total is not None else None
+    end = edge[0][key] if edge else None
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in (last, end)):
+        # Clé non entière ou total inconnu : parcours séquentiel par curseur
+        while True:
+            page = seek(last, None, step)
+            if not page:
+                return
+            last = page[-1][key]
+            yield rows_out(page)
+            if len(page) < step:
+                return
+
+    segments = max(1, math.ceil((total - len(rows)) / step))
+    width = (end - last) / segments
+    bounds = list(dict.fromkeys([last + round(width * i) for i in range(segments)] + [end]))
+
+    def load(lo: Any, hi: Any) -> List[Dict[str, Any]]:
+        # Une tranche peut dépasser une page (ids denses) : on avance le curseur dans la tranche
+        out: List[Dict[str, Any]] = []
+        cursor = lo
+        while True:
+            page = seek(cursor, hi, step)
+            out.extend(page)
+            if len(page) < step:
+                return rows_out(out)
+            cursor = page[-1][key]
+
+    ranges = iter(zip(bounds, bounds[1:]))
+    in_flight: deque = deque()
+    for lo, hi in ranges:
+        in_flight.append(_submit(load, lo, hi))
+        if len(in_flight) >= MAX_PAGES_IN_FLIGHT:
+            break
+    while in_flight:
+        page = in_flight.popleft().result()
+        next_range = next(ranges, None)
+        if next_range is not None:
+            in_flight.append(_submit(load, *next_range))
+        if page:
+            yield page
+
+
+def fetch_all_rows(client, table: str, columns: Any = "*", filters: Sequence[data_access.Filter] = (),
+                   order: Optional[str] = "id", desc: bool = False,
+                   page_size: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    for page in fetch_pages(client, table, columns, filters, order, desc, page_size):
+        rows.extend(page)
+    return rows
+
+
+def fetch_df(client, table: str, columns: Any = "*", filters: Sequence[data_access.Filter] = (),
+             order: Optional[str] = "id", desc: bool = False,
+             page_size: int = PAGE_SIZE) -> pd.DataFrame:
+    """Assemble les pages en un DataFrame au fil de l'eau (chaque page est convertie dès réception)."""
+    frames = [pd.DataFrame(page) for page in fetch_pages(client, table, columns, filters, order, desc, page_size)]
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
@@ -0,0 +1,273 @@
+"""
+Profilage à la demande des reruns d'une session (administrateurs).
+
+Un administrateur arme une session (« 🔐 Gestion des comptes utilisateurs ») :
+ses N prochains reruns sont échantillonnés. Un thread de fond relève la pile
+du thread du script toutes les INTERVAL secondes (sys._current_frames, sans
+dépendance ni instrumentation du code) jusqu'à la fin du rerun, y compris
+après st.stop() ou st.rerun().
+
+Chaque échantillon est attribué à la première famille rencontrée depuis le
+script (erp_api.py) : lecture des données, calculs pandas / numpy, figures
+Plotly, PDF et exports, rendu Streamlit ; la construction d'un DataFrame dans
+data_access compte donc en lecture, celle d'une figure en Plotly.
+
+Un profil est un fichier JSON de profile_path : session, utilisateur, page,
+filtres des appels de la couche de données pendant le rerun, temps par
+famille, et les piles au format replié (« a;b;c durée_µs », lu par
+flamegraph.pl et speedscope).
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import data_access
+
+log = logging.getLogger("erp.perf")
+
+INTERVAL = 0.005        # secondes entre deux échantillons
+MAX_SECONDS = 300.0     # un rerun plus long est coupé
+MAX_RERUNS = 20         # reruns profilés au plus par armement
+MAX_PROFILES = 200      # fichiers gardés dans profile_path (les plus anciens supprimés)
+SESSION_TTL = 1800.0    # sessions proposées : vues dans la dernière demi-heure
+
+# Familles dans l'ordre d'affichage ; "script" : code de erp_api.py hors familles
+FAMILLES = {
+    "donnees": "Lecture des données",
+    "pandas": "Calculs pandas / numpy",
+    "plotly": "Figures Plotly",
+    "pdf": "PDF et exports",
+    "rendu": "Rendu Streamlit",
+    "script": "Script",
+}
+_MODULES = {
+    "donnees": {"data_access", "pagination", "filter_pushdown", "aggregates", "delta_sync", "reference_data",
+                "fanout", "replica", "sqlite_backend", "fake_backend", "table_cache", "projections",
+                "write_queue", "id_allocator", "lot_import", "postgrest", "httpx", "httpcore", "supabase"},
+    "pandas": {"pandas", "numpy", "sklearn"},
+    "plotly": {"plotly"},
+    "pdf": {"exports", "xlsxwriter"},
+    "rendu": {"streamlit"},
+}
+SCRIPT = "erp_api"
+
+_dir = "profils"
+_seen: Dict[str, Dict[str, Any]] = {}
+_armed: Dict[str, int] = {}
+_running: Dict[str, "Sampler"] = {}
+_lock = threading.Lock()
+
+
+def configure(path: Optional[str]) -> None:
+    """Dossier des profils (profile_path dans secrets.toml)."""
+    global _dir
+    if path:
+        _dir = path
+
+
+def _family(module: str, function: str) -> Optional[str]:
+    if module == SCRIPT:
+        return "pdf" if "pdf" in function.lower() else None
+    top = module.split(".", 1)[0]
+    for family, modules in _MODULES.items():
+        if top in modules:
+            return family
+    return None
+
+
+def _stack(frame) -> List[tuple]:
+    """(module, fonction, ligne) de la racine du script à la feuille ; vide hors du script."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    for start, f in enumerate(frames):
+        if f.f_globals.get("__name__") == "__main__":
+            break
+    else:
+        return []
+    out = []
+    for f in frames[start:]:
+        module = f.f_globals.get("__name__") or "?"
+        if module == "__main__":
+            module = SCRIPT
+        out.append((module, getattr(f.f_code, "co_qualname", f.f_code.co_name), f.f_lineno))
+    return out
+
+
+class Sampler(threading.Thread):
+    """Échantillonne la pile d'un thread de script jusqu'à la fin de son rerun, puis enregistre le profil."""
+
+    def __init__(self, target: int, meta: Dict[str, Any], queries: List[Dict[str, Any]]):
+        super().__init__(name="erp-profiler", daemon=True)
+        self.target = target
+        self.meta = meta
+        self.queries = queries  # liste des appels du rerun (data_access), lue à la fin
+        self.stacks: Counter = Counter()
+        self.families: Counter = Counter()
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        started = previous = time.perf_counter()
+        seen = False
+        while not self.stopped.wait(INTERVAL):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self.target)
+            stack = _stack(frame) if frame is not None else []
+            del frame
+            if not stack:
+                if seen:
+                    break  # le rerun est terminé
+                previous = now
+                continue
+            seen = True
+            elapsed = int((now - previous) * 1e6)
+            previous = now
+            labels = []
+            family = None
+            for module, function, line in stack:
+                labels.append(f"{module}:{function}:{line}" if function == "<module>" else f"{module}:{function}")
+                family = family or _family(module, function)
+            self.stacks[";".join(labels)] += elapsed
+            self.families[family or "script"] += elapsed
+            if now - started > MAX_SECONDS:
+                break
+        with _lock:
+            if _running.get(self.meta["session"]) is self:
+                del _running[self.meta["session"]]
+        if self.stacks:
+            try:
+                save(self.profile())
+            except OSError as e:
+                log.warning("Profil non enregistré : %s", e)
+
+    def profile(self) -> Dict[str, Any]:
+        filtres = []
+        for record in list(self.queries):
+            for f in record.get("filtres") or []:
+                entry = [record["table"], *f]
+                if entry not in filtres:
+                    filtres.append(entry)
+        return {
+            **self.meta,
+            "duree_ms": round(sum(self.families.values()) / 1000, 1),
+            "familles": {FAMILLES[k]: round(self.families[k] / 1000, 1) for k in FAMILLES if self.families[k]},
+            "appels": len(self.queries),
+            "filtres": filtres,
+            "pile": dict(self.stacks),
+        }
+
+
+# --- Sessions et armement ---
+def begin(session: str, utilisateur: Optional[str], page: Optional[str]) -> bool:
+    """Début d'un rerun (thread du script) : lance l'échantillonnage si la session est armée."""
+    now = time.time()
+    with _lock:
+        _seen[session] = {"session": session, "utilisateur": utilisateur, "page": page, "vu": now}
+        for key in [k for k, v in _seen.items() if now - v["vu"] > SESSION_TTL]:
+            del _seen[key]
+        previous = _running.pop(session, None)
+        if previous is not None:
+            # st.rerun() enchaîné trop vite pour être vu par l'échantillonneur : profil précédent clos ici
+            previous.stopped.set()
+        if not _armed.get(session):
+            return False
+        _armed[session] -= 1
+        if not _armed[session]:
+            del _armed[session]
+        sampler = Sampler(threading.get_ident(), {
+            "id": f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}",
+            "session": session,
+            "utilisateur": utilisateur,
+            "page": page,
+            "debut": datetime.now().isoformat(timespec="seconds"),
+            "intervalle_ms": INTERVAL * 1000,
+        }, data_access.snapshot_context().get("queries", []))
+        _running[session] = sampler
+    sampler.start()
+    return True
+
+
+def set_page(session: str, utilisateur: Optional[str], page: Optional[str]) -> None:
+    """Page et utilisateur du rerun en cours, connus après begin (menu, connexion)."""
+    with _lock:
+        if session in _seen:
+            _seen[session].update(utilisateur=utilisateur, page=page)
+        sampler = _running.get(session)
+        if sampler is not None:
+            sampler.meta.update(utilisateur=utilisateur, page=page)
+
+
+def arm(session: str, reruns: int) -> None:
+    with _lock:
+        _armed[session] = max(1, min(int(reruns), MAX_RERUNS))
+
+
+def disarm(session: str) -> None:
+    with _lock:
+        _armed.pop(session, None)
+
+
+def sessions() -> List[Dict[str, Any]]:
+    """Sessions vues récemment, avec les reruns restant à profiler."""
+    with _lock:
+        return [{**s, "reruns_armes": _armed.get(s["session"], 0)}
+                for s in sorted(_seen.values(), key=lambda s: -s["vu"])]
+
+
+# --- Stockage ---
+def save(profile: Dict[str, Any]) -> str:
+    os.makedirs(_dir, exist_ok=True)
+    path = os.path.join(_dir, f"{profile['id']}.json")
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(profile, fh, ensure_ascii=False, default=str)
+    for old in sorted(n for n in os.listdir(_dir) if n.endswith(".json"))[:-MAX_PROFILES]:
+        os.remove(os.path.join(_dir, old))
+    return path
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """Profils enregistrés, du plus récent au plus ancien (sans les piles)."""
+    if not os.path.isdir(_dir):
+        return []
+    out = []
+    for name in sorted((n for n in os.listdir(_dir) if n.endswith(".json")), reverse=True):
+        try:
+            with open(os.path.join(_dir, name), encoding="utf-8") as fh:
+                profile = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        profile.pop("pile", None)
+        out.append(profile)
+    return out
+
+
+def load(profile_id: str) -> Dict[str, Any]:
+    with open(os.path.join(_dir, f"{os.path.basename(profile_id)}.json"), encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def folded(profile: Dict[str, Any]) -> str:
+    """Piles repliées « a;b;c durée_µs », une par ligne (flamegraph.pl, speedscope)."""
+    return "".join(f"{stack} {weight}\n" for stack, weight in sorted(profile["pile"].items()))
+
+
+def hot_functions(profile: Dict[str, Any], limit: int = 15) -> List[Dict[str, Any]]:
+    """Fonctions au sommet des piles (temps propre) et temps inclusif, en ms."""
+    self_time: Counter = Counter()
+    total: Counter = Counter()
+    for stack, weight in profile["pile"].items():
+        frames = stack.split(";")
+        self_time[frames[-1]] += weight
+        for frame in set(frames):
+            total[frame] += weight
+    return [{"fonction": f, "propre (ms)": round(w / 1000, 1), "inclusif (ms)": round(total[f] / 1000, 1)}
+            for f, w in self_time.most_common(limit)]
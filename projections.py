@@ -0,0 +1,43 @@
+"""
+Registre des projections de colonnes par page du menu.
+
+Chaque page déclare, table par table, les colonnes dont ses KPIs, graphiques
+et tableaux ont besoin. data_access remplace un select("*") par la projection
+déclarée et signale toute colonne demandée hors registre : moins de JSON
+transféré et parsé, ce qui compte pour les agents sur connexion mobile.
+"""
+from typing import Dict, Optional, Tuple
+
+PAGE_PROJECTIONS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "🏠 Accueil": {
+        "lots": ("id", "filiale", "type_lot", "quantite", "impression_pin", "date_enregistrement"),
+        "controle_qualite": ("lot_id", "date_controle", "type_carte", "quantite",
+                             "quantite_a_tester", "resultat", "remarque"),
+        "expedition": ("agence", "pays", "statut"),
+    },
+    "🧪 Contrôle qualité": {
+        "lots": ("id", "nom_lot", "type_lot", "quantite", "date_production", "date_enregistrement",
+                 "filiale", "impression_pin", "nombre_pin"),
+        "controle_qualite": ("id", "lot_id"),
+    },
+    "🗂 Inventaire des tests": {
+        "controle_qualite": ("id", "date_controle", "type_carte", "quantite",
+                             "quantite_a_tester", "remarque", "resultat", "lot_id"),
+        "lots": ("id", "nom_lot", "filiale"),
+    },
+    "🗂 Inventaire des conditionnements": {
+        "conditionnement": ("id", "nom_lot", "type_lot", "filiale", "type_emballage", "nombre_cartes",
+                            "packs", "remarque", "operateur", "date_conditionnement"),
+    },
+    "📦 Visualisation des expéditions": {
+        "expedition": ("id", "lot_id", "pays", "statut", "bordereau", "reference",
+                       "agence", "agent_id", "date_expedition"),
+        "lots": ("id", "nom_lot"),
+        "livreurs": ("id", "nom", "prenom"),
+    },
+}
+
+
+def page_projection(page: Optional[str], table: str) -> Optional[Tuple[str, ...]]:
+    """Colonnes déclarées par la page pour cette table (None : pas de contrainte)."""
+    return PAGE_PROJECTIONS.get(page or "", {}).get(table)
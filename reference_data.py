@@ -0,0 +1,132 @@
+"""
+Données de référence partagées par toutes les sessions du processus.
+
+references_expedition, agences_livraison et livreurs sont petites, changent
+rarement et sont lues sur presque toutes les pages. Elles sont chargées une
+fois (les trois lectures en parallèle) et tenues en dictionnaires indexés :
+pays → agence, pays → référence, agence → livreurs.
+
+Toute écriture de l'application sur l'une de ces tables (ajout, modification,
+suppression dans « Gestion des agences » et « Annuaire des livreurs ») vide
+le cache via les abonnés de data_access ; REFRESH_AFTER borne l'âge des
+données pour les modifications faites depuis un autre processus.
+Les lignes sont partagées : les pages reçoivent des copies (rows, livreurs_de).
+Les trois lectures passent par un pool dédié : des appels de fanout peuvent
+attendre ce chargement (_load_lock), il ne doit pas attendre leurs threads.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+import data_access
+import fanout
+
+log = logging.getLogger("erp.data")
+
+TABLES = ("references_expedition", "agences_livraison", "livreurs")
+REFRESH_AFTER = 600.0  # secondes
+
+_executor = ThreadPoolExecutor(max_workers=len(TABLES), thread_name_prefix="erp-reference")
+
+
+def _project(rows: Sequence[Dict[str, Any]], columns: Sequence[str] = ()) -> List[Dict[str, Any]]:
+    if not columns:
+        return [dict(r) for r in rows]
+    return [{c: r.get(c) for c in columns} for r in rows]
+
+
+class ReferenceData:
+    """Instantané des trois tables de référence et de leurs index."""
+
+    def __init__(self, references: List[Dict[str, Any]], agences: List[Dict[str, Any]],
+                 livreurs: List[Dict[str, Any]]):
+        self.tables = {"references_expedition": references, "agences_livraison": agences, "livreurs": livreurs}
+        self.loaded_at = time.time()
+        # Première ligne par pays, comme les lectures .eq("pays", ...)[0] qu'elles remplacent
+        self.reference_par_pays: Dict[str, Any] = {}
+        for row in references:
+            self.reference_par_pays.setdefault(row.get("pays"), row.get("reference"))
+        self.agence_par_pays: Dict[str, Any] = {}
+        for row in agences:
+            self.agence_par_pays.setdefault(row.get("pays"), row.get("agence"))
+        self.livreurs_par_agence: Dict[str, List[Dict[str, Any]]] = {}
+        for row in livreurs:
+            self.livreurs_par_agence.setdefault(row.get("agence"), []).append(row)
+
+    def reference(self, pays: str, default: Any = None) -> Any:
+        return self.reference_par_pays.get(pays, default)
+
+    def agence(self, pays: str, default: Any = None) -> Any:
+        return self.agence_par_pays.get(pays, default)
+
+    def livreurs_de(self, agence: str, *columns: str) -> List[Dict[str, Any]]:
+        return _project(self.livreurs_par_agence.get(agence, []), columns)
+
+    def rows(self, table: str, *columns: str) -> List[Dict[str, Any]]:
+        """Copie des lignes d'une table, réduites aux colonnes demandées (toutes par défaut)."""
+        return _project(self.tables[table], columns)
+
+
+def load(client) -> ReferenceData:
+    lectures = fanout.run({
+        "references_expedition": lambda: data_access.select_rows(client, "references_expedition", "*", order="pays"),
+        "agences_livraison": lambda: data_access.select_rows(client, "agences_livraison", "*", order="pays"),
+        "livreurs": lambda: data_access.select_rows(client, "livreurs", "*", order="id"),
+    }, executor=_executor)
+    for table in TABLES:
+        if lectures.error(table):
+            raise lectures.error(table)
+    return ReferenceData(*(lectures.get(table) for table in TABLES))
+
+
+# --- Cache du processus ---
+_data: Optional[ReferenceData] = None
+_generation = 0
+_listening = False
+_lock = threading.Lock()
+_load_lock = threading.Lock()  # un seul chargement à la fois, les autres sessions l'attendent
+
+
+def _fresh(data: Optional[ReferenceData]) -> bool:
+    return data is not None and time.time() - data.loaded_at < REFRESH_AFTER
+
+
+def get(client) -> ReferenceData:
+    """Données de référence du processus, chargées au premier appel ou après invalidation."""
+    global _data, _listening
+    with _lock:
+        if not _listening:
+            data_access.add_write_listener(_on_write)
+            _listening = True
+        data = _data
+    if _fresh(data):
+        return data
+    with _load_lock:
+        with _lock:
+            data, generation = _data, _generation
+        if _fresh(data):
+            return data
+        with data_access.measure("reference", ",".join(TABLES)) as record:
+            data = load(client)
+            record["lignes"] = sum(len(rows) for rows in data.tables.values())
+        with _lock:
+            # Une écriture pendant le chargement : l'instantané sert ce rerun mais n'est pas gardé
+            if generation == _generation:
+                _data = data
+        log.info("Données de référence chargées : %s",
+                 ", ".join(f"{t}={len(data.tables[t])}" for t in TABLES))
+        return data
+
+
+def invalidate() -> None:
+    global _data, _generation
+    with _lock:
+        _data = None
+        _generation += 1
+
+
+def _on_write(table: str, op: str, filters, rows) -> None:
+    if table in TABLES:
+        invalidate()
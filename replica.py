@@ -0,0 +1,298 @@
+"""
+Réplique locale en lecture : les tables Supabase recopiées dans un fichier SQLite.
+
+Un thread de fond tient la copie à jour (lignes nouvelles par id à chaque
+cycle, réconciliation complète périodique pour les modifications et
+suppressions faites ailleurs). Les écritures de l'application partent vers
+Supabase ; la ligne renvoyée est appliquée aussitôt dans la copie (lecture de
+ses propres écritures sans attendre le cycle suivant). Les événements du flux de
+modifications (change_feed.py) y sont appliqués de la même façon.
+
+ReplicatedClient s'utilise comme le client de session : les select et les
+agrégats (kpi_*, distinct_values) des tables répliquées sont servis par SQLite
+(sqlite_backend, mêmes index et cumuls), tout le reste va à Supabase.
+
+La copie n'a pas les contraintes d'unicité locales (expedition_lot_unique...) :
+elle reprend les lignes telles que Supabase les a acceptées, doublons compris.
+Une table n'est servie par la copie qu'après une synchronisation qui a reçu
+des lignes : une copie vide (compte de la réplique absent, RLS) laisse les
+lectures sur Supabase. Un agrégat suit les tables qu'il lit
+(aggregates.AGGREGATE_TABLES) : expedition vide ne retient que kpi_expeditions.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aggregates
+import change_feed
+import data_access
+import pagination
+import sqlite_backend
+
+log = logging.getLogger("erp.data")
+
+# Table → clé primaire ; les tables de référence (clé pays) sont recopiées entièrement à chaque cycle
+REPLICATED_TABLES: Dict[str, str] = {
+    "lots": "id",
+    "controle_qualite": "id",
+    "conditionnement": "id",
+    "expedition": "id",
+    "livreurs": "id",
+    "agences_livraison": "pays",
+    "references_expedition": "pays",
+}
+LOCAL_RPC = set(aggregates.SQLITE_QUERIES) | {"distinct_values"}
+
+DEFAULT_INTERVAL = 10.0     # secondes entre deux cycles du thread
+DEFAULT_FULL_EVERY = 900.0  # réconciliation complète des tables à clé id
+STALE_AFTER = 60.0          # au-delà, l'indicateur passe à l'orange
+
+
+def create_from_template(path: str, template: str = "erp_lots") -> None:
+    """Crée les tables de la réplique d'après le schéma du fichier erp_lots (ouvert en lecture seule)."""
+    with sqlite3.connect(f"file:{template}?mode=ro", uri=True) as src:
+        ddl = [sql for (sql,) in src.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'rollup_%'"
+        )]
+    with sqlite3.connect(path) as dst:
+        for sql in ddl:
+            dst.execute(sql.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+
+
+class Replica:
+    """Copie SQLite des tables répliquées, tenue à jour par un thread de fond."""
+
+    def __init__(self, remote, path: str = "erp_replica.db", template: str = "erp_lots",
+                 interval: float = DEFAULT_INTERVAL, full_every: float = DEFAULT_FULL_EVERY,
+                 refresh_auth: Optional[Callable[[Any], None]] = None):
+        create_from_template(path, template)
+        self.remote = remote
+        self.local = sqlite_backend.SQLiteClient(path, unique_indexes=False)
+        with self.local.lock, self.local.conn:
+            # Fichiers de réplique créés avant : contraintes retirées
+            for statement in sqlite_backend.UNIQUE_INDEXES:
+                name = statement.split("IF NOT EXISTS ", 1)[1].split()[0]
+                self.local.conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+        self.interval = interval
+        self.full_every = full_every
+        self.refresh_auth = refresh_auth
+        self.last_sync: Dict[str, float] = {}
+        self.last_full: Dict[str, float] = {}
+        self.filled: set = set()  # tables dont une synchronisation a reçu des lignes
+        self.last_error: Optional[str] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Thread de fond ---
+    def start(self) -> "Replica":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="erp-replica", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.sync_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def sync_once(self) -> None:
+        if self.refresh_auth is not None:
+            self.refresh_auth(self.remote)
+        for table, key in REPLICATED_TABLES.items():
+            try:
+                started = time.time()
+                if key != "id" or started - self.last_full.get(table, 0.0) >= self.full_every:
+                    self._full(table, key)
+                    self.last_full[table] = started
+                else:
+                    self._delta(table)
+                self.last_sync[table] = started
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{table} : {e}"
+                log.warning("Réplique : synchronisation de %s impossible : %s", table, e)
+
+    def _delta(self, table: str) -> None:
+        with self.local.lock:
+            high = self.local.conn.execute(f'SELECT max(id) FROM "{table}"').fetchone()[0]
+        filters = [("gt", "id", high)] if high is not None else []
+        for page in pagination.fetch_pages(self.remote, table, "*", filters, order="id"):
+            self.apply_rows(table, page)
+            if page:
+                self.filled.add(table)
+
+    def _full(self, table: str, key: str) -> None:
+        seen = set()
+        for page in pagination.fetch_pages(self.remote, table, "*", order=key):
+            self.apply_rows(table, page)
+            seen.update(r[key] for r in page)
+        if seen:
+            self.filled.add(table)
+        elif table not in self.last_sync:
+            # Première copie vide (table vide, ou lignes masquées par RLS sans compte de réplique) : lectures sur Supabase
+            log.warning("Réplique : aucune ligne reçue pour %s, lectures laissées sur Supabase", table)
+        with self.local.lock:
+            local_keys = {r[0] for r in self.local.conn.execute(f'SELECT "{key}" FROM "{table}"')}
+        self.delete_keys(table, local_keys - seen)
+
+    # --- Application des lignes ---
+    def apply_rows(self, table: str, rows: Iterable[Dict[str, Any]]) -> None:
+        """Insère ou met à jour les lignes (ON CONFLICT DO UPDATE : les triggers de cumuls suivent)."""
+        rows = list(rows)
+        if not rows:
+            return
+        key = REPLICATED_TABLES[table]
+        columns = list(dict.fromkeys(c for r in rows for c in r))
+        self.local.add_columns(table, columns)
+        quoted = ", ".join(f'"{c}"' for c in columns)
+        updates = ", ".join(f'"{c}" = excluded."{c}"' for c in columns if c != key)
+        sql = f'INSERT INTO "{table}" ({quoted}) VALUES ({", ".join("?" * len(columns))}) ' \
+              f'ON CONFLICT ("{key}") DO ' + (f"UPDATE SET {updates}" if updates else "NOTHING")
+        with self.local.lock, self.local.conn:
+            self.local.conn.executemany(sql, [[sqlite_backend._value(r.get(c)) for c in columns] for r in rows])
+
+    def delete_keys(self, table: str, keys: Iterable[Any]) -> None:
+        keys = list(keys)
+        key = REPLICATED_TABLES[table]
+        with self.local.lock, self.local.conn:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                self.local.conn.execute(f'DELETE FROM "{table}" WHERE "{key}" IN ({", ".join("?" * len(chunk))})', chunk)
+
+    def on_write(self, table: str, op: str, filters, rows) -> None:
+        """Écriture de l'application sur Supabase : la ligne renvoyée est recopiée tout de suite."""
+        if table not in REPLICATED_TABLES:
+            return
+        key = REPLICATED_TABLES[table]
+        rows = [r for r in (rows or []) if isinstance(r, dict) and key in r]
+        try:
+            if op == "delete":
+                self.delete_keys(table, [r[key] for r in rows])
+            else:
+                self.apply_rows(table, rows)
+        except Exception as e:
+            log.warning("Réplique : écriture sur %s non recopiée : %s", table, e)
+        if not rows:
+            # Pas de représentation renvoyée : le prochain cycle rattrape
+            self._wake.set()
+
+    def on_change(self, change: change_feed.Change) -> None:
+        """Événement du flux de modifications : la copie suit sans attendre le cycle suivant."""
+        if change.table not in REPLICATED_TABLES:
+            return
+        key = REPLICATED_TABLES[change.table]
+        if change.op == change_feed.RESYNC:
+            # Événements manqués pendant la coupure : réconciliation complète au prochain cycle
+            self.last_full.pop(change.table, None)
+            self._wake.set()
+        elif change.op == change_feed.DELETE:
+            if change.key(key) is not None:
+                self.delete_keys(change.table, [change.key(key)])
+        elif change.record:
+            self.apply_rows(change.table, [change.record])
+
+    # --- État ---
+    def ready(self, table: Optional[str] = None) -> bool:
+        """Table (ou toutes) synchronisée au moins une fois avec des lignes reçues."""
+        if table is not None:
+            return table in self.last_sync and table in self.filled
+        return all(self.ready(t) for t in REPLICATED_TABLES)
+
+    def staleness(self) -> Optional[float]:
+        """Âge (secondes) de la table la moins récemment synchronisée ; None avant la première copie."""
+        if not all(t in self.last_sync for t in REPLICATED_TABLES):
+            return None
+        return time.time() - min(self.last_sync.values())
+
+
+def staleness_label(replica: Replica) -> str:
+    age = replica.staleness()
+    if age is None:
+        return "⏳ Copie locale en cours d'initialisation (lectures sur Supabase)"
+    texte = f"{int(age)} s" if age < 120 else f"{int(age // 60)} min"
+    etat = "🟢" if age < STALE_AFTER else "🟠"
+    erreur = f" — dernière erreur : {replica.last_error}" if replica.last_error else ""
+    vides = [t for t in REPLICATED_TABLES if t not in replica.filled]
+    sur_supabase = f" — lues sur Supabase (copie vide) : {', '.join(vides)}" if vides else ""
+    return f"{etat} Copie locale : il y a {texte}{erreur}{sur_supabase}"
+
+
+class _RoutedTable:
+    """select → réplique (si la table est copiée), écritures → Supabase."""
+
+    def __init__(self, client: "ReplicatedClient", name: str):
+        self.client = client
+        self.name = name
+
+    def select(self, *columns: str, **kwargs):
+        if self.name in REPLICATED_TABLES and self.client.replica.ready(self.name):
+            return self.client.replica.local.table(self.name).select(*columns, **kwargs)
+        return self.client.remote.table(self.name).select(*columns, **kwargs)
+
+    def insert(self, *args, **kwargs):
+        return self.client.remote.table(self.name).insert(*args, **kwargs)
+
+    def upsert(self, *args, **kwargs):
+        return self.client.remote.table(self.name).upsert(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self.client.remote.table(self.name).update(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self.client.remote.table(self.name).delete(*args, **kwargs)
+
+
+def _rpc_tables(fn: str, params: Optional[Dict[str, Any]]) -> Tuple[str, ...]:
+    """Tables lues par une fonction (aggregates.AGGREGATE_TABLES, p_table de distinct_values)."""
+    if fn == "distinct_values":
+        return (str((params or {}).get("p_table")),)
+    return aggregates.AGGREGATE_TABLES.get(fn, tuple(REPLICATED_TABLES))
+
+
+class ReplicatedClient:
+    """Client de session : lectures sur la réplique locale, écritures et authentification sur Supabase."""
+
+    def __init__(self, remote, replica: Replica):
+        self.remote = remote
+        self.replica = replica
+
+    def table(self, name: str) -> _RoutedTable:
+        return _RoutedTable(self, name)
+
+    from_ = table
+
+    def rpc(self, fn: str, params: Optional[Dict[str, Any]] = None):
+        # Fonction servie localement dès que les tables qu'elle lit sont prêtes (une table vide
+        # ailleurs ne la renvoie pas sur Supabase)
+        if fn in LOCAL_RPC and all(self.replica.ready(t) for t in _rpc_tables(fn, params)):
+            return self.replica.local.rpc(fn, params)
+        return self.remote.rpc(fn, params)
+
+    def set_bearer(self, token: Optional[str]) -> None:
+        self.remote.set_bearer(token)
+
+
+# --- Réplique du processus ---
+_replica: Optional[Replica] = None
+_lock = threading.Lock()
+
+
+def start(remote, path: str = "erp_replica.db", **kwargs) -> Replica:
+    """Démarre (une fois par processus) la réplique et son thread de fond."""
+    global _replica
+    with _lock:
+        if _replica is None:
+            _replica = Replica(remote, path, **kwargs)
+            data_access.add_write_listener(_replica.on_write)
+            change_feed.add_consumer(_replica.on_change)
+        return _replica.start()
@@ -0,0 +1,128 @@
+"""
+Cumuls quotidiens pour la base SQLite locale (erp_lots).
+
+Équivalent de 003_rollups_quotidiens.sql : rollup_lots_jour (jour × filiale ×
+type_lot) et rollup_controle_jour (jour × filiale × type_carte × resultat),
+tenues à jour par triggers à chaque insertion, modification et suppression.
+Les agrégats SQLite de aggregates.py lisent ces tables.
+"""
+import sqlite3
+
+ROLLUP_TABLES = """
+CREATE TABLE IF NOT EXISTS rollup_lots_jour (
+    jour TEXT NOT NULL,
+    filiale TEXT NOT NULL DEFAULT '',
+    type_lot TEXT NOT NULL DEFAULT '',
+    nb_lots INTEGER NOT NULL DEFAULT 0,
+    quantite INTEGER NOT NULL DEFAULT 0,
+    lots_avec_pin INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (jour, filiale, type_lot)
+);
+CREATE TABLE IF NOT EXISTS rollup_controle_jour (
+    jour TEXT NOT NULL,
+    filiale TEXT NOT NULL DEFAULT '',
+    type_carte TEXT NOT NULL DEFAULT '',
+    resultat TEXT NOT NULL DEFAULT '',
+    nb_tests INTEGER NOT NULL DEFAULT 0,
+    quantite INTEGER NOT NULL DEFAULT 0,
+    quantite_a_tester INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (jour, filiale, type_carte, resultat)
+);
+"""
+
+
+def _lots(row: str, signe: int) -> str:
+    """Ajoute (signe=1) ou retire (signe=-1) la ligne lots NEW / OLD des cumuls."""
+    return f"""
+    INSERT INTO rollup_lots_jour (jour, filiale, type_lot, nb_lots, quantite, lots_avec_pin)
+    SELECT date({row}.date_enregistrement), coalesce({row}.filiale, ''), coalesce({row}.type_lot, ''),
+           {signe}, {signe} * coalesce({row}.quantite, 0), {signe} * coalesce({row}.impression_pin = 'Oui', 0)
+    WHERE {row}.date_enregistrement IS NOT NULL
+    ON CONFLICT (jour, filiale, type_lot) DO UPDATE SET
+        nb_lots = nb_lots + excluded.nb_lots,
+        quantite = quantite + excluded.quantite,
+        lots_avec_pin = lots_avec_pin + excluded.lots_avec_pin;
+    DELETE FROM rollup_lots_jour WHERE nb_lots <= 0;"""
+
+
+def _controle(source: str, filiale: str, signe: int) -> str:
+    """Ajoute / retire les contrôles c de la requête source sous la filiale donnée."""
+    return f"""
+    INSERT INTO rollup_controle_jour (jour, filiale, type_carte, resultat, nb_tests, quantite, quantite_a_tester)
+    SELECT date(c.date_controle), coalesce({filiale}, ''), coalesce(c.type_carte, ''), coalesce(c.resultat, ''),
+           {signe}, {signe} * coalesce(c.quantite, 0), {signe} * coalesce(c.quantite_a_tester, 0)
+    {source}
+    ON CONFLICT (jour, filiale, type_carte, resultat) DO UPDATE SET
+        nb_tests = nb_tests + excluded.nb_tests,
+        quantite = quantite + excluded.quantite,
+        quantite_a_tester = quantite_a_tester + excluded.quantite_a_tester;
+    DELETE FROM rollup_controle_jour WHERE nb_tests <= 0;"""
+
+
+def _ligne_controle(row: str) -> str:
+    return f"FROM (SELECT {row}.date_controle AS date_controle, {row}.type_carte AS type_carte, " \
+           f"{row}.resultat AS resultat, {row}.quantite AS quantite, {row}.quantite_a_tester AS quantite_a_tester) c " \
+           f"WHERE c.date_controle IS NOT NULL"
+
+
+# La filiale des contrôles vient du lot : ses cumuls suivent un changement de filiale
+_CONTROLES_DU_LOT = "FROM controle_qualite c WHERE c.lot_id = OLD.id AND c.date_controle IS NOT NULL"
+
+ROLLUP_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS trg_rollup_lots_ins AFTER INSERT ON lots BEGIN
+    {_lots("NEW", 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rollup_lots_upd AFTER UPDATE ON lots BEGIN
+    {_lots("OLD", -1)}
+    {_lots("NEW", 1)}
+    {_controle(_CONTROLES_DU_LOT + " AND OLD.filiale IS NOT NEW.filiale", "OLD.filiale", -1)}
+    {_controle(_CONTROLES_DU_LOT + " AND OLD.filiale IS NOT NEW.filiale", "NEW.filiale", 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rollup_lots_del AFTER DELETE ON lots BEGIN
+    {_lots("OLD", -1)}
+    {_controle(_CONTROLES_DU_LOT, "OLD.filiale", -1)}
+    {_controle(_CONTROLES_DU_LOT, "NULL", 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rollup_controle_ins AFTER INSERT ON controle_qualite BEGIN
+    {_controle(_ligne_controle("NEW"), "(SELECT filiale FROM lots WHERE id = NEW.lot_id)", 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rollup_controle_upd AFTER UPDATE ON controle_qualite BEGIN
+    {_controle(_ligne_controle("OLD"), "(SELECT filiale FROM lots WHERE id = OLD.lot_id)", -1)}
+    {_controle(_ligne_controle("NEW"), "(SELECT filiale FROM lots WHERE id = NEW.lot_id)", 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rollup_controle_del AFTER DELETE ON controle_qualite BEGIN
+    {_controle(_ligne_controle("OLD"), "(SELECT filiale FROM lots WHERE id = OLD.lot_id)", -1)}
+END;
+"""
+
+REBUILD = """
+DELETE FROM rollup_lots_jour;
+DELETE FROM rollup_controle_jour;
+INSERT INTO rollup_lots_jour (jour, filiale, type_lot, nb_lots, quantite, lots_avec_pin)
+SELECT date(l.date_enregistrement), coalesce(l.filiale, ''), coalesce(l.type_lot, ''),
+       count(*), coalesce(sum(l.quantite), 0), sum(coalesce(l.impression_pin = 'Oui', 0))
+FROM lots l WHERE l.date_enregistrement IS NOT NULL
+GROUP BY 1, 2, 3;
+INSERT INTO rollup_controle_jour (jour, filiale, type_carte, resultat, nb_tests, quantite, quantite_a_tester)
+SELECT date(c.date_controle), coalesce(l.filiale, ''), coalesce(c.type_carte, ''), coalesce(c.resultat, ''),
+       count(*), coalesce(sum(c.quantite), 0), coalesce(sum(c.quantite_a_tester), 0)
+FROM controle_qualite c LEFT JOIN lots l ON l.id = c.lot_id
+WHERE c.date_controle IS NOT NULL
+GROUP BY 1, 2, 3, 4;
+"""
+
+
+def install(conn: sqlite3.Connection) -> None:
+    """Crée les tables de cumuls et leurs triggers ; les remplit à la première installation."""
+    existe = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup_lots_jour'"
+    ).fetchone()
+    conn.executescript(ROLLUP_TABLES + ROLLUP_TRIGGERS)
+    if not existe:
+        rebuild(conn)
+
+
+def rebuild(conn: sqlite3.Connection) -> None:
+    """Recalcule entièrement les cumuls (initialisation, contrôle de cohérence)."""
+    conn.executescript(REBUILD)
+    conn.commit()
@@ -0,0 +1,441 @@
+"""
+Base SQLite locale (erp_lots) derrière la même interface que le client Supabase.
+
+SQLiteClient expose table() / from_() / rpc() / set_bearer() comme
+data_access.SessionClient ; le constructeur de requêtes accepte les appels des
+pages et de data_access (select, eq / neq / gt / gte / lt / lte / like / ilike
+/ in_ / is_, order, limit, range, insert, upsert, update, delete, execute) et
+renvoie un objet .data / .count comme postgrest. Les erreurs remontent en
+APIError. Sert à l'exécution hors ligne, aux mesures sans latence réseau et
+de base réaliste pour les essais.
+
+La base de travail (DEFAULT_PATH, hors dépôt) est une copie du fichier
+erp_lots versionné, faite à la première ouverture : colonnes ajoutées,
+index, cumuls et user_id dérivés ne touchent jamais le modèle.
+
+Les fonctions SQL des migrations (distinct_values, kpi_*, reserver_ids,
+login_utilisateur, get_auth_user_by_email) ont leur équivalent local.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import closing
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from postgrest.exceptions import APIError
+
+import aggregates
+import rollups
+
+log = logging.getLogger("erp.data")
+
+TEMPLATE = "erp_lots"          # base versionnée : modèle ouvert en lecture seule
+DEFAULT_PATH = "erp_local.db"  # base de travail du backend local
+
+# Colonnes présentes côté Supabase mais absentes du fichier erp_lots d'origine
+MISSING_COLUMNS: Dict[str, Tuple[Tuple[str, str], ...]] = {
+    "conditionnement": (("nom_lot", "TEXT"),),
+    "utilisateurs": (("user_id", "TEXT"), ("email", "TEXT")),
+    "agences_livraison": (("created_by", "TEXT"), ("operateur", "TEXT")),
+    "expedition": (("cle_idempotence", "TEXT"),),
+}
+
+# Équivalents locaux de 005_conditionnement_unique.sql, 006_file_ecritures.sql (cibles des upserts)
+# et 008_lots_nom_unique.sql
+UNIQUE_INDEXES = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS conditionnement_unique_paquet "
+    "ON conditionnement (nom_lot, date_conditionnement, type_emballage, filiale)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS expedition_cle_idempotence_key ON expedition (cle_idempotence)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS expedition_lot_unique ON expedition (lot_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS lots_nom_lot_unique ON lots (nom_lot)",
+)
+
+# Index des filtres des pages (mêmes colonnes que 001_rpc_distinct_values.sql)
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS lots_date_enregistrement_idx ON lots (date_enregistrement)",
+    "CREATE INDEX IF NOT EXISTS lots_nom_lot_idx ON lots (nom_lot)",
+    "CREATE INDEX IF NOT EXISTS controle_qualite_date_controle_idx ON controle_qualite (date_controle)",
+    "CREATE INDEX IF NOT EXISTS controle_qualite_lot_id_idx ON controle_qualite (lot_id)",
+    "CREATE INDEX IF NOT EXISTS conditionnement_date_idx ON conditionnement (date_conditionnement)",
+    "CREATE INDEX IF NOT EXISTS expedition_lot_id_idx ON expedition (lot_id)",
+    "CREATE INDEX IF NOT EXISTS livreurs_agence_idx ON livreurs (agence)",
+)
+
+
+class Response:
+    """Même forme que la réponse postgrest : .data (liste de lignes) et .count."""
+
+    def __init__(self, data: List[Dict[str, Any]], count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+def _error(message: str, code: str = "sqlite") -> APIError:
+    return APIError({"message": message, "code": code, "hint": None, "details": None})
+
+
+def _quote(column: str) -> str:
+    return f'"{column}"'
+
+
+def _value(value: Any) -> Any:
+    # Booléens stockés en 0 / 1 comme dans erp_lots
+    return int(value) if isinstance(value, bool) else value
+
+
+def ensure_schema(conn: sqlite3.Connection, unique_indexes: bool = True) -> None:
+    """
+    Ajoute les colonnes et index attendus par l'application (fichier erp_lots antérieur).
+    unique_indexes=False : sans les contraintes d'unicité (copie de données déjà validées ailleurs).
+    """
+    for table, columns in MISSING_COLUMNS.items():
+        existing = {r[1] for r in conn.execute(f'PRAGMA table_info("{table}")')}
+        if not existing:
+            continue
+        for column, sql_type in columns:
+            if column not in existing:
+                conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {sql_type}')
+    for statement in INDEXES:
+        conn.execute(statement)
+    for statement in UNIQUE_INDEXES if unique_indexes else ():
+        try:
+            conn.execute(statement)
+        except sqlite3.IntegrityError as e:
+            log.warning("Index unique non créé (doublons existants) : %s", e)
+    conn.commit()
+
+
+class QueryBuilder:
+    """Requête sur une table, construite par appels chaînés puis exécutée par execute()."""
+
+    def __init__(self, client: "SQLiteClient", table: str):
+        self.client = client
+        self.table = table
+        self._action = "select"
+        self._columns: Sequence[str] = ("*",)
+        self._count: Optional[str] = None
+        self._where: List[str] = []
+        self._params: List[Any] = []
+        self._order: List[str] = []
+        self._limit: Optional[int] = None
+        self._offset = 0
+        self._payload: Any = None
+        self._on_conflict = ""
+        self._ignore_duplicates = False
+
+    # --- Actions ---
+    def select(self, *columns: str, count: Optional[str] = None, head: Optional[bool] = None) -> "QueryBuilder":
+        cols = [c.strip() for part in columns for c in part.split(",") if c.strip()]
+        self._columns = tuple(cols) or ("*",)
+        self._count = str(getattr(count, "value", count)) if count else None
+        return self
+
+    def insert(self, json: Any, *, count=None, returning=None, upsert: bool = False,
+               default_to_null: bool = True) -> "QueryBuilder":
+        self._action, self._payload = ("upsert" if upsert else "insert"), json
+        return self
+
+    def upsert(self, json: Any, *, count=None, returning=None, ignore_duplicates: bool = False,
+               on_conflict: str = "", default_to_null: bool = True) -> "QueryBuilder":
+        self._action, self._payload = "upsert", json
+        self._on_conflict, self._ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def update(self, json: Dict[str, Any], *, count=None, returning=None) -> "QueryBuilder":
+        self._action, self._payload = "update", json
+        return self
+
+    def delete(self, *, count=None, returning=None) -> "QueryBuilder":
+        self._action = "delete"
+        return self
+
+    # --- Filtres ---
+    def _filter(self, column: str, sql: str, *params: Any) -> "QueryBuilder":
+        self.client.check_columns(self.table, [column])
+        self._where.append(f'"{column}" {sql}')
+        self._params.extend(_value(p) for p in params)
+        return self
+
+    def eq(self, column: str, value: Any) -> "QueryBuilder":
+        return self._filter(column, "= ?", value)
+
+    def neq(self, column: str, value: Any) -> "QueryBuilder":
+        return self._filter(column, "!= ?", value)
+
+    def gt(self, column: str, value: Any) -> "QueryBuilder":
+        return self._filter(column, "> ?", value)
+
+    def gte(self, column: str, value: Any) -> "QueryBuilder":
+        return self._filter(column, ">= ?", value)
+
+    def lt(self, column: str, value: Any) -> "QueryBuilder":
+        return self._filter(column, "< ?", value)
+
+    def lte(self, column: str, value: Any) -> "QueryBuilder":
+        return self._filter(column, "<= ?", value)
+
+    def like(self, column: str, pattern: str) -> "QueryBuilder":
+        return self._filter(column, "LIKE ?", str(pattern).replace("*", "%"))
+
+    def ilike(self, column: str, pattern: str) -> "QueryBuilder":
+        self.client.check_columns(self.table, [column])
+        self._where.append(f'lower("{column}") LIKE lower(?)')
+        self._params.append(str(pattern).replace("*", "%"))
+        return self
+
+    def in_(self, column: str, values: Sequence[Any]) -> "QueryBuilder":
+        values = list(values)
+        if not values:
+            self.client.check_columns(self.table, [column])
+            self._where.append("0")
+            return self
+        return self._filter(column, f"IN ({', '.join('?' * len(values))})", *values)
+
+    def is_(self, column: str, value: Any) -> "QueryBuilder":
+        if value is None or str(value).lower() == "null":
+            return self._filter(column, "IS NULL")
+        return self._filter(column, "IS ?", value if isinstance(value, bool) else str(value).lower() == "true")
+
+    def order(self, column: str, *, desc: bool = False, nullsfirst: Optional[bool] = None,
+              foreign_table: Optional[str] = None) -> "QueryBuilder":
+        self.client.check_columns(self.table, [column])
+        # Comme PostgreSQL : NULL en dernier en ordre croissant, en premier en décroissant
+        nulls = desc if nullsfirst is None else nullsfirst
+        self._order.append(f'"{column}" {"DESC" if desc else "ASC"} NULLS {"FIRST" if nulls else "LAST"}')
+        return self
+
+    def limit(self, size: int, *, foreign_table: Optional[str] = None) -> "QueryBuilder":
+        self._limit = size
+        return self
+
+    def range(self, start: int, end: int, foreign_table: Optional[str] = None) -> "QueryBuilder":
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    # --- Exécution ---
+    def _where_sql(self) -> str:
+        return f" WHERE {' AND '.join(self._where)}" if self._where else ""
+
+    def _select_sql(self) -> Tuple[str, List[Any]]:
+        columns = self._columns
+        if columns != ("*",):
+            self.client.check_columns(self.table, columns)
+        cols = "*" if columns == ("*",) else ", ".join(f'"{c}"' for c in columns)
+        sql = f'SELECT {cols} FROM "{self.table}"{self._where_sql()}'
+        if self._order:
+            sql += " ORDER BY " + ", ".join(self._order)
+        params = list(self._params)
+        if self._limit is not None or self._offset:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if self._limit is None else self._limit, self._offset]
+        return sql, params
+
+    def _rows(self) -> List[Dict[str, Any]]:
+        payload = self._payload
+        rows = [payload] if isinstance(payload, dict) else list(payload or [])
+        for row in rows:
+            self.client.check_columns(self.table, row.keys())
+        return rows
+
+    def _write(self, conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        if self._action in ("insert", "upsert"):
+            conflict = ""
+            if self._action == "upsert":
+                target = [c.strip() for c in (self._on_conflict or "id").split(",") if c.strip()]
+                self.client.check_columns(self.table, target)
+                conflict = f" ON CONFLICT ({', '.join(map(_quote, target))}) "
+            for row in self._rows():
+                cols = list(row)
+                sql = f'INSERT INTO "{self.table}" ({", ".join(map(_quote, cols))}) ' \
+                      f'VALUES ({", ".join("?" * len(cols))})'
+                if conflict:
+                    updates = [c for c in cols if c not in target]
+                    if self._ignore_duplicates or not updates:
+                        sql += conflict + "DO NOTHING"
+                    else:
+                        sql += conflict + "DO UPDATE SET " + ", ".join(f'"{c}" = excluded."{c}"' for c in updates)
+                out += [dict(r) for r in conn.execute(sql + " RETURNING *", [_value(row[c]) for c in cols])]
+        elif self._action == "update":
+            values = dict(self._payload or {})
+            self.client.check_columns(self.table, values.keys())
+            sets = ", ".join(f'"{c}" = ?' for c in values)
+            sql = f'UPDATE "{self.table}" SET {sets}{self._where_sql()} RETURNING *'
+            out = [dict(r) for r in conn.execute(sql, [_value(v) for v in values.values()] + self._params)]
+        elif self._action == "delete":
+            sql = f'DELETE FROM "{self.table}"{self._where_sql()} RETURNING *'
+            out = [dict(r) for r in conn.execute(sql, self._params)]
+        return out
+
+    def execute(self) -> Response:
+        self.client.check_table(self.table)
+        try:
+            with self.client.lock:
+                conn = self.client.conn
+                if self._action == "select":
+                    sql, params = self._select_sql()
+                    data = [dict(r) for r in conn.execute(sql, params)]
+                    count = None
+                    if self._count:
+                        count = conn.execute(f'SELECT count(*) FROM "{self.table}"{self._where_sql()}',
+                                             self._params).fetchone()[0]
+                    return Response(data, count)
+                # Une écriture = une transaction : tout ou rien, comme une requête PostgREST
+                with conn:
+                    return Response(self._write(conn))
+        except sqlite3.IntegrityError as e:
+            # Mêmes codes que PostgreSQL : violation d'unicité = 23505
+            raise _error(str(e), "23505" if "UNIQUE" in str(e) else "23000") from e
+        except sqlite3.Error as e:
+            raise _error(str(e)) from e
+
+
+class RPCBuilder:
+    def __init__(self, client: "SQLiteClient", fn: str, params: Dict[str, Any]):
+        self.client, self.fn, self.params = client, fn, params
+
+    def execute(self) -> Response:
+        handler = self.client.functions.get(self.fn)
+        if handler is None and self.fn not in aggregates.SQLITE_QUERIES:
+            raise _error(f"Fonction {self.fn} introuvable", "PGRST202")
+        try:
+            with self.client.lock:
+                if handler is None:
+                    return Response(self.client.kpi(self.fn, self.params))
+                return Response(handler(**self.params))
+        except sqlite3.Error as e:
+            raise _error(str(e)) from e
+
+
+class SQLiteClient:
+    """Client local : mêmes appels que data_access.SessionClient, exécutés sur SQLite."""
+
+    def __init__(self, path: str = DEFAULT_PATH, conn: Optional[sqlite3.Connection] = None,
+                 unique_indexes: bool = True):
+        self.path = path
+        self.conn = conn or sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        # Une connexion partagée par les threads des sessions : accès sérialisés
+        self.lock = threading.RLock()
+        self._schema: Dict[str, Tuple[str, ...]] = {}
+        with self.lock:
+            ensure_schema(self.conn, unique_indexes)
+            rollups.install(self.conn)
+        self.functions: Dict[str, Callable[..., List[Any]]] = {
+            "distinct_values": self._distinct_values,
+            "reserver_ids": self._reserver_ids,
+            "login_utilisateur": self._login_utilisateur,
+            "get_auth_user_by_email": self._get_auth_user_by_email,
+        }
+
+    # --- Interface commune ---
+    def table(self, name: str) -> QueryBuilder:
+        return QueryBuilder(self, name)
+
+    from_ = table
+
+    def rpc(self, fn: str, params: Optional[Dict[str, Any]] = None) -> RPCBuilder:
+        return RPCBuilder(self, fn, params or {})
+
+    def set_bearer(self, token: Optional[str]) -> None:
+        """Pas de RLS en local : le jeton est ignoré."""
+
+    # --- Schéma ---
+    def add_columns(self, table: str, columns) -> None:
+        """Ajoute les colonnes inconnues (sans type, comme le permet SQLite)."""
+        missing = [c for c in columns if c not in self.columns(table)]
+        if not missing:
+            return
+        with self.lock:
+            for column in missing:
+                self.conn.execute(f'ALTER TABLE "{table}" ADD COLUMN {_quote(column)}')
+            self._schema.pop(table, None)
+
+    def columns(self, table: str) -> Tuple[str, ...]:
+        if table not in self._schema:
+            with self.lock:
+                self._schema[table] = tuple(r[1] for r in self.conn.execute(f'PRAGMA table_info("{table}")'))
+        return self._schema[table]
+
+    def check_table(self, table: str) -> None:
+        if not self.columns(table):
+            raise _error(f"Table {table} introuvable", "42P01")
+
+    def check_columns(self, table: str, columns) -> None:
+        known = self.columns(table)
+        unknown = [c for c in columns if c not in known]
+        if unknown:
+            raise _error(f"Colonne(s) {unknown} introuvable(s) dans {table}", "42703")
+
+    # --- Fonctions SQL locales ---
+    def kpi(self, name: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return aggregates.sqlite_fetch(self.conn, name, **params).to_dict("records")
+
+    def _distinct_values(self, p_table: str, p_column: str) -> List[str]:
+        self.check_columns(p_table, [p_column])
+        rows = self.conn.execute(
+            f'SELECT DISTINCT CAST("{p_column}" AS TEXT) FROM "{p_table}" WHERE "{p_column}" IS NOT NULL ORDER BY 1'
+        )
+        return [r[0] for r in rows]
+
+    def _reserver_ids(self, p_table: str, p_nombre: int) -> List[int]:
+        self.check_table(p_table)
+        nombre = max(int(p_nombre), 1)
+        with self.conn:
+            row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (p_table,)).fetchone()
+            start = row[0] if row else (self.conn.execute(f'SELECT coalesce(max(id), 0) FROM "{p_table}"').fetchone()[0])
+            if row:
+                self.conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (start + nombre, p_table))
+            else:
+                self.conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (p_table, start + nombre))
+        return list(range(start + 1, start + nombre + 1))
+
+    def _login_utilisateur(self, ident: str, pass_hash: str) -> List[Dict[str, Any]]:
+        row = self.conn.execute(
+            "SELECT id, user_id, identifiant, role, doit_changer_mdp FROM utilisateurs "
+            "WHERE identifiant = ? AND mot_de_passe = ? AND coalesce(actif, 1) = 1",
+            (ident, pass_hash),
+        ).fetchone()
+        if row is None:
+            return []
+        user_id = row["user_id"]
+        if not user_id:
+            # Pas d'utilisateur auth.users en local : identifiant stable dérivé de l'id
+            user_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"erp_lots/utilisateurs/{row['id']}"))
+            with self.conn:
+                self.conn.execute("UPDATE utilisateurs SET user_id = ? WHERE id = ?", (user_id, row["id"]))
+        return [{"user_id": user_id, "role": row["role"] or "operateur", "display_name": row["identifiant"],
+                 "doit_changer_mdp": bool(row["doit_changer_mdp"])}]
+
+    def _get_auth_user_by_email(self, p_email: str) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            "SELECT user_id AS id, email FROM utilisateurs WHERE lower(email) = lower(?) AND user_id IS NOT NULL",
+            (p_email,),
+        )
+        return [dict(r) for r in rows]
+
+
+_clients: Dict[str, SQLiteClient] = {}
+_clients_lock = threading.Lock()
+
+
+def copy_template(path: str, template: str = TEMPLATE) -> None:
+    """Copie (schéma et données) du modèle versionné vers la base de travail path."""
+    with closing(sqlite3.connect(f"file:{template}?mode=ro", uri=True)) as src, \
+            closing(sqlite3.connect(path)) as dst:
+        src.backup(dst)
+    log.info("Base locale %s créée depuis %s", path, template)
+
+
+def connect(path: str = DEFAULT_PATH, template: str = TEMPLATE) -> SQLiteClient:
+    """Client SQLite du processus pour ce fichier (une connexion partagée par les sessions)."""
+    if os.path.exists(template) and os.path.exists(path) and os.path.samefile(path, template):
+        raise ValueError(f"{template} est le modèle versionné : choisissez une autre base (sqlite_path)")
+    with _clients_lock:
+        if path not in _clients:
+            if not os.path.exists(path):
+                copy_template(path, template)
+            _clients[path] = SQLiteClient(path)
+        return _clients[path]
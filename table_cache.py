@@ -0,0 +1,73 @@
+"""
+Cache de lecture partagé par le processus, placé devant les requêtes PostgREST.
+
+Les entrées sont rangées par table puis par clé (projection, filtres, tri) et
+expirent selon un TTL propre à chaque table. Toute écriture sur une table passe
+par invalidate(table) : les pages relisent alors la base au rerun suivant.
+"""
+import threading
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+# TTL (secondes) par défaut ; surchargés par la section [cache_ttl] de secrets.toml
+DEFAULT_TTL = 60.0
+TABLE_TTLS: Dict[str, float] = {
+    "lots": 120.0,
+    "controle_qualite": 120.0,
+    "conditionnement": 120.0,
+    "expedition": 120.0,
+    "livreurs": 600.0,
+    "agences_livraison": 600.0,
+    "references_expedition": 600.0,
+}
+
+
+class TableCache:
+    """Cache TTL thread-safe, invalidable table par table."""
+
+    def __init__(self, default_ttl: float = DEFAULT_TTL, ttls: Optional[Dict[str, float]] = None):
+        self.default_ttl = default_ttl
+        self.ttls: Dict[str, float] = dict(ttls or {})
+        self._entries: Dict[str, Dict[Hashable, Tuple[float, List[Dict[str, Any]]]]] = {}
+        # Génération par table : une lecture commencée avant une invalidation ne repeuple pas le cache
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def ttl_for(self, table: str) -> float:
+        return float(self.ttls.get(table, self.default_ttl))
+
+    def generation(self, table: str) -> int:
+        with self._lock:
+            return self._generations.get(table, 0)
+
+    def get(self, table: str, key: Hashable) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(table, {}).get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, table: str, key: Hashable, rows: List[Dict[str, Any]],
+            generation: int, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl_for(table) if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            if self._generations.get(table, 0) != generation:
+                return
+            self._entries.setdefault(table, {})[key] = (time.monotonic() + ttl, rows)
+
+    def invalidate(self, table: str) -> None:
+        with self._lock:
+            self._entries.pop(table, None)
+            self._generations[table] = self._generations.get(table, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for table in list(self._entries):
+                self._generations[table] = self._generations.get(table, 0) + 1
+            self._entries.clear()
@@ -0,0 +1,298 @@
+"""
+File d'écritures durable (conditionnement, expédition) rejouée vers Supabase.
+
+Chaque écriture est d'abord enregistrée dans la table file_ecritures du
+fichier SQLite local (DEFAULT_PATH, hors dépôt) : l'opérateur est acquitté tout de suite.
+Si rien n'attend et que la connexion est bonne, l'envoi est tenté dans la
+foulée ; sinon un thread de fond rejoue la file dans l'ordre, par lots, dès
+le retour de la connexion.
+
+Idempotence : l'envoi est un upsert "ignore les doublons" sur une clé
+unique, soit la clé métier fournie (on_conflict, ex. le paquet de
+conditionnement), soit cle_idempotence posée sur chaque ligne
+(006_file_ecritures.sql). Un second envoi après un accusé perdu ne crée rien.
+Les violations d'une autre contrainte (lot déjà expédié...) sont mises de
+côté en statut « conflit » et affichées aux opérateurs.
+
+Une écriture envoyée dans la foulée est réservée (statut « en cours ») sous le
+verrou avant l'envoi : le thread de rejeu ne la reprend pas en même temps.
+Réservations laissées par un processus arrêté en plein envoi : remises en
+attente à l'ouverture de la file (le rejeu est idempotent).
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from postgrest.exceptions import APIError
+
+import data_access
+
+log = logging.getLogger("erp.data")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_ecritures (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    cle TEXT NOT NULL UNIQUE,
+    table_cible TEXT NOT NULL,
+    lignes TEXT NOT NULL,
+    on_conflict TEXT NOT NULL,
+    user_id TEXT,
+    statut TEXT NOT NULL DEFAULT 'en_attente',
+    tentatives INTEGER NOT NULL DEFAULT 0,
+    erreur TEXT,
+    cree_le TEXT NOT NULL,
+    envoye_le TEXT
+);
+CREATE INDEX IF NOT EXISTS file_ecritures_statut_idx ON file_ecritures (statut, seq);
+"""
+
+DEFAULT_PATH = "erp_file_ecritures.db"  # fichier de travail, jamais la base erp_lots versionnée
+BATCH_SIZE = 100        # lignes par requête de rejeu
+RETRY_DELAY = 15.0      # secondes entre deux tentatives hors connexion
+IDEMPOTENCY_COLUMN = "cle_idempotence"
+
+# Statuts d'une écriture
+EN_ATTENTE, EN_COURS, ENVOYE, CONFLIT, ERREUR, IGNORE = (
+    "en_attente", "en_cours", "envoye", "conflit", "erreur", "ignore")
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _message(e: Exception) -> str:
+    return str(getattr(e, "message", None) or e)
+
+
+def _permanent(e: APIError) -> Optional[str]:
+    """Statut d'une erreur définitive (le rejeu n'y changera rien), None si elle est passagère."""
+    code = str(e.code or "")
+    if code == "23505":
+        return CONFLIT
+    if code.startswith(("22", "23", "42")) or code.startswith("PGRST2"):
+        return ERREUR
+    return None
+
+
+class WriteQueue:
+    """File d'écritures persistée en SQLite, rejouée dans l'ordre par un thread de fond."""
+
+    def __init__(self, path: str = DEFAULT_PATH, client=None,
+                 token_factory: Optional[Callable[[str], str]] = None,
+                 retry_delay: float = RETRY_DELAY):
+        self.path = path
+        self.client = client
+        self.token_factory = token_factory
+        self.retry_delay = retry_delay
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        with self.conn:
+            self.conn.execute("UPDATE file_ecritures SET statut = ? WHERE statut = ?", (EN_ATTENTE, EN_COURS))
+        self.lock = threading.RLock()
+        self.offline_since: Optional[float] = None
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Soumission ---
+    def submit(self, client, table: str, rows: Any, on_conflict: Optional[str] = None,
+               user_id: Optional[str] = None) -> Tuple[str, List[Dict[str, Any]], Optional[str]]:
+        """
+        Enregistre l'écriture dans la file puis tente l'envoi si la file est vide.
+        Renvoie (statut, lignes créées, erreur de cet envoi) ; statut en_attente = acquittée localement seulement.
+        """
+        rows = [dict(r) for r in ([rows] if isinstance(rows, dict) else rows)]
+        cle = str(uuid.uuid4())
+        if on_conflict is None:
+            on_conflict = IDEMPOTENCY_COLUMN
+            for i, row in enumerate(rows):
+                row[IDEMPOTENCY_COLUMN] = f"{cle}:{i}"
+        with self.lock, self.conn:
+            backlog = self.conn.execute(
+                "SELECT count(*) FROM file_ecritures WHERE statut = ?", (EN_ATTENTE,)
+            ).fetchone()[0]
+            # Envoi immédiat seulement si rien ne le précède (ordre) et si la connexion n'est pas réputée
+            # coupée : la ligne est alors réservée (en cours), le rejeu ne la prend pas
+            immediate = backlog == 0 and self.online()
+            seq = self.conn.execute(
+                "INSERT INTO file_ecritures (cle, table_cible, lignes, on_conflict, user_id, statut, cree_le) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (cle, table, json.dumps(rows, default=str), on_conflict, user_id,
+                 EN_COURS if immediate else EN_ATTENTE, _now()),
+            ).lastrowid
+        if immediate:
+            try:
+                data = self._send(client, table, rows, on_conflict)
+                self._mark([seq], ENVOYE, self._report(table, rows, data, on_conflict))
+                return ENVOYE, data, None
+            except (httpx.TransportError, APIError) as e:
+                if self._failed([seq], e):
+                    return self._status(seq), [], _message(e)
+        self._wake.set()
+        return EN_ATTENTE, [], None
+
+    def exists(self, client, table: str, filters) -> Optional[bool]:
+        """
+        Contrôle en ligne avant soumission (ex. lot déjà expédié) : True si une ligne correspond.
+        None hors connexion : l'écriture part en file et la contrainte de la base tranche au rejeu.
+        """
+        if not self.online():
+            return None
+        try:
+            return bool(data_access.select_rows(client, table, "id", filters, limit=1))
+        except httpx.TransportError:
+            self.offline_since = self.offline_since or time.time()
+            return None
+
+    # --- Rejeu ---
+    def start(self) -> "WriteQueue":
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="erp-write-queue", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.replay()
+            except Exception as e:
+                log.warning("File d'écritures : rejeu interrompu : %s", e)
+            self._wake.wait(self.retry_delay)
+            self._wake.clear()
+
+    def replay(self) -> int:
+        """Envoie les écritures en attente dans l'ordre ; s'arrête à la première erreur passagère."""
+        sent = 0
+        while True:
+            with self.lock:
+                items = self.conn.execute(
+                    "SELECT * FROM file_ecritures WHERE statut = ? ORDER BY seq LIMIT ?", (EN_ATTENTE, BATCH_SIZE)
+                ).fetchall()
+            if not items:
+                return sent
+            # Lot : écritures consécutives de même cible, même clé et même auteur
+            head = items[0]
+            batch = [head]
+            for item in items[1:]:
+                same = (item["table_cible"], item["on_conflict"], item["user_id"]) == \
+                       (head["table_cible"], head["on_conflict"], head["user_id"])
+                if not same or sum(len(json.loads(i["lignes"])) for i in batch) >= BATCH_SIZE:
+                    break
+                batch.append(item)
+            client = self._client_for(head["user_id"])
+            try:
+                self._replay_batch(client, batch)
+            except (httpx.TransportError, APIError):
+                return sent
+            sent += len(batch)
+
+    def _replay_batch(self, client, batch) -> None:
+        table, on_conflict = batch[0]["table_cible"], batch[0]["on_conflict"]
+        rows = [json.loads(item["lignes"]) for item in batch]
+        try:
+            data = self._send(client, table, [r for part in rows for r in part], on_conflict)
+        except APIError as e:
+            if len(batch) == 1 or _permanent(e) is None:
+                if self._failed([item["seq"] for item in batch], e):
+                    return
+                raise
+            # Une ligne fautive dans le lot : envoi un par un pour l'isoler
+            for item in batch:
+                self._replay_batch(client, [item])
+            return
+        except httpx.TransportError as e:
+            self._failed([item["seq"] for item in batch], e)
+            raise
+        for item, part in zip(batch, rows):
+            # Personne n'attend le rejeu : des lignes déjà présentes sont signalées en conflit
+            report = self._report(table, part, data, on_conflict)
+            self._mark([item["seq"]], CONFLIT if report else ENVOYE, report)
+
+    def _send(self, client, table: str, rows: List[Dict[str, Any]], on_conflict: str) -> List[Dict[str, Any]]:
+        data = data_access.upsert_rows(client, table, rows, on_conflict=on_conflict, ignore_duplicates=True)
+        self.offline_since = None
+        return data
+
+    def _client_for(self, user_id: Optional[str]):
+        # Jeton de l'auteur de l'écriture (RLS), frappé au moment du rejeu
+        if self.token_factory is not None and user_id:
+            self.client.set_bearer(self.token_factory(user_id))
+        return self.client
+
+    # --- États ---
+    def _failed(self, seqs: List[int], e: Exception) -> bool:
+        """Note l'échec ; True si l'écriture est mise de côté définitivement."""
+        status = _permanent(e) if isinstance(e, APIError) else None
+        message = _message(e)
+        if status is None:
+            self.offline_since = self.offline_since or time.time()
+            # Réservation levée : l'écriture repart avec le rejeu
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    "UPDATE file_ecritures SET statut = ?, tentatives = tentatives + 1, erreur = ? WHERE seq = ?",
+                    [(EN_ATTENTE, message, s) for s in seqs],
+                )
+            return False
+        self._mark(seqs, status, message)
+        return True
+
+    def _report(self, table: str, rows, data, on_conflict: str) -> Optional[str]:
+        if on_conflict == IDEMPOTENCY_COLUMN:
+            return None
+        # Clé métier : les lignes non renvoyées existaient déjà
+        keys = [c.strip() for c in on_conflict.split(",")]
+        created = {tuple(str(r.get(k)) for k in keys) for r in data}
+        existing = [r for r in rows if tuple(str(r.get(k)) for k in keys) not in created]
+        return f"{len(existing)} ligne(s) déjà existante(s) dans {table}" if existing else None
+
+    def _mark(self, seqs: List[int], status: str, message: Optional[str] = None) -> None:
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE file_ecritures SET statut = ?, erreur = ?, envoye_le = ? WHERE seq = ?",
+                [(status, message, _now() if status == ENVOYE else None, s) for s in seqs],
+            )
+
+    def _status(self, seq: int) -> str:
+        with self.lock:
+            return self.conn.execute("SELECT statut FROM file_ecritures WHERE seq = ?", (seq,)).fetchone()[0]
+
+    def online(self) -> bool:
+        return self.offline_since is None or time.time() - self.offline_since >= self.retry_delay
+
+    def pending(self, table: Optional[str] = None) -> int:
+        sql, params = "SELECT count(*) FROM file_ecritures WHERE statut = ?", [EN_ATTENTE]
+        if table:
+            sql, params = sql + " AND table_cible = ?", params + [table]
+        with self.lock:
+            return self.conn.execute(sql, params).fetchone()[0]
+
+    def problems(self, table: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Écritures mises de côté (conflit, erreur), à examiner par un opérateur."""
+        sql, params = "SELECT * FROM file_ecritures WHERE statut IN (?, ?)", [CONFLIT, ERREUR]
+        if table:
+            sql, params = sql + " AND table_cible = ?", params + [table]
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(sql + " ORDER BY seq", params)]
+
+    def dismiss(self, seq: int) -> None:
+        self._mark([seq], IGNORE, None)
+
+
+# --- File du processus ---
+_queue: Optional[WriteQueue] = None
+_lock = threading.Lock()
+
+
+def start(path: str = DEFAULT_PATH, client=None, **kwargs) -> WriteQueue:
+    """Ouvre (une fois par processus) la file d'écritures et démarre son thread de rejeu."""
+    global _queue
+    with _lock:
+        if _queue is None:
+            _queue = WriteQueue(path, client, **kwargs)
+        return _queue.start()